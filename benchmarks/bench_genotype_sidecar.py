@@ -0,0 +1,87 @@
+"""
+Compares counting the carriers of a sample subset from [%GT,] text, as
+printed by bcftools query --samples, against the 2 bit packed rows of the
+genotype sidecar, on synthetic biallelic records.
+
+Run from the repository root;
+
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/bench_genotype_sidecar.py
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/bench_genotype_sidecar.py \
+        --records 2000 --samples 100000 --subset 0.01
+"""
+import argparse
+import time
+
+import numpy as np
+
+from shared.utils.genotypes import GenotypeCounts, PackedGenotypeCounts, allele_matrix
+from shared.utils.site_index import pack_rows, select_samples
+
+
+def synthetic_records(records, samples, frequency):
+    rng = np.random.default_rng(0)
+    matrices = (rng.random((records, samples, 2)) < frequency).astype(np.int8)
+    missing = rng.random((records, samples)) < 0.01
+    matrices[missing] = -1
+    return matrices
+
+
+def gt_text(matrix, sample_indexes):
+    # bcftools query --samples prints the chosen samples only
+    return "".join(
+        "./.," if matrix[n, 0] < 0 else f"{matrix[n, 0]}|{matrix[n, 1]},"
+        for n in sample_indexes
+    ).encode()
+
+
+def packed_rows(matrix):
+    called = np.count_nonzero(matrix >= 0, axis=1)
+    copies = np.count_nonzero(matrix == 1, axis=1)
+    return pack_rows(np.vstack([called, copies]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--subset", type=float, default=0.1)
+    parser.add_argument("--frequency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    matrices = synthetic_records(args.records, args.samples, args.frequency)
+    rng = np.random.default_rng(1)
+    sample_indexes = np.sort(
+        rng.choice(args.samples, int(args.samples * args.subset), replace=False)
+    )
+    texts = [gt_text(matrix, sample_indexes) for matrix in matrices]
+    rows = [packed_rows(matrix) for matrix in matrices]
+
+    start = time.perf_counter()
+    expected = [
+        (counts.call_count, counts.total_count, counts.carriers)
+        for counts in (GenotypeCounts(allele_matrix(text), [0]) for text in texts)
+    ]
+    text_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    packed = [
+        (counts.call_count, counts.total_count, counts.carriers)
+        for counts in (
+            PackedGenotypeCounts(select_samples(record, sample_indexes), [0])
+            for record in rows
+        )
+    ]
+    packed_seconds = time.perf_counter() - start
+    assert packed == expected
+
+    text_bytes = sum(map(len, texts))
+    packed_bytes = sum(record.nbytes for record in rows)
+    print(f"[%GT,] text  {text_bytes:>12} bytes, counted in {text_seconds * 1000:.1f} ms")
+    print(
+        f"packed rows  {packed_bytes:>12} bytes, counted in {packed_seconds * 1000:.1f} ms"
+    )
+    print(f"{text_seconds / packed_seconds:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
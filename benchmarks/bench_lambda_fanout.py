@@ -0,0 +1,121 @@
+"""
+Load tests the lambda fan out of shared.utils.AsyncLambdaClient against
+benchmarks/stub_lambda.py, comparing the async engine with the blocking
+thread pool it falls back to, and the tail latency with and without
+hedging when some invocations straggle.
+
+Run from the repository root;
+
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/bench_lambda_fanout.py
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/bench_lambda_fanout.py \
+        --invocations 1000 --slow-fraction 0.02 --hedge-percentiles 0 95
+"""
+import argparse
+import asyncio
+import os
+import resource
+import threading
+import time
+
+from stub_lambda import StubLambda
+
+# the stub does not check signatures
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+
+from shared.utils.async_lambda import AsyncLambdaClient
+from shared.utils.concurrency_limiter import lambda_limiter
+
+
+def start_stub(port, latency, throttle_above=None, slow_fraction=0, slow_latency=5):
+    stub = StubLambda(
+        latency,
+        throttle_above=throttle_above,
+        slow_fraction=slow_fraction,
+        slow_latency=slow_latency,
+    )
+    started = threading.Event()
+    threading.Thread(
+        target=lambda: asyncio.run(stub.serve(port=port, started=started)),
+        daemon=True,
+    ).start()
+    started.wait()
+    return stub
+
+
+def percentile(values, q):
+    return sorted(values)[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+def run(engine, stub, port, invocations, concurrency, hedge_percentile=None):
+    client = AsyncLambdaClient(engine=engine, endpoint_url=f"http://127.0.0.1:{port}")
+    payloads = ["{}"] * invocations
+    if hedge_percentile:
+        # latencies the hedging delay is learned from
+        for _ in client.stream("stub", ["{}"] * 200, concurrency):
+            pass
+    stub.peak_in_flight = 0
+    stub.throttles = 0
+    invoked = stub.invocations
+    peak_threads = threading.active_count()
+
+    start = time.perf_counter()
+    latencies = []
+    for n, response, seconds in client.stream(
+        "stub", payloads, concurrency, hedge_percentile=hedge_percentile
+    ):
+        assert response == stub.response
+        latencies.append(seconds)
+        peak_threads = max(peak_threads, threading.active_count())
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    print(
+        f"{engine:>8} hedge p{hedge_percentile or '-'}: "
+        f"{len(latencies)} invocations in {elapsed:.2f}s "
+        f"({len(latencies) / elapsed:.0f}/s), peak in flight {stub.peak_in_flight}, "
+        f"peak threads {peak_threads}, "
+        f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB, "
+        f"throttled {stub.throttles}, "
+        f"duplicates {stub.invocations - invoked - len(latencies)}, "
+        f"latency p50 {percentile(latencies, 50):.2f}s "
+        f"p99 {percentile(latencies, 99):.2f}s max {max(latencies):.2f}s"
+    )
+    lambda_limiter.log_metrics("stub")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--invocations", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--engines", nargs="+", default=["async", "threads"])
+    parser.add_argument("--throttle-above", type=int, default=None)
+    parser.add_argument("--slow-fraction", type=float, default=0)
+    parser.add_argument("--slow-latency", type=float, default=5)
+    parser.add_argument("--hedge-percentiles", type=float, nargs="+", default=[0])
+    args = parser.parse_args()
+
+    stub = start_stub(
+        args.port,
+        args.latency,
+        args.throttle_above,
+        args.slow_fraction,
+        args.slow_latency,
+    )
+    for engine in args.engines:
+        for hedge_percentile in args.hedge_percentiles:
+            run(
+                engine,
+                stub,
+                args.port,
+                args.invocations,
+                args.concurrency,
+                hedge_percentile,
+            )
+
+
+if __name__ == "__main__":
+    main()
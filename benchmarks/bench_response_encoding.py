@@ -0,0 +1,126 @@
+"""
+Compares the size and decoding time of record level performQuery responses
+sent as PerformQueryResponse json and in the columnar encoding of
+shared.payloads.compact_responses, on synthetic variants and samples.
+
+Run from the repository root;
+
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/bench_response_encoding.py
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/bench_response_encoding.py \
+        --variants 50000 --samples 2500 --carriers 0.05
+"""
+import argparse
+import json
+import random
+import time
+from typing import List
+
+import jsons
+
+from shared.payloads import PerformQueryResponse, decode_responses, encode_responses
+
+
+def synthetic_responses(regions, variants, samples, carriers):
+    random.seed(0)
+    names = [f"SAMPLE{n:06d}" for n in range(samples)]
+    responses = []
+    for region in range(regions):
+        position = region * 1000000
+        region_variants = []
+        for _ in range(variants // regions):
+            position += random.randint(1, 200)
+            reference, alternate = random.sample("ACGT", 2)
+            region_variants.append((position, reference, alternate, "SNP"))
+        responses.append(
+            {
+                "dataset_id": "dataset",
+                "exists": True,
+                "all_alleles_count": 2 * samples * len(region_variants),
+                "call_count": len(region_variants),
+                "chromosome": "1",
+                "variants": region_variants,
+                "sample_indexes": sorted(
+                    random.sample(range(samples), int(samples * carriers))
+                ),
+            }
+        )
+    return responses, names
+
+
+def plain(responses, names):
+    # as returned by perform_query without response_encoding
+    return [
+        {
+            "dataset_id": response["dataset_id"],
+            "exists": response["exists"],
+            "all_alleles_count": response["all_alleles_count"],
+            "variants": [
+                f"{response['chromosome']}\t{position}\t{reference}\t{alternate}\t{variant_type}"
+                for position, reference, alternate, variant_type in response["variants"]
+            ],
+            "call_count": response["call_count"],
+            "sample_names": [names[n] for n in response["sample_indexes"]],
+        }
+        for response in responses
+    ]
+
+
+def timed(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = function()
+    return result, (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--variants", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=2500)
+    parser.add_argument("--carriers", type=float, default=0.2)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    responses, names = synthetic_responses(
+        args.regions, args.variants, args.samples, args.carriers
+    )
+    body = json.dumps(plain(responses, names))
+    compact = json.dumps(encode_responses(responses, names))
+
+    expected, jsons_seconds = timed(
+        lambda: jsons.default_list_deserializer(
+            json.loads(body), List[PerformQueryResponse]
+        ),
+        args.repeats,
+    )
+    # boolean and count queries only read the counts
+    _, counts_seconds = timed(
+        lambda: [
+            (response.exists, response.call_count)
+            for response in decode_responses([json.loads(compact)])
+        ],
+        args.repeats,
+    )
+    # record queries format the variants and sample names
+    decoded, records_seconds = timed(
+        lambda: [
+            (response, response.variants, response.sample_names)
+            for response in decode_responses([json.loads(compact)])
+        ],
+        args.repeats,
+    )
+    for response, (other, variants, sample_names) in zip(expected, decoded):
+        assert response.variants == variants
+        assert response.sample_names == sample_names
+        assert response.call_count == other.call_count
+
+    print(f"json     {len(body):>10} bytes, decoded in {jsons_seconds * 1000:.1f} ms")
+    print(
+        f"columnar {len(compact):>10} bytes, decoded in {counts_seconds * 1000:.1f} ms "
+        f"reading counts, {records_seconds * 1000:.1f} ms reading records"
+    )
+    print(f"{len(body) / len(compact):.1f}x fewer bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Compares the compiled ALT matchers of shared.utils against the per record
+variant type ladder they replaced, on a synthetic stream of records.
+
+Run from the repository root;
+
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/bench_variant_matchers.py
+"""
+import argparse
+import random
+import re
+import time
+
+from shared.utils.variant_matchers import compile_matcher
+
+
+VARIANT_TYPES = ["SNP", "INDEL", "DEL", "INS", "DUP", "DUP:TANDEM", "CNV", "INV"]
+SYMBOLIC = ["<DEL>", "<INS>", "<DUP>", "<DUP:TANDEM>", "<CN0>", "<CN2>", "<INV>"]
+
+
+def legacy_hit_indexes(
+    vcf_reference,
+    vcf_all_alts,
+    alternate_bases,
+    variant_type,
+    variant_min_length,
+    variant_max_length,
+):
+    # copy of the ladder perform_query used to evaluate for every record
+    variant_prefix = f"<{variant_type}"
+    vcf_reference_length = len(vcf_reference)
+
+    if alternate_bases == "N" and variant_type is not None:
+        if variant_type == "DEL":
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if (
+                    (alt.startswith(variant_prefix) or alt == "<CN0>")
+                    if alt.startswith("<")
+                    else len(alt) < vcf_reference_length
+                )
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+        elif variant_type == "SNP":
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if len(alt) == vcf_reference_length
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+        elif variant_type == "INDEL":
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if len(alt) != vcf_reference_length
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+        elif variant_type == "INS":
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if (
+                    alt.startswith(variant_prefix)
+                    if alt.startswith("<")
+                    else len(alt) > vcf_reference_length
+                )
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+        elif variant_type == "DUP":
+            pattern = re.compile("({}){{2,}}".format(vcf_reference))
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if (
+                    (
+                        alt.startswith(variant_prefix)
+                        or (alt.startswith("<CN") and alt not in ("<CN0>", "<CN1>"))
+                    )
+                    if alt.startswith("<")
+                    else pattern.fullmatch(alt)
+                )
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+        elif variant_type == "DUP:TANDEM":
+            tandem = vcf_reference + vcf_reference
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if (
+                    (alt.startswith(variant_prefix) or alt == "<CN2>")
+                    if alt.startswith("<")
+                    else alt == tandem
+                )
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+        elif variant_type == "CNV":
+            pattern = re.compile("\\.|({})*".format(vcf_reference))
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if (
+                    (
+                        alt.startswith(variant_prefix)
+                        or alt.startswith("<CN")
+                        or alt.startswith("<DEL")
+                        or alt.startswith("<DUP")
+                    )
+                    if alt.startswith("<")
+                    else pattern.fullmatch(alt)
+                )
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+        else:
+            hit_indexes = [
+                i
+                for i, alt in enumerate(vcf_all_alts)
+                if alt.startswith(variant_prefix)
+                and variant_min_length <= len(alt) <= variant_max_length
+            ]
+    elif alternate_bases == "N":
+        hit_indexes = [
+            i
+            for i, alt in enumerate(vcf_all_alts)
+            if variant_min_length <= len(alt) <= variant_max_length
+        ]
+    else:
+        hit_indexes = [
+            i
+            for i, alt in enumerate(vcf_all_alts)
+            if alt.upper() == alternate_bases
+            and variant_min_length <= len(alt) <= variant_max_length
+        ]
+
+    return hit_indexes
+
+
+def synthetic_records(count, seed):
+    """(REF, ALTs) of a dense region, mostly SNPs with some indels and SVs"""
+    rng = random.Random(seed)
+    # a dense region repeats a limited set of REF alleles
+    references = ["".join(rng.choices("ACGT", k=rng.choice([1, 1, 1, 2, 3]))) for _ in range(64)]
+    records = []
+
+    for _ in range(count):
+        reference = rng.choice(references)
+        alts = []
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            kind = rng.random()
+            if kind < 0.8:
+                alts.append(rng.choice("ACGT") * len(reference))
+            elif kind < 0.9:
+                alts.append(reference + "".join(rng.choices("ACGT", k=rng.randint(1, 4))))
+            elif kind < 0.95:
+                alts.append(reference * rng.randint(2, 3))
+            else:
+                alts.append(rng.choice(SYMBOLIC))
+        records.append((reference, alts))
+
+    return records
+
+
+def run(label, records, hit_indexes):
+    start = time.perf_counter()
+    hits = [hit_indexes(reference, alts) for reference, alts in records]
+    elapsed = time.perf_counter() - start
+    print(f"{label:>10}: {elapsed:.3f}s")
+    return hits, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    records = synthetic_records(args.records, args.seed)
+    queries = [("N", variant_type, 0, float("inf")) for variant_type in VARIANT_TYPES]
+    queries += [("N", None, 0, 2), ("G", "SNP", 0, float("inf"))]
+
+    for alternate_bases, variant_type, min_length, max_length in queries:
+        print(f"alt={alternate_bases} type={variant_type} length={min_length}-{max_length}")
+        legacy, legacy_elapsed = run(
+            "ladder",
+            records,
+            lambda reference, alts: legacy_hit_indexes(
+                reference, alts, alternate_bases, variant_type, min_length, max_length
+            ),
+        )
+        match = compile_matcher(alternate_bases, variant_type, min_length, max_length)
+        compiled, compiled_elapsed = run(
+            "compiled",
+            records,
+            lambda reference, alts: [
+                i for i, alt in enumerate(alts) if match(reference, alt)
+            ],
+        )
+        assert legacy == compiled, "compiled matcher disagrees with the ladder"
+        print(f"{'speedup':>10}: {legacy_elapsed / compiled_elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Checks that splitQuery delegates any number of payloads through a tree in
+which no invocation sends more than the fan-out width of invocations, and
+whose depth is the smallest that fits them, including at exact powers of
+the width.
+
+Run from the repository root;
+
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/check_fanout_tree.py
+    $ PYTHONPATH=shared_resources/python-modules/python python benchmarks/check_fanout_tree.py \
+        --max-payloads 100000 --widths 2 5 6 10
+"""
+import argparse
+import importlib.util
+import math
+import os
+
+# modules read their configuration from the lambda environment on import
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("BEACON_DEFAULT_GRANULARITY", "boolean")
+os.environ.setdefault("BEACON_API_VERSION", "v2.0.0")
+os.environ.setdefault("BEACON_ENABLE_AUTH", "false")
+os.environ.setdefault("CONFIG_MAX_VARIANT_SEARCH_BASE_RANGE", "5000000")
+os.environ.setdefault("PERFORM_QUERY_LAMBDA", "performQuery")
+os.environ.setdefault("SPLIT_QUERY_TOPIC_ARN", "splitQuery")
+for table in [
+    "DATASETS",
+    "ONTOLOGIES",
+    "DESCENDANTS",
+    "ANSCESTORS",
+    "TERM_LABELS",
+    "VARIANT_QUERIES",
+    "VARIANT_QUERY_RESPONSES",
+    "VCF_SUMMARIES",
+]:
+    os.environ.setdefault(f"DYNAMO_{table}_TABLE", table)
+
+spec = importlib.util.spec_from_file_location(
+    "split_query", "lambda/splitQuery/lambda_function.py"
+)
+split_query = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(split_query)
+
+
+def tree(payloads, width):
+    """(widest fan-out, depth) of the invocations delegating payloads"""
+    delegated = split_query.delegation_width(payloads, width)
+    if delegated == 1:
+        return payloads, 1
+    # the same chunks as split_query
+    size = math.ceil(payloads / delegated)
+    subtrees = [
+        tree(min(size, payloads - start), width)
+        for start in range(0, payloads, size)
+    ]
+    return (
+        max(len(subtrees), *(fan_out for fan_out, _ in subtrees)),
+        1 + max(depth for _, depth in subtrees),
+    )
+
+
+def smallest_depth(payloads, width):
+    depth = 1
+    while width**depth < payloads:
+        depth += 1
+    return depth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--max-payloads", type=int, default=20000)
+    parser.add_argument("--widths", type=int, nargs="+", default=[2, 3, 5, 6, 10])
+    args = parser.parse_args()
+
+    failures = 0
+    for width in args.widths:
+        powers = set()
+        power = width
+        while power <= args.max_payloads:
+            powers.update((power - 1, power, power + 1))
+            power *= width
+        # every count up to a few levels, then around each power of width
+        counts = sorted(set(range(1, min(args.max_payloads, width**3) + 1)) | powers)
+        for payloads in counts:
+            fan_out, depth = tree(payloads, width)
+            if fan_out > width or depth != smallest_depth(payloads, width):
+                failures += 1
+                print(
+                    f"width {width} payloads {payloads}: "
+                    f"fan-out {fan_out} depth {depth}"
+                )
+        print(f"width {width}: checked {len(counts)} payload counts")
+    if failures:
+        raise SystemExit(f"{failures} delegation trees exceed the fan-out bound")
+    print("All delegation trees are within the fan-out bound")
+
+
+if __name__ == "__main__":
+    main()
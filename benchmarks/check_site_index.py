@@ -0,0 +1,160 @@
+"""
+Checks that the site index answers boolean and count queries the same way
+performQuery does, on a local bgzipped and indexed VCF. The index is built
+by summariseVcf into an in-memory bucket, then random queries are answered
+by both and compared. Needs bcftools and tabix on the PATH.
+
+Run from the repository root;
+
+    $ PYTHONPATH=shared_resources/python-modules/python:lambda/performQuery python benchmarks/check_site_index.py
+    $ PYTHONPATH=shared_resources/python-modules/python:lambda/performQuery python benchmarks/check_site_index.py \
+        --vcf examples/test-data/chr1.vcf.gz --queries 1000
+"""
+import argparse
+import importlib.util
+import io
+import os
+import random
+
+# modules read their configuration from the lambda environment on import
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("BEACON_DEFAULT_GRANULARITY", "boolean")
+os.environ.setdefault("BEACON_API_VERSION", "v2.0.0")
+os.environ.setdefault("BEACON_ENABLE_AUTH", "false")
+os.environ.setdefault("CONFIG_MAX_VARIANT_SEARCH_BASE_RANGE", "5000000")
+os.environ.setdefault("CONFIG_VARIANT_SEARCH_SITE_INDEX", "true")
+os.environ.setdefault("CONFIG_VARIANT_SEARCH_GENOTYPE_SIDECAR", "false")
+os.environ.setdefault("ATHENA_METADATA_BUCKET", "check")
+for table in [
+    "DATASETS",
+    "ONTOLOGIES",
+    "DESCENDANTS",
+    "ANSCESTORS",
+    "TERM_LABELS",
+    "VARIANT_QUERIES",
+    "VARIANT_QUERY_RESPONSES",
+    "VCF_SUMMARIES",
+]:
+    os.environ.setdefault(f"DYNAMO_{table}_TABLE", table)
+
+from shared.utils import compile_matcher, get_vcf_chromosomes
+from shared.utils import site_index
+from query_engine import perform_query
+
+
+VARIANT_TYPES = [None, "SNP", "INDEL", "DEL", "INS", "DUP", "CNV"]
+
+
+class MemoryBucket:
+    """Just the calls site_index makes to S3"""
+
+    def __init__(self):
+        self.objects = dict()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else Body
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+
+def build_manifest(vcf_location):
+    spec = importlib.util.spec_from_file_location(
+        "summariseVcf", "lambda/summariseVcf/lambda_function.py"
+    )
+    summarise = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(summarise)
+
+    errored, error, contigs = get_vcf_chromosomes(vcf_location)
+    if errored:
+        raise RuntimeError(error)
+    results = {
+        contig: summarise.summarise_contig(vcf_location, contig) for contig in contigs
+    }
+    return {"bins": {contig: result.bins for contig, result in results.items()}}, {
+        contig: (result.first_position, result.last_position)
+        for contig, result in results.items()
+        if result.records
+    }
+
+
+def random_query(spans):
+    contig = random.choice(sorted(spans))
+    first, last = spans[contig]
+    start = random.randint(first - 100, last)
+    end = random.randint(start, last + 100)
+    reference_bases, alternate_bases = random.choice(
+        [("N", "N")] * 4 + [(random.choice("ACGT"), random.choice("ACGT"))]
+    )
+    return dict(
+        contig=contig,
+        start=start,
+        end=end,
+        reference_bases=reference_bases,
+        alternate_bases=alternate_bases,
+        variant_type=random.choice(VARIANT_TYPES),
+        requested_granularity=random.choice(["boolean", "count"]),
+        include_details=random.random() < 0.5,
+    )
+
+
+def answers(vcf_location, manifest, query):
+    response = perform_query(
+        {
+            "region": f"{query['contig']}:{query['start']}-{query['end']}",
+            "vcf_location": vcf_location,
+            "reference_bases": query["reference_bases"],
+            "alternate_bases": query["alternate_bases"],
+            "variant_type": query["variant_type"],
+            "requested_granularity": query["requested_granularity"],
+            "include_details": query["include_details"],
+        }
+    )
+    scanned = (
+        response["exists"],
+        response["call_count"],
+        response["all_alleles_count"],
+        response["variants"],
+    )
+    indexed = site_index.query_site_index(
+        vcf_location,
+        manifest,
+        query["contig"],
+        query["start"],
+        query["end"],
+        query["reference_bases"],
+        compile_matcher(query["alternate_bases"], query["variant_type"], 0, float("inf")),
+        boolean=query["requested_granularity"] == "boolean",
+        include_details=query["include_details"],
+    )
+    return scanned, tuple(indexed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--vcf", default="examples/test-data/chr1.vcf.gz")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # bcftools and tabix run in /tmp
+    vcf_location = os.path.abspath(args.vcf)
+    site_index.s3 = MemoryBucket()
+    manifest, spans = build_manifest(vcf_location)
+    mismatches = 0
+
+    for _ in range(args.queries):
+        query = random_query(spans)
+        scanned, indexed = answers(vcf_location, manifest, query)
+        if scanned != indexed:
+            mismatches += 1
+            print(f"MISMATCH {query}\n  performQuery {scanned}\n  site index   {indexed}")
+
+    print(f"{args.queries - mismatches} of {args.queries} queries agree")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
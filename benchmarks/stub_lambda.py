@@ -0,0 +1,112 @@
+"""
+Stand-in for the Lambda Invoke API, answering every invocation with a
+fixed payload after a fixed delay. Used to load test the fan out of
+shared.utils.AsyncLambdaClient without deploying anything.
+
+Run from the repository root;
+
+    $ python benchmarks/stub_lambda.py --port 9001 --latency 0.5
+
+and point the invoking code at it with LAMBDA_ENDPOINT_URL=http://127.0.0.1:9001
+"""
+import argparse
+import asyncio
+import random
+
+
+class StubLambda:
+    def __init__(
+        self,
+        latency=0.5,
+        response=b"[]",
+        throttle_above=None,
+        slow_fraction=0,
+        slow_latency=5,
+    ):
+        self.latency = latency
+        self.response = response
+        # stragglers such as cold starts or slow S3 reads
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        # invocations in flight beyond this are throttled, like an account
+        # running out of concurrency
+        self.throttle_above = throttle_above
+        self.throttles = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.invocations = 0
+
+    async def handle(self, reader, writer):
+        # keep-alive connections carry several invocations
+        try:
+            while request_line := await reader.readline():
+                length = 0
+                while (header := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = header.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                if not request_line.startswith(b"POST "):
+                    writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                    continue
+
+                if self.throttle_above is not None and self.in_flight >= self.throttle_above:
+                    self.throttles += 1
+                    writer.write(
+                        b"HTTP/1.1 429 Too Many Requests\r\n"
+                        b"x-amzn-ErrorType: TooManyRequestsException\r\n"
+                        b"Content-Length: 0\r\n\r\n"
+                    )
+                    await writer.drain()
+                    continue
+
+                self.invocations += 1
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                slow = random.random() < self.slow_fraction
+                await asyncio.sleep(self.slow_latency if slow else self.latency)
+                self.in_flight -= 1
+
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(self.response)}\r\n\r\n".encode()
+                    + self.response
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=9001, started=None):
+        server = await asyncio.start_server(self.handle, host, port, backlog=4096)
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--response", default="[]")
+    parser.add_argument("--throttle-above", type=int, default=None)
+    parser.add_argument("--slow-fraction", type=float, default=0)
+    parser.add_argument("--slow-latency", type=float, default=5)
+    args = parser.parse_args()
+
+    stub = StubLambda(
+        args.latency,
+        args.response.encode(),
+        args.throttle_above,
+        args.slow_fraction,
+        args.slow_latency,
+    )
+    asyncio.run(stub.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
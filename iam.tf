@@ -45,7 +45,10 @@ data "aws_iam_policy_document" "lambda-submitDataset" {
     actions = [
       "lambda:InvokeFunction",
     ]
-    resources = [module.lambda-indexer.lambda_function_arn]
+    resources = [
+      module.lambda-indexer.lambda_function_arn,
+      module.lambda-summariseVcf.lambda_function_arn,
+    ]
   }
 }
 
@@ -148,7 +151,8 @@ data "aws_iam_policy_document" "lambda-getAnalyses" {
     resources = [
       aws_dynamodb_table.datasets.arn,
       aws_dynamodb_table.variant_queries.arn,
-      aws_dynamodb_table.variant_query_responses.arn
+      aws_dynamodb_table.variant_query_responses.arn,
+      aws_dynamodb_table.vcf_summaries.arn
     ]
   }
 
@@ -212,7 +216,8 @@ data "aws_iam_policy_document" "lambda-getGenomicVariants" {
     resources = [
       aws_dynamodb_table.datasets.arn,
       aws_dynamodb_table.variant_queries.arn,
-      aws_dynamodb_table.variant_query_responses.arn
+      aws_dynamodb_table.variant_query_responses.arn,
+      aws_dynamodb_table.vcf_summaries.arn
     ]
   }
 
@@ -274,7 +279,8 @@ data "aws_iam_policy_document" "lambda-getIndividuals" {
     resources = [
       aws_dynamodb_table.datasets.arn,
       aws_dynamodb_table.variant_queries.arn,
-      aws_dynamodb_table.variant_query_responses.arn
+      aws_dynamodb_table.variant_query_responses.arn,
+      aws_dynamodb_table.vcf_summaries.arn
     ]
   }
 
@@ -336,7 +342,8 @@ data "aws_iam_policy_document" "lambda-getBiosamples" {
     resources = [
       aws_dynamodb_table.datasets.arn,
       aws_dynamodb_table.variant_queries.arn,
-      aws_dynamodb_table.variant_query_responses.arn
+      aws_dynamodb_table.variant_query_responses.arn,
+      aws_dynamodb_table.vcf_summaries.arn
     ]
   }
 
@@ -398,7 +405,8 @@ data "aws_iam_policy_document" "lambda-getDatasets" {
     resources = [
       aws_dynamodb_table.datasets.arn,
       aws_dynamodb_table.variant_queries.arn,
-      aws_dynamodb_table.variant_query_responses.arn
+      aws_dynamodb_table.variant_query_responses.arn,
+      aws_dynamodb_table.vcf_summaries.arn
     ]
   }
 
@@ -460,7 +468,8 @@ data "aws_iam_policy_document" "lambda-getCohorts" {
     resources = [
       aws_dynamodb_table.datasets.arn,
       aws_dynamodb_table.variant_queries.arn,
-      aws_dynamodb_table.variant_query_responses.arn
+      aws_dynamodb_table.variant_query_responses.arn,
+      aws_dynamodb_table.vcf_summaries.arn
     ]
   }
 
@@ -506,7 +515,8 @@ data "aws_iam_policy_document" "lambda-getRuns" {
     resources = [
       aws_dynamodb_table.datasets.arn,
       aws_dynamodb_table.variant_queries.arn,
-      aws_dynamodb_table.variant_query_responses.arn
+      aws_dynamodb_table.variant_query_responses.arn,
+      aws_dynamodb_table.vcf_summaries.arn
     ]
   }
 
@@ -546,6 +556,26 @@ data "aws_iam_policy_document" "lambda-analytics" {
     resources = [module.lambda-splitQuery.lambda_function_arn]
   }
 
+  statement {
+    actions = [
+      "dynamodb:UpdateItem",
+    ]
+    resources = [
+      aws_dynamodb_table.variant_queries.arn,
+    ]
+  }
+
+  statement {
+    actions = [
+      "dynamodb:DescribeTable",
+      "dynamodb:GetItem",
+      "dynamodb:BatchGetItem",
+    ]
+    resources = [
+      aws_dynamodb_table.vcf_summaries.arn,
+    ]
+  }
+
   statement {
     actions = [
       "SNS:Publish",
@@ -565,6 +595,50 @@ data "aws_iam_policy_document" "lambda-analytics" {
   }
 }
 
+#
+# summariseVcf Lambda Function
+#
+data "aws_iam_policy_document" "lambda-summariseVcf" {
+  statement {
+    actions = [
+      "s3:GetObject",
+      "s3:ListBucket",
+    ]
+    resources = ["*"]
+  }
+
+  statement {
+    actions = [
+      "dynamodb:DescribeTable",
+      "dynamodb:PutItem",
+      "dynamodb:UpdateItem",
+    ]
+    resources = [
+      aws_dynamodb_table.vcf_summaries.arn,
+    ]
+  }
+
+  statement {
+    actions = [
+      "s3:PutObject",
+    ]
+    resources = [
+      "${aws_s3_bucket.metadata-bucket.arn}/site-index/*",
+    ]
+  }
+
+  statement {
+    actions = [
+      "lambda:InvokeFunction",
+    ]
+    resources = [
+      # contigs are summarised by further summariseVcf invocations, the arn
+      # is built as the function depends on this policy
+      "arn:aws:lambda:${var.region}:${data.aws_caller_identity.this.account_id}:function:summariseVcf",
+    ]
+  }
+}
+
 #
 # indexer Lambda Function
 #
@@ -587,7 +661,31 @@ data "aws_iam_policy_document" "lambda-splitQuery" {
     actions = [
       "lambda:InvokeFunction",
     ]
-    resources = [module.lambda-performQuery.lambda_function_arn]
+    resources = [
+      module.lambda-performQuery.lambda_function_arn,
+      # large chunks are delegated to further splitQuery invocations, the
+      # arn is built as the function depends on this policy
+      "arn:aws:lambda:${var.region}:${data.aws_caller_identity.this.account_id}:function:splitQuery",
+    ]
+  }
+
+  statement {
+    actions = [
+      "dynamodb:DescribeTable",
+      "dynamodb:GetItem",
+    ]
+    resources = [
+      aws_dynamodb_table.variant_queries.arn,
+    ]
+  }
+
+  statement {
+    actions = [
+      "s3:PutObject",
+    ]
+    resources = [
+      "${aws_s3_bucket.metadata-bucket.arn}/query-spill/*",
+    ]
   }
 
   statement {
@@ -58,6 +58,9 @@ pip install pydantic==2.0.2 --target layers/python_libraries/python
 pip install pyhumps==3.8.0 --target layers/python_libraries/python
 pip install pynamodb==6.1.0 --target layers/python_libraries/python
 pip install pyorc==0.9.0 --target layers/python_libraries/python
+pip install pysam==0.22.1 --target layers/python_libraries/python
+pip install numpy==1.26.4 --target layers/python_libraries/python
+pip install aiohttp==3.9.5 --target layers/python_libraries/python
 pip install requests==2.31.0 --target layers/python_libraries/python
 pip install smart_open==7.0.4 --target layers/python_libraries/python
 pip install strenum==0.4.15 --target layers/python_libraries/python
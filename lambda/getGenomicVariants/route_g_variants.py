@@ -104,6 +104,8 @@ def route(request: RequestParams):
 
         if exists:
             if request.query.requested_granularity == "boolean":
+                # stops the outstanding splitQuery and performQuery work
+                query_responses.close()
                 break
             if check_all:
                 variants.update(query_response.variants)
@@ -107,6 +107,8 @@ def route(request: RequestParams, variant_id):
 
         if exists:
             if request.query.requested_granularity == Granularity.BOOLEAN:
+                # stops the outstanding splitQuery and performQuery work
+                query_responses.close()
                 break
             variants.update(query_response.variants)
 
@@ -165,6 +165,8 @@ def route(request: RequestParams, variant_id):
 
         if query_response.exists:
             if request.query.requested_granularity == "boolean":
+                # stops the outstanding splitQuery and performQuery work
+                query_responses.close()
                 break
             dataset_samples[query_response.dataset_id].update(
                 sorted(query_response.sample_names)
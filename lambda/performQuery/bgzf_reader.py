@@ -0,0 +1,227 @@
+from collections import OrderedDict
+import os
+import struct
+import zlib
+
+import boto3
+
+from shared.utils import parse_s3_url
+from shared.utils.tabix_index import TabixIndex
+from index_cache import index_cache
+from readers import LruCache, TextReader
+
+
+# compressed bytes held in memory across warm invocations
+BLOCK_CACHE_MAX_BYTES = int(
+    os.environ.get("BLOCK_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+# bytes fetched by a single range read on a cache miss
+READ_AHEAD_BYTES = int(os.environ.get("BGZF_READ_AHEAD_BYTES", 1024 * 1024))
+BGZF_HEADER = struct.Struct("<4BI2BH2BHH")
+
+
+s3 = boto3.client("s3")
+
+
+class BlockCache:
+    """
+    Read-through LRU cache of compressed BGZF blocks keyed by
+    (file, etag, compressed offset). Shared by every reader in the container
+    so neighbouring regions reuse blocks that were already fetched.
+    """
+
+    def __init__(self, max_bytes=BLOCK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.blocks = OrderedDict()
+
+    def get(self, key):
+        block = self.blocks.get(key)
+        if block is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.blocks.move_to_end(key)
+        return block
+
+    def put(self, key, block):
+        if key in self.blocks:
+            return
+        self.blocks[key] = block
+        self.size += len(block)
+        while self.size > self.max_bytes and self.blocks:
+            _, evicted = self.blocks.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "blocks": len(self.blocks),
+            "bytes": self.size,
+        }
+
+
+block_cache = BlockCache()
+# (vcf, etag) -> VcfHeader
+headers = LruCache()
+# local index path -> TabixIndex
+indexes = {}
+
+
+def block_size(data, offset):
+    (*_, si1, si2, _, bsize) = BGZF_HEADER.unpack_from(data, offset)
+    if si1 != 66 or si2 != 67:
+        raise ValueError("Not a BGZF block")
+    return bsize + 1
+
+
+class BgzfFile:
+    def __init__(self, vcf_location, etag, cache=block_cache):
+        self.bucket, self.key = parse_s3_url(vcf_location)
+        self.file_key = (vcf_location, etag)
+        self.cache = cache
+
+    def compressed_block(self, coffset):
+        block = self.cache.get((*self.file_key, coffset))
+        if block is not None:
+            return block
+
+        response = s3.get_object(
+            Bucket=self.bucket,
+            Key=self.key,
+            Range=f"bytes={coffset}-{coffset + READ_AHEAD_BYTES - 1}",
+        )
+        data = response["Body"].read()
+        # split the range into blocks, the first one is the requested one
+        offset = 0
+        while offset + BGZF_HEADER.size <= len(data):
+            size = block_size(data, offset)
+            if offset + size > len(data):
+                break
+            self.cache.put((*self.file_key, coffset + offset), data[offset : offset + size])
+            offset += size
+
+        return data[: block_size(data, 0)]
+
+    def block(self, coffset):
+        """Decompressed data and compressed size of the block at coffset"""
+        block = self.compressed_block(coffset)
+        # skip the 18 byte header and the 8 byte CRC32/ISIZE footer
+        return zlib.decompress(block[18:-8], -15), len(block)
+
+    def read(self, vbeg, vend):
+        """Decompressed bytes between two virtual offsets"""
+        coffset, uoffset = vbeg >> 16, vbeg & 0xFFFF
+        cend, uend = vend >> 16, vend & 0xFFFF
+        parts = []
+
+        while coffset < cend or (coffset == cend and uend):
+            data, size = self.block(coffset)
+            # empty block marks the end of the file
+            if not data:
+                break
+            parts.append(data[uoffset : uend if coffset == cend else None])
+            coffset += size
+            uoffset = 0
+
+        return b"".join(parts)
+
+    def lines(self, vbeg, vend):
+        for line in self.read(vbeg, vend).split(b"\n"):
+            if line:
+                yield line.decode()
+
+
+class VcfHeader:
+    def __init__(self, samples):
+        self.samples = samples
+        self.sample_index = {sample: n for n, sample in enumerate(samples)}
+
+
+def read_header(bgzf_file):
+    if (header := headers.get(bgzf_file.file_key)) is not None:
+        return header
+
+    coffset = 0
+    pending = ""
+    while True:
+        data, size = bgzf_file.block(coffset)
+        if not data:
+            raise ValueError("VCF header has no #CHROM line")
+        pending += data.decode()
+        if (start := pending.find("#CHROM")) >= 0 and (
+            end := pending.find("\n", start)
+        ) >= 0:
+            break
+        coffset += size
+
+    header = VcfHeader(pending[start:end].rstrip("\r").split("\t")[9:])
+    headers.put(bgzf_file.file_key, header)
+    return header
+
+
+class BgzfReader(TextReader):
+    """
+    In-process replacement of bcftools query. Records are read through the
+    block cache and parsed directly from the VCF text
+    """
+
+    def __init__(self, vcf_location, etag, index, samples=[]):
+        super().__init__()
+        self.bgzf_file = BgzfFile(vcf_location, etag)
+        self.index = index
+        header = read_header(self.bgzf_file)
+
+        if samples:
+            self.columns = sorted(header.sample_index[sample] for sample in samples)
+        else:
+            self.columns = list(range(len(header.samples)))
+        self.all_columns = len(self.columns) == len(header.samples)
+        self.samples = [header.samples[n] for n in self.columns]
+
+    @classmethod
+    def open(cls, vcf_location, samples=[]):
+        """None if the VCF cannot be read in-process"""
+        etag, index_path = index_cache.lookup(vcf_location)
+        if index_path is None:
+            return None
+        if (index := indexes.get(index_path)) is None:
+            index = indexes[index_path] = TabixIndex.load(index_path)
+        # parsed indexes are small, but drop ones evicted from disk
+        for path in [path for path in indexes if not os.path.exists(path)]:
+            del indexes[path]
+        return cls(vcf_location, etag, index, samples)
+
+    def records(self, regions):
+        for region in regions:
+            yield from self.region_records(region)
+
+    def region_records(self, region):
+        chromosome = region[: region.find(":")]
+        start = int(region[region.find(":") + 1 : region.find("-")])
+        end = int(region[region.find("-") + 1 :])
+
+        for vbeg, vend in self.index.chunks(chromosome, start, end):
+            for line in self.bgzf_file.lines(vbeg, vend):
+                fields = line.split("\t", 8)
+                if fields[0] != chromosome:
+                    continue
+                position = int(fields[1])
+                if position > end:
+                    return
+                elif position < start:
+                    continue
+                # same as [%GT,] of bcftools query
+                genotypes = ""
+                if len(fields) == 9 and fields[8].startswith("GT"):
+                    calls = fields[8].split("\t")[1:]
+                    if not self.all_columns:
+                        calls = [calls[n] for n in self.columns]
+                    genotypes = "".join(f"{call.split(':', 1)[0]}," for call in calls)
+                yield position, fields[3], fields[4].split(","), fields[7], genotypes
+
+    def stats(self):
+        return self.bgzf_file.cache.stats()
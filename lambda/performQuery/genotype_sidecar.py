@@ -0,0 +1,125 @@
+import json
+
+import boto3
+import botocore
+import numpy as np
+
+from shared.utils import ENV_ATHENA, ENV_CONFIG
+from shared.utils.genotypes import PackedGenotypeCounts
+from shared.utils.site_index import (
+    BIN_BASES,
+    GenotypeBin,
+    genotype_key,
+    genotype_samples_key,
+    select_samples,
+    site_indexes,
+)
+
+
+s3 = boto3.client("s3")
+# records are visited in position order, so their rows follow one another
+READ_AHEAD_BYTES = 1 << 20
+
+
+class SampleGenotypes:
+    """
+    Genotypes of the chosen samples of a vcf, read from the bins of its
+    genotype sidecar instead of bcftools. Bins are read with ranged gets,
+    the record index first and then the rows of hit records. Rows hold every
+    sample so they are read whole, only the chosen samples are decoded.
+    """
+
+    def __init__(self, vcf_location, contigs, all_samples, chosen_samples):
+        self.vcf_location = vcf_location
+        self.contigs = set(contigs)
+        chosen = set(chosen_samples)
+        # header order, same as bcftools query --samples
+        self.sample_indexes = np.array(
+            [n for n, sample in enumerate(all_samples) if not chosen or sample in chosen],
+            dtype=np.int64,
+        )
+        self.samples = [all_samples[n] for n in self.sample_indexes]
+        self.sample_count = len(all_samples)
+        # (contig, bin) -> GenotypeBin
+        self.bins = dict()
+
+    @classmethod
+    def open(cls, vcf_location, chosen_samples):
+        """None when vcf_location has no up to date genotype sidecar"""
+        if not ENV_CONFIG.CONFIG_VARIANT_SEARCH_GENOTYPE_SIDECAR:
+            return None
+        manifest = site_indexes.load([vcf_location]).get(vcf_location)
+        if manifest is None or not manifest.get("genotypes"):
+            return None
+
+        try:
+            body = s3.get_object(
+                Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+                Key=genotype_samples_key(vcf_location),
+            )["Body"].read()
+        except botocore.exceptions.ClientError as error:
+            print(f"Unable to read genotype samples of {vcf_location}\n", error)
+            return None
+        print(f"Reading genotypes from sidecar - {vcf_location}")
+        return cls(vcf_location, manifest["genotypes"], json.loads(body), chosen_samples)
+
+    def _bin(self, contig, bin):
+        key = (contig, bin)
+        if key not in self.bins:
+            try:
+                genotype_bin = GenotypeBin(
+                    RangedObject(genotype_key(self.vcf_location, contig, bin)).read
+                )
+            except (botocore.exceptions.ClientError, ValueError) as error:
+                print(f"Unable to read genotypes of {contig} bin {bin}\n", error)
+                genotype_bin = None
+            if (
+                genotype_bin is not None
+                and genotype_bin.sample_count != self.sample_count
+            ):
+                print(f"Genotype sidecar of {self.vcf_location} is corrupt")
+                genotype_bin = None
+            self.bins[key] = genotype_bin
+        return self.bins[key]
+
+    def counts(self, contig, position, reference, alts, hit_indexes):
+        """
+        PackedGenotypeCounts of the chosen samples for a record, None when
+        the sidecar does not have it and its genotypes must be read from the
+        vcf
+        """
+        if contig not in self.contigs:
+            return None
+        genotype_bin = self._bin(contig, position // BIN_BASES)
+        rows = None
+        if genotype_bin is not None:
+            rows = genotype_bin.rows(position, reference, alts)
+        if rows is None:
+            print(
+                f"No genotypes of {contig}:{position} {reference}>{','.join(alts)}"
+                f" in sidecar of {self.vcf_location}"
+            )
+            return None
+        return PackedGenotypeCounts(
+            select_samples(rows, self.sample_indexes), hit_indexes
+        )
+
+
+class RangedObject:
+    """Ranged gets of a sidecar object, keeping the last READ_AHEAD_BYTES read"""
+
+    def __init__(self, key):
+        self.key = key
+        self.start = 0
+        self.buffer = b""
+
+    def read(self, offset, size):
+        if not self.start <= offset <= offset + size <= self.start + len(self.buffer):
+            end = offset + max(size, READ_AHEAD_BYTES) - 1
+            self.buffer = s3.get_object(
+                Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+                Key=self.key,
+                Range=f"bytes={offset}-{end}",
+            )["Body"].read()
+            self.start = offset
+        return self.buffer[offset - self.start : offset - self.start + size]
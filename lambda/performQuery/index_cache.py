@@ -0,0 +1,117 @@
+import hashlib
+import os
+import uuid
+
+import boto3
+import botocore
+
+from shared.utils import preserve_tmp, parse_s3_url
+from shared.utils.vcf_text import INDEX_SUFFIXES
+
+
+INDEX_CACHE_DIR = "/tmp/index-cache"
+# ephemeral storage of performQuery is 1024 MB, leave room for bcftools
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("INDEX_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+s3 = boto3.client("s3")
+
+
+class IndexCache:
+    """
+    On-disk cache of tabix/CSI indexes kept in /tmp across warm invocations.
+    Entries are keyed by the VCF location and its ETag, so a replaced VCF
+    never reuses a stale index. Least recently used entries are evicted once
+    the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, directory=INDEX_CACHE_DIR, max_bytes=INDEX_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        preserve_tmp(directory)
+
+    def get(self, vcf_location):
+        """
+        Returns the local path of the index of vcf_location, downloading it
+        on a cache miss. None is returned when the index cannot be cached,
+        in which case htslib falls back to fetching the index itself.
+        """
+        return self.lookup(vcf_location)[1]
+
+    def lookup(self, vcf_location):
+        """Same as get, but also returns the ETag of the VCF"""
+        bucket, key = parse_s3_url(vcf_location)
+        if bucket is None:
+            return None, None
+
+        try:
+            etag = s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+        except botocore.exceptions.ClientError as error:
+            print(f"Unable to read ETag of {vcf_location}\n", error)
+            return None, None
+
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = hashlib.sha1(vcf_location.encode()).hexdigest()
+        stem = f"{prefix}.{hashlib.sha1(etag.encode()).hexdigest()[:16]}"
+
+        for suffix in INDEX_SUFFIXES:
+            path = os.path.join(self.directory, stem + suffix)
+            if os.path.isfile(path):
+                # bump the modified time, used as the LRU clock
+                os.utime(path)
+                print(f"Index cache hit - {vcf_location}")
+                return etag, path
+
+        # entries of an older version of this vcf are never used again
+        self._remove_prefix(prefix)
+
+        for suffix in INDEX_SUFFIXES:
+            try:
+                size = s3.head_object(Bucket=bucket, Key=key + suffix)["ContentLength"]
+            except botocore.exceptions.ClientError:
+                continue
+            self._evict(size)
+            path = os.path.join(self.directory, stem + suffix)
+            # download under a temporary name so a partial file is never used
+            partial = os.path.join(self.directory, f".{uuid.uuid4().hex}")
+            try:
+                s3.download_file(bucket, key + suffix, partial)
+                os.replace(partial, path)
+            except Exception as e:
+                print(f"Unable to cache index of {vcf_location}\n", e)
+                if os.path.exists(partial):
+                    os.unlink(partial)
+                return etag, None
+            print(f"Index cache miss - {vcf_location}")
+            return etag, path
+
+        print(f"No index found for {vcf_location}")
+        return etag, None
+
+    def _entries(self):
+        entries = []
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            if file_name.startswith(".") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def _remove_prefix(self, prefix):
+        for _, _, path in self._entries():
+            if os.path.basename(path).startswith(prefix):
+                os.unlink(path)
+
+    def _evict(self, incoming_bytes):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries) + incoming_bytes
+
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.unlink(path)
+            total -= size
+
+
+index_cache = IndexCache()
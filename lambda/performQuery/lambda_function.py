@@ -1,6 +1,6 @@
 import json
 
-from shared.utils import clear_tmp
+from shared.utils import clear_tmp, spill_response
 from query_engine import perform_query
 
 
@@ -16,7 +16,8 @@ def lambda_handler(event, context):
 
     response = perform_query(event, is_async)
     clear_tmp()
-    return response
+    # record queries with samples can exceed the lambda response limit
+    return spill_response(response)
 
 
 if __name__ == "__main__":
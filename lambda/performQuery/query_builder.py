@@ -1,13 +1,32 @@
+import re
 from typing import List
 
 
+SITES_FORMAT = "%POS\t%REF\t%ALT\t%INFO"
+GENOTYPES_FORMAT = f"{SITES_FORMAT}\t[%GT,]"
+# only plain identifiers are pushed down, anything else is left to python
+bases_pattern = re.compile("[A-Za-z]+")
+type_pattern = re.compile("[A-Za-z0-9_:]+")
+
+
+def bases_regex(bases):
+    # case insensitive without relying on regex flags of bcftools
+    return "".join(f"[{base.upper()}{base.lower()}]" for base in bases)
+
+
+def any_allele(*alternatives):
+    """Expression that is true if any ALT allele fully matches an alternative"""
+    return f'ALT~"(^|,)({"|".join(alternatives)})(,|$)"'
+
+
 class QueryBuiler:
     def __init__(self) -> None:
         self.region = ""
         self.samples = []
-        self.format = "%POS\t%REF\t%ALT\t%INFO\t[%GT,]"
+        self.format = GENOTYPES_FORMAT
         self.vcf = ""
-        self.parser_attrs = []
+        self.index = None
+        self.include = []
 
     def set_region(self, region: str):
         self.region = region
@@ -24,34 +43,122 @@ class QueryBuiler:
 
         return self
 
-    def set_return_samples(self, flag=True):
-        if flag:
-            self.format += "\t[%SAMPLE,]"
+    def set_index(self, index: str):
+        self.index = index
+
+        return self
+
+    def set_sites_only(self, flag=True):
+        self.format = SITES_FORMAT if flag else GENOTYPES_FORMAT
+
+        return self
+
+    @property
+    def sites_only(self):
+        return self.format == SITES_FORMAT
+
+    def plan(self, info_ids, genotypes_needed):
+        """
+        Chooses the output format from the INFO fields declared in the header.
+        Without genotype output, INFO/AC and INFO/AN answer the query, so
+        bcftools does not need to decode and print the genotypes at all.
+        """
+        return self.set_sites_only(
+            not genotypes_needed and "AC" in info_ids and "AN" in info_ids
+        )
+
+    def set_filters(
+        self,
+        reference_bases: str = "N",
+        alternate_bases: str = "N",
+        variant_type: str = None,
+    ):
+        """
+        Pushes the allele constraints of a query down into an --include
+        expression, so records that cannot match never leave bcftools.
+        The expression only removes records that perform_query would reject,
+        which still checks every allele and the variant lengths.
+        """
+        self.include = []
+        known_reference = reference_bases != "N" and bases_pattern.fullmatch(
+            reference_bases
+        )
+
+        if known_reference:
+            self.include.append(f'REF~"^{bases_regex(reference_bases)}$"')
+
+        if alternate_bases != "N":
+            if bases_pattern.fullmatch(alternate_bases):
+                self.include.append(any_allele(bases_regex(alternate_bases)))
+        elif variant_type and type_pattern.fullmatch(variant_type):
+            if (alleles := self._type_alleles(variant_type, known_reference)):
+                self.include.append(any_allele(*alleles))
+
         return self
 
+    def _type_alleles(self, variant_type, known_reference):
+        # the symbolic alleles are the same regardless of the REF
+        if variant_type not in ("DEL", "SNP", "INDEL", "INS", "DUP", "DUP:TANDEM", "CNV"):
+            return [f"<{variant_type}[^,]*"]
+        if not known_reference:
+            return []
+
+        # sequence alleles depend on the length of the REF
+        length = len(known_reference.group())
+        reference = bases_regex(known_reference.group())
+        shorter = [f"[^<,][^,]{{0,{length - 2}}}"] if length > 1 else []
+
+        if variant_type == "SNP":
+            return [f"[^,]{{{length}}}"]
+        elif variant_type == "INDEL":
+            return [f"[^,]{{1,{length - 1}}}"] * (length > 1) + [
+                f"[^,]{{{length + 1},}}"
+            ]
+        elif variant_type == "DEL":
+            return ["<DEL[^,]*", "<CN0>"] + shorter
+        elif variant_type == "INS":
+            return ["<INS[^,]*", f"[^<,][^,]{{{length},}}"]
+        elif variant_type == "DUP":
+            return ["<DUP[^,]*", "<CN[^,]*", f"({reference}){{2,}}"]
+        elif variant_type == "DUP:TANDEM":
+            return ["<DUP:TANDEM[^,]*", "<CN2>", reference * 2]
+        # CNV matches almost every allele, filtering it is not worth it
+        return []
+
+    def _vcf(self):
+        # htslib reads a locally cached index instead of downloading it
+        return f"{self.vcf}##idx##{self.index}" if self.index else self.vcf
+
+    def build_header(self):
+        args = ["bcftools", "view", "--header-only", "--no-version", self._vcf()]
+        print(f"Built header query: {str(args)}")
+        return args
+
     def build(self):
         args = [
             "bcftools",
             "query",
             "--regions",
             self.region,
+            # records are read once, for the region holding their POS, not
+            # once for every region they overlap
+            "--regions-overlap",
+            "pos",
             "--format",
             f"{self.format}\n",
         ]
 
+        if self.include:
+            args.extend(["--include", " && ".join(self.include)])
+
+        vcf = self._vcf()
+
         if self.samples:
-            args.extend(["--samples", ",".join(self.samples), self.vcf])
+            args.extend(["--samples", ",".join(self.samples), vcf])
         else:
-            args.append(self.vcf)
+            args.append(vcf)
 
             # TODO if this is the case, must be piped for correct AC/AN
             # Use bcftools view for this
         print(f"Built query: {str(args)}")
-        self.parser_attrs = len(self.format.split("\t"))
         return args
-
-    def parse_line(self, line):
-        if self.parser_attrs == 5:
-            return line.split("\t") + [""]
-        elif self.parser_attrs == 6:
-            return line.split("\t")
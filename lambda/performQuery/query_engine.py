@@ -1,35 +1,89 @@
 import os
-import re
-import subprocess
+import time
 
 import boto3
 
 from shared.apiutils.requests import Granularity
+from shared.dynamodb import is_query_cancelled
+from shared.payloads import encode_responses
+from shared.utils import ENV_CONFIG, compile_matcher
+from shared.utils.genotypes import GenotypeCounts
+from shared.utils.site_index import SiteCounts, site_indexes
 from query_builder import QueryBuiler
+from index_cache import index_cache
+from bgzf_reader import BgzfReader
+from readers import BcftoolsReader, PysamReader
+from genotype_sidecar import SampleGenotypes
 
 
 # uncomment below for debugging
 # os.environ['LD_DEBUG'] = 'all'
-all_count_pattern = re.compile("[0-9]+")
-get_all_calls = all_count_pattern.findall
 s3 = boto3.client("s3")
+# bcftools, bgzf (in-process block cache) or pysam (htslib bindings)
+DEFAULT_ENGINE = os.environ.get("PERFORM_QUERY_ENGINE", "bcftools")
+# seconds between checks of the cancellation flag while reading records
+CANCELLATION_CHECK_SECONDS = 2
+
+
+def open_reader(
+    engine,
+    vcf_location,
+    samples,
+    include_samples,
+    genotypes_needed=True,
+    filters={},
+    sites_only=False,
+):
+    if engine == "bgzf":
+        if (reader := BgzfReader.open(vcf_location, samples)) is not None:
+            return engine, reader
+        print("Unable to read VCF in-process, falling back to bcftools")
+    elif engine == "pysam":
+        if PysamReader.available():
+            return engine, PysamReader(
+                vcf_location, index_cache.get(vcf_location), samples
+            )
+        print("pysam is not installed, falling back to bcftools")
+
+    etag, index_path = index_cache.lookup(vcf_location)
+    bcftools_query = QueryBuiler()
+    bcftools_query = bcftools_query.set_samples(samples)
+    bcftools_query = bcftools_query.set_vcf(vcf_location)
+    bcftools_query = bcftools_query.set_index(index_path)
+    bcftools_query = bcftools_query.set_filters(**filters)
+
+    reader = BcftoolsReader(bcftools_query, etag, include_samples, genotypes_needed)
+    if sites_only:
+        reader.set_sites_only()
+    return "bcftools", reader
+
+
+class RegionResult:
+    """Pipeline variables of a single region of a payload"""
+
+    def __init__(self, region):
+        ## region is of form: "chrom:start-end"
+        self.chromosome = region[: region.find(":")]
+        self.first_base_pos = int(region[region.find(":") + 1 : region.find("-")])
+        self.last_base_pos = int(region[region.find("-") + 1 :])
+        self.exists = False
+        # (position, reference, alternate, variant_type) of each hit allele
+        self.variants = []
+        self.call_count = 0
+        self.all_alleles_count = 0
+        self.sample_indices = set()
+        # no further records can change the response
+        self.done = False
 
 
 def perform_query(payload: dict(), is_async: bool = False):
-    region = payload["region"]
+    # regions of a payload are on the same chromosome and do not overlap
+    regions = payload.get("regions") or [payload["region"]]
     variant_type = payload.get("variant_type", "")
-    variant_prefix = f"<{variant_type}"
 
-    ## region is of form: "chrom:start-end"
-    first_base_pos = int(region[region.find(":") + 1 : region.find("-")])
-    last_base_pos = int(region[region.find("-") + 1 :])
-    chromosome = region[: region.find(":")]
     # alleles requested
     reference_bases = payload.get("reference_bases", "N")
     alternate_bases = payload.get("alternate_bases", "N")
-    # variant end range
-    end_min = payload["end_min"]
-    end_max = payload["end_max"]
     # variant length
     variant_max_length = payload.get("variant_max_length", -1)
     variant_min_length = payload.get("variant_min_length", 0)
@@ -47,235 +101,141 @@ def perform_query(payload: dict(), is_async: bool = False):
     # query id
     query_id = payload.get("query_id", "-")
     dataset_id = payload.get("dataset_id", "-")
+    # record reader
+    engine = payload.get("engine", DEFAULT_ENGINE)
 
     # pipeline variables
-    exists = False
-    variants = []
-    call_count = 0
-    all_alleles_count = 0
-    sample_indices = set()
-    all_sample_names = []
-    sample_names = []
-
-    bcftools_query = QueryBuiler()
-    bcftools_query = bcftools_query.set_samples(chosen_samples)
-    bcftools_query = bcftools_query.set_region(region)
-    bcftools_query = bcftools_query.set_return_samples(include_samples)
-
-    bcftools_query = bcftools_query.set_vcf(payload["vcf_location"])
-    args = bcftools_query.build()
+    results = [RegionResult(region) for region in regions]
+    ordered = sorted(results, key=lambda result: result.first_base_pos)
+    current = 0
+    pending = len(results)
+    # queries without an id, e.g. direct invocations, cannot be cancelled
+    next_check = time.time() + CANCELLATION_CHECK_SECONDS if query_id != "-" else None
+
+    # type, length and alt checks of a single ALT allele
+    match = compile_matcher(
+        alternate_bases, variant_type, variant_min_length, variant_max_length
+    )
 
-    print("Iterating bcftools result")
-    query_process = subprocess.Popen(
-        args, stdout=subprocess.PIPE, cwd="/tmp", encoding="ascii"
+    # only carriers need genotypes when INFO/AC and INFO/AN are present
+    genotypes_needed = requested_granularity == Granularity.RECORD and include_samples
+    sample_genotypes = None
+    if chosen_samples or genotypes_needed:
+        sample_genotypes = SampleGenotypes.open(payload["vcf_location"], chosen_samples)
+    # counts summariseVcf filled in for records lacking INFO/AC or INFO/AN
+    site_counts = None
+    if (
+        requested_granularity == Granularity.RECORD
+        and not genotypes_needed
+        and not chosen_samples
+        and ENV_CONFIG.CONFIG_VARIANT_SEARCH_SITE_INDEX
+    ):
+        manifest = site_indexes.load([payload["vcf_location"]]).get(
+            payload["vcf_location"]
+        )
+        if manifest is not None and manifest.get("filled"):
+            site_counts = SiteCounts(payload["vcf_location"], manifest)
+
+    engine, reader = open_reader(
+        engine,
+        payload["vcf_location"],
+        chosen_samples,
+        include_samples,
+        genotypes_needed=genotypes_needed and sample_genotypes is None,
+        filters=dict(
+            reference_bases=reference_bases,
+            alternate_bases=alternate_bases,
+            variant_type=variant_type,
+        ),
+        sites_only=sample_genotypes is not None or site_counts is not None,
     )
+    samples = reader.samples
+    records = reader.records(regions)
+
+    print(f"Iterating {engine} result")
+    # iterate through vcf records of all regions in a single pass
+    for vcf_position, vcf_reference, vcf_all_alts, vcf_info, vcf_genotypes in records:
+        if next_check is not None and time.time() > next_check:
+            if is_query_cancelled(query_id):
+                print(f"Query {query_id} cancelled")
+                break
+            next_check = time.time() + CANCELLATION_CHECK_SECONDS
+
+        while vcf_position > ordered[current].last_base_pos:
+            current += 1
+            if current == len(ordered):
+                break
+        if current == len(ordered):
+            break
+        result = ordered[current]
 
-    # iterate through bcftools output
-    for line in query_process.stdout:
-        try:
-            (
-                vcf_position,
-                vcf_reference,
-                vcf_all_alts,
-                vcf_info_str,
-                vcf_genotypes,
-                vcf_samples,
-            ) = bcftools_query.parse_line(line)
-
-            if not all_sample_names and vcf_samples:
-                all_sample_names = [
-                    sample for sample in vcf_samples.strip().strip(",").split(",")
-                ]
-        except ValueError as e:
-            print(repr(line.split("\t")))
-            raise e
-
-        vcf_position = int(vcf_position)
         # Ensure each variant will only be found by one process
         # TODO handle CNVs
-        if not first_base_pos <= vcf_position <= last_base_pos:
+        if vcf_position < result.first_base_pos or result.done:
             continue
 
-        vcf_reference_length = len(vcf_reference)
-
-        # must be within end range
-        # TODO this seems to be incorrect
-        # if not end_min <= vcf_position + vcf_reference_length - 1 <= end_max:
-        #     continue
-
         # validation; if not N validate
+        # bcftools already drops most records failing the checks below (see
+        # QueryBuiler.set_filters), these remain for the other engines and
+        # for the per allele and length checks
         if vcf_reference.upper() != reference_bases and reference_bases != "N":
             continue
 
-        vcf_all_alts = vcf_all_alts.split(",")
-
-        # alternate base not defined
-        if alternate_bases == "N" and variant_type is not None:
-            if variant_type == "DEL":
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if (
-                        (alt.startswith(variant_prefix) or alt == "<CN0>")
-                        if alt.startswith("<")
-                        else len(alt) < vcf_reference_length
-                    )
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-            elif variant_type == "SNP":
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if len(alt) == vcf_reference_length
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-            elif variant_type == "INDEL":
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if len(alt) != vcf_reference_length
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-            elif variant_type == "INS":
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if (
-                        alt.startswith(variant_prefix)
-                        if alt.startswith("<")
-                        else len(alt) > vcf_reference_length
-                    )
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-            elif variant_type == "DUP":
-                pattern = re.compile("({}){{2,}}".format(vcf_reference))
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if (
-                        (
-                            alt.startswith(variant_prefix)
-                            or (alt.startswith("<CN") and alt not in ("<CN0>", "<CN1>"))
-                        )
-                        if alt.startswith("<")
-                        else pattern.fullmatch(alt)
-                    )
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-            elif variant_type == "DUP:TANDEM":
-                tandem = vcf_reference + vcf_reference
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if (
-                        (alt.startswith(variant_prefix) or alt == "<CN2>")
-                        if alt.startswith("<")
-                        else alt == tandem
-                    )
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-            elif variant_type == "CNV":
-                pattern = re.compile("\.|({})*".format(vcf_reference))
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if (
-                        (
-                            alt.startswith(variant_prefix)
-                            or alt.startswith("<CN")
-                            or alt.startswith("<DEL")
-                            or alt.startswith("<DUP")
-                        )
-                        if alt.startswith("<")
-                        else pattern.fullmatch(alt)
-                    )
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-            else:
-                # For structural variants that aren't otherwise recognisable
-                hit_indexes = [
-                    i
-                    for i, alt in enumerate(vcf_all_alts)
-                    if alt.startswith(variant_prefix)
-                    and variant_min_length <= len(alt) <= variant_max_length
-                ]
-        # if alternate base defined
-        # here we should check for the asked variant lengths
-        elif alternate_bases == "N":
-            hit_indexes = [
-                i
-                for i, alt in enumerate(vcf_all_alts)
-                if variant_min_length <= len(alt) <= variant_max_length
-            ]
-        else:
-            hit_indexes = [
-                i
-                for i, alt in enumerate(vcf_all_alts)
-                if alt.upper() == alternate_bases
-                and variant_min_length <= len(alt) <= variant_max_length
-            ]
-
+        hit_indexes = [
+            i for i, alt in enumerate(vcf_all_alts) if match(vcf_reference, alt)
+        ]
         if not hit_indexes:
             continue
         # hit_indexes are of form [0, 1] for ALT A,GC
 
-        # Look through INFO for AC and AN, used for efficient calculations. Note
-        # we cannot request them explicitly in the query, as bcftools will crash
-        # if they aren't present.
-        all_alt_counts = None
-        total_count = None
-        vcf_variant_type = "N/A"
-
-        for info in vcf_info_str.split(";"):
-            if info.startswith("AC="):
-                all_alt_counts = info[3:]
-            elif info.startswith("AN="):
-                total_count = int(info[3:])
-            elif info.startswith("VT="):
-                vcf_variant_type = info[3:]
-            elif info.startswith("SVTYPE=") and vcf_variant_type == "N/A":
-                vcf_variant_type = info[7:]
-
-        all_calls = None
+        alt_counts, total_count, vcf_variant_type = reader.info(vcf_info)
+        if site_counts is not None and (alt_counts is None or total_count is None):
+            alt_counts, total_count = site_counts.counts(
+                result.chromosome, vcf_position, vcf_reference, vcf_all_alts
+            )
+
+        genotype_counts = None
+        if sample_genotypes is not None:
+            genotype_counts = sample_genotypes.counts(
+                result.chromosome,
+                vcf_position,
+                vcf_reference,
+                vcf_all_alts,
+                hit_indexes,
+            )
         # if AC=X was there
-        if all_alt_counts is not None:
-            alt_counts = [int(c) for c in all_alt_counts.split(",")]
+        if alt_counts is not None:
             call_counts = [alt_counts[i] for i in hit_indexes]
-            # ["Chr1 123 A G SNP"]
-            variants += [
-                f"{chromosome}\t{vcf_position}\t{vcf_reference}\t{vcf_all_alts[i]}\t{vcf_variant_type}"
+            result.variants += [
+                (vcf_position, vcf_reference, vcf_all_alts[i], vcf_variant_type)
                 for i in hit_indexes
                 if alt_counts[i] != 0
             ]
-            call_count += sum(call_counts)
+            result.call_count += sum(call_counts)
         # otherwise
         else:
-            # Much slower, but doesn't require INFO/AC
-            # parsing 0|0,0|0,0|0,0|0
-            all_calls = [int(g) for g in get_all_calls(vcf_genotypes)]
-            hit_set = {i + 1 for i in hit_indexes}
-            # ["Chr1 123 A G SNP"]
-            variants += [
-                f"{chromosome}\t{vcf_position}\t{vcf_reference}\t{vcf_all_alts[i-1]}\t{vcf_variant_type}"
-                for i in set(all_calls) & hit_set
+            # Slower, but doesn't require INFO/AC
+            if genotype_counts is None:
+                genotype_counts = GenotypeCounts(
+                    reader.genotype_matrix(vcf_genotypes), hit_indexes
+                )
+            result.variants += [
+                (vcf_position, vcf_reference, vcf_all_alts[i - 1], vcf_variant_type)
+                for i in genotype_counts.hit_alleles
             ]
-            call_count += sum(1 for call in all_calls if call in hit_set)
+            result.call_count += genotype_counts.call_count
 
         # if there are actual variants
-        if call_count:
-            exists = True
+        if result.call_count:
+            result.exists = True
             if not include_details:
-                break
-            hit_string = "|".join(str(i + 1) for i in hit_indexes)
-            pattern = re.compile(f"(^|[|/])({hit_string})([|/]|$)")
-            if requested_granularity == Granularity.RECORD and include_samples:
-                sample_indices.update(
-                    [
-                        i
-                        for i, gt in enumerate(vcf_genotypes.split(","))
-                        if pattern.search(gt)
-                    ]
-                )
+                result.done = True
+            elif requested_granularity == Granularity.RECORD and include_samples:
+                if genotype_counts is None:
+                    genotype_counts = GenotypeCounts(
+                        reader.genotype_matrix(vcf_genotypes), hit_indexes
+                    )
+                result.sample_indices.update(genotype_counts.carriers)
 
         # Used for calculating frequency. This will be a misleading value if the
         # alleles are spread over multiple vcf records. Ideally we should
@@ -283,33 +243,81 @@ def perform_query(payload: dict(), is_async: bool = False):
         # beacon specification doesn't support it. A quick fix might be to
         # represent the frequency of any matching allele in the population of
         # haplotypes, but this could lead to an illegal value > 1.
-        if total_count is not None:
-            all_alleles_count += total_count
+        if result.done:
+            pass
+        elif total_count is not None:
+            result.all_alleles_count += total_count
         else:
-            # Much slower, but doesn't require INFO/AN
-            if all_calls is None:
-                all_calls = get_all_calls(vcf_genotypes)
-            all_alleles_count += len(all_calls)
+            # Slower, but doesn't require INFO/AN
+            if genotype_counts is None:
+                genotype_counts = GenotypeCounts(
+                    reader.genotype_matrix(vcf_genotypes), hit_indexes
+                )
+            result.all_alleles_count += genotype_counts.total_count
 
         # if only bool is asked and a variant if found
-        if requested_granularity == Granularity.BOOLEAN and exists:
-            break
-    query_process.stdout.close()
-
-    if requested_granularity == Granularity.RECORD and include_samples:
-        sample_names = [
-            sample for n, sample in enumerate(all_sample_names) if n in sample_indices
-        ]
-
-    print("Iterating bcftools result complete")
-
-    response = {
-        "dataset_id": dataset_id,
-        "exists": exists,
-        "all_alleles_count": all_alleles_count,
-        "variants": variants,
-        "call_count": call_count,
-        "sample_names": [] if not include_samples else sample_names,
-    }
+        if requested_granularity == Granularity.BOOLEAN and result.exists:
+            result.done = True
 
-    return response
+        if result.done:
+            pending -= 1
+            # skip the remaining records of the region
+            if not pending:
+                break
+    records.close()
+    reader.close()
+
+    if engine == "bgzf":
+        print(f"Block cache - {reader.stats()}")
+
+    print(f"Iterating {engine} result complete")
+
+    if payload.get("response_encoding") == "columnar":
+        # a single blob of columns, whatever the number of regions
+        return encode_responses(
+            [
+                {
+                    "dataset_id": dataset_id,
+                    "exists": result.exists,
+                    "all_alleles_count": result.all_alleles_count,
+                    "call_count": result.call_count,
+                    "chromosome": result.chromosome,
+                    "variants": result.variants,
+                    "sample_indexes": (
+                        sorted(result.sample_indices)
+                        if requested_granularity == Granularity.RECORD
+                        and include_samples
+                        else []
+                    ),
+                }
+                for result in results
+            ],
+            samples,
+        )
+
+    responses = []
+    for result in results:
+        sample_names = []
+        if requested_granularity == Granularity.RECORD and include_samples:
+            sample_names = [
+                sample
+                for n, sample in enumerate(samples)
+                if n in result.sample_indices
+            ]
+        responses.append(
+            {
+                "dataset_id": dataset_id,
+                "exists": result.exists,
+                "all_alleles_count": result.all_alleles_count,
+                # ["Chr1 123 A G SNP"]
+                "variants": [
+                    f"{result.chromosome}\t{position}\t{reference}\t{alternate}\t{variant_type}"
+                    for position, reference, alternate, variant_type in result.variants
+                ],
+                "call_count": result.call_count,
+                "sample_names": [] if not include_samples else sample_names,
+            }
+        )
+
+    # payloads of a single region receive a single response
+    return responses if "regions" in payload else responses[0]
@@ -0,0 +1,283 @@
+from collections import OrderedDict
+import copy
+import os
+import subprocess
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+from shared.utils.genotypes import allele_matrix, tuples_matrix
+from shared.utils.vcf_text import parse_header, parse_info
+
+
+# size of the buffered reads of bcftools output
+QUERY_BUFFER_BYTES = int(os.environ.get("QUERY_BUFFER_BYTES", 1024 * 1024))
+TAB = ord("\t")
+NEWLINE = ord("\n")
+# headers of vcfs with many samples are large, only the recent ones are kept
+HEADER_CACHE_ENTRIES = int(os.environ.get("HEADER_CACHE_ENTRIES", 64))
+
+
+class LruCache:
+    """
+    At most max_entries values, the least recently used is dropped first.
+    Used for the parsed headers held across warm invocations
+    """
+
+    def __init__(self, max_entries=HEADER_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if (value := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# (vcf, etag) -> (samples, INFO ids) declared in the header
+vcf_headers = LruCache()
+# (vcf, etag, requested samples) -> sample names in the order of the output
+sample_lists = LruCache()
+
+
+def split_record(line, sites_only=False):
+    """
+    Splits a line of bcftools query output into POS, REF, ALT, INFO and GT
+    bytes. Only the leading columns are sliced out, the possibly very wide
+    genotype column is returned as a memoryview of the line, not a copy.
+    """
+    end = len(line) - 1 if line and line[-1] == NEWLINE else len(line)
+    ref_start = line.index(TAB) + 1
+    alt_start = line.index(TAB, ref_start) + 1
+    info_start = line.index(TAB, alt_start) + 1
+    info_end = end if sites_only else line.index(TAB, info_start)
+
+    return (
+        line[: ref_start - 1],
+        line[ref_start : alt_start - 1],
+        line[alt_start : info_start - 1],
+        line[info_start:info_end],
+        None if sites_only else memoryview(line)[info_end + 1 : end],
+    )
+
+
+# Every reader yields the records of a list of regions, sorted by position, as
+# (position, reference, alts, info, genotypes), each record once, for the
+# region holding its position
+# info and genotypes are reader specific and only decoded through
+# the reader when the record is a hit
+class TextReader:
+    """
+    Records whose INFO and genotypes are text, as printed by
+    bcftools query --format "%INFO\t[%GT,]"
+    """
+
+    def __init__(self):
+        self.samples = []
+
+    def info(self, info):
+        if isinstance(info, bytes):
+            info = info.decode()
+        # AC and AN are used for efficient calculations
+        return parse_info(info)
+
+    def genotype_matrix(self, genotypes):
+        # parsing 0|0,0|0,0|0,0|0
+        return allele_matrix(genotypes)
+
+    def close(self):
+        pass
+
+
+class BcftoolsReader(TextReader):
+    def __init__(
+        self, bcftools_query, etag=None, include_samples=False, genotypes_needed=True
+    ):
+        super().__init__()
+        self.bcftools_query = bcftools_query
+        self.etag = etag
+        self.query_process = None
+        # subset of the records fetched on demand
+        self.fetch_samples = bcftools_query.samples
+        if include_samples:
+            self.samples = self.read_samples()
+        if not genotypes_needed:
+            _, info_ids = self.read_header()
+            self.bcftools_query.plan(info_ids, genotypes_needed)
+
+    def read_header(self):
+        """
+        Samples and INFO ids of the header, read once and cached per VCF
+        version
+        """
+        key = (self.bcftools_query.vcf, self.etag)
+        if (header := vcf_headers.get(key)) is not None:
+            return header
+
+        text = subprocess.run(
+            self.bcftools_query.build_header(),
+            stdout=subprocess.PIPE,
+            cwd="/tmp",
+            encoding="utf-8",
+            errors="replace",
+            check=True,
+        ).stdout
+        header = parse_header(text)
+
+        # an unknown etag cannot tell versions of the vcf apart
+        if self.etag is not None:
+            vcf_headers.put(key, header)
+        return header
+
+    def read_samples(self):
+        """Sample names of the output, cached per requested subset"""
+        subset = tuple(sorted(self.bcftools_query.samples))
+        key = (self.bcftools_query.vcf, self.etag, subset)
+        if (samples := sample_lists.get(key)) is not None:
+            return samples
+
+        samples, _ = self.read_header()
+        # bcftools query keeps the header order of a subset
+        chosen = set(subset)
+        samples = [sample for sample in samples if not subset or sample in chosen]
+
+        if self.etag is not None:
+            sample_lists.put(key, samples)
+        return samples
+
+    def set_sites_only(self):
+        """
+        Genotypes are read elsewhere, bcftools neither decodes nor subsets
+        them other than for records fetched on demand
+        """
+        self.fetch_samples = self.bcftools_query.samples
+        self.bcftools_query.set_samples([]).set_sites_only()
+
+    def records(self, regions):
+        # a single bcftools process reads all the regions
+        args = self.bcftools_query.set_region(",".join(regions)).build()
+        sites_only = self.bcftools_query.sites_only
+        self.query_process = subprocess.Popen(
+            args, stdout=subprocess.PIPE, cwd="/tmp", bufsize=QUERY_BUFFER_BYTES
+        )
+
+        for line in self.query_process.stdout:
+            try:
+                (
+                    position,
+                    reference,
+                    alts,
+                    info,
+                    genotypes,
+                ) = split_record(line, sites_only)
+            except ValueError as e:
+                print(repr(line[:1024]))
+                raise e
+
+            reference = reference.decode()
+            alts = alts.decode()
+            if genotypes is None:
+                # sites only output, genotypes are fetched on demand
+                genotypes = (regions[0], position, reference, alts)
+
+            # INFO is decoded by the reader only for hits
+            yield int(position), reference, alts.split(","), info, genotypes
+
+    def genotype_matrix(self, genotypes):
+        if isinstance(genotypes, tuple):
+            genotypes = self.fetch_genotypes(*genotypes)
+        return super().genotype_matrix(genotypes)
+
+    def fetch_genotypes(self, region, position, reference, alts):
+        """
+        Genotypes of a single record of a sites only query. Only needed for
+        the rare records lacking the AC or AN declared in the header, or
+        missing from the genotype sidecar.
+        """
+        chromosome = region[: region.find(":")]
+        bcftools_query = (
+            copy.copy(self.bcftools_query)
+            .set_sites_only(False)
+            .set_samples(self.fetch_samples)
+        )
+        args = bcftools_query.set_region(
+            f"{chromosome}:{position.decode()}-{position.decode()}"
+        ).build()
+        output = subprocess.run(args, stdout=subprocess.PIPE, cwd="/tmp", check=True).stdout
+
+        for line in output.splitlines():
+            fields = split_record(line)
+            if fields[:3] == (position, reference.encode(), alts.encode()):
+                return fields[4]
+        return b""
+
+    def close(self):
+        if self.query_process is not None:
+            self.query_process.stdout.close()
+
+
+class PysamReader:
+    """
+    Reads records through the htslib bindings of pysam, without formatting
+    them as text and parsing them back
+    """
+
+    def __init__(self, vcf_location, index_path=None, samples=[]):
+        self.variant_file = pysam.VariantFile(vcf_location, index_filename=index_path)
+        if samples:
+            self.variant_file.subset_samples(samples)
+        self.samples = list(self.variant_file.header.samples)
+        # pysam raises on INFO keys the header does not declare
+        self.info_ids = set(self.variant_file.header.info)
+
+    @classmethod
+    def available(cls):
+        return pysam is not None
+
+    def records(self, regions):
+        for region in regions:
+            yield from self.region_records(region)
+
+    def region_records(self, region):
+        chromosome = region[: region.find(":")]
+        start = int(region[region.find(":") + 1 : region.find("-")])
+        end = int(region[region.find("-") + 1 :])
+
+        for record in self.variant_file.fetch(chromosome, start - 1, end):
+            # records overlapping the start belong to the previous region
+            if record.pos < start:
+                continue
+            yield (
+                record.pos,
+                record.ref,
+                list(record.alts) if record.alts else ["."],
+                record.info,
+                record.samples,
+            )
+
+    def info(self, info):
+        get = lambda key: info.get(key) if key in self.info_ids else None
+        alt_counts = get("AC")
+        total_count = get("AN")
+        variant_type = get("VT") or get("SVTYPE") or "N/A"
+
+        if alt_counts is not None and not isinstance(alt_counts, tuple):
+            alt_counts = (alt_counts,)
+        if isinstance(variant_type, tuple):
+            variant_type = ",".join(variant_type)
+
+        return alt_counts, total_count, variant_type
+
+    def genotype_matrix(self, genotypes):
+        return tuples_matrix(sample["GT"] for sample in genotypes.values())
+
+    def close(self):
+        self.variant_file.close()
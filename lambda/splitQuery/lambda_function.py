@@ -1,39 +1,86 @@
-from concurrent.futures import ThreadPoolExecutor
 import json
+import math
 import os
 from typing import List
-import gzip
-import base64
 
 import boto3
 
-from shared.utils import LambdaClient
+from shared.utils import AsyncLambdaClient, ENV_CONFIG, lambda_limiter, spill_response
+from shared.dynamodb import is_query_cancelled
+from shared.payloads import decode_chunk, encode_chunk
 
 
 PERFORM_QUERY = os.environ["PERFORM_QUERY_LAMBDA"]
-THREADS = 50
+# performQuery invocations in flight per splitQuery invocation
+CONCURRENCY = 200
 
 
-aws_lambda = LambdaClient()
+aws_lambda = AsyncLambdaClient()
 sns = boto3.client("sns")
 
 
-def perform_query(payload: dict):
-    response = aws_lambda.invoke(
-        FunctionName=PERFORM_QUERY,
-        InvocationType="RequestResponse",
-        Payload=json.dumps(payload),
+def delegation_width(payloads, width):
+    """
+    Number of splitQuery invocations the payloads are delegated to, 1 when
+    they are invoked directly. A tree of the smallest depth with
+    width ** depth >= payloads is enough for any number of payloads, each
+    level uses the fewest invocations that keep the subtrees below it within
+    that depth. The depth is counted in integers, a float logarithm rounds
+    up at exact powers of width.
+    """
+    if payloads <= width:
+        return 1
+    depth = 1
+    while width**depth < payloads:
+        depth += 1
+    return min(width, math.ceil(payloads / width ** (depth - 1)))
+
+
+def split_query(payloads: List[dict], is_async: bool = False, function_name=None):
+    width = delegation_width(
+        len(payloads), ENV_CONFIG.CONFIG_VARIANT_SEARCH_FANOUT_WIDTH
     )
-
-    return json.loads(response["Payload"].read())
-
-
-# TODO if the response is too big upload to S3
-def split_query(payloads: List[dict], is_async: bool = False):
-    executor = ThreadPoolExecutor(THREADS)
-    futures = [executor.submit(perform_query, payload) for payload in payloads]
-
-    return [future.result() for future in futures]
+    if width > 1 and function_name is not None:
+        # contiguous sub-chunks keep the regions of a vcf together
+        size = math.ceil(len(payloads) / width)
+        chunks = [payloads[n : n + size] for n in range(0, len(payloads), size)]
+        print(f"Delegating {len(payloads)} payloads to {len(chunks)} splitQuery")
+        stream = aws_lambda.stream(
+            function_name,
+            [encode_chunk(chunk) for chunk in chunks],
+            len(chunks),
+            before_invoke=lambda n: not is_query_cancelled(chunks[n][0]["query_id"]),
+        )
+        query_id = lambda n: chunks[n][0]["query_id"]
+    else:
+        stream = aws_lambda.stream(
+            PERFORM_QUERY,
+            [json.dumps(payload) for payload in payloads],
+            CONCURRENCY,
+            # the query was answered while this payload waited to be sent
+            before_invoke=lambda n: not is_query_cancelled(payloads[n]["query_id"]),
+            # a cold start or a slow read must not hold up the whole query
+            hedge_percentile=ENV_CONFIG.CONFIG_VARIANT_SEARCH_HEDGE_PERCENTILE,
+        )
+        query_id = lambda n: payloads[n]["query_id"]
+
+    responses = []
+    try:
+        for n, response, seconds in stream:
+            if response is None:
+                print(f"Query {query_id(n)} cancelled")
+                break
+            # payloads of several regions return a response per region and
+            # delegated splitQuery invocations a list of responses
+            if isinstance(response := json.loads(response), list):
+                responses.extend(response)
+            else:
+                responses.append(response)
+    finally:
+        stream.close()
+        lambda_limiter.log_metrics()
+
+    return responses
 
 
 def lambda_handler(event, context):
@@ -44,15 +91,13 @@ def lambda_handler(event, context):
     except:
         print("using invoke event")
         is_async = False
-    
-    # if gzipped
-    if not isinstance(event, list):
-        event = base64.b64decode(event.encode())
-        event = gzip.decompress(event)
-        event = json.loads(event)
-    print("Event Received: {}".format(json.dumps(event)))
-    response = split_query(event, is_async)
-    return response
+
+    event = decode_chunk(event)
+    # parameters shared by the payloads are logged once
+    print(f"Event Received: {len(event)} payloads, first {json.dumps(event[:1])}")
+    response = split_query(event, is_async, context.function_name)
+    # spilled responses are kept as pointers, resolved by perform_variant_search
+    return spill_response(response)
 
 
 if __name__ == "__main__":
@@ -10,7 +10,7 @@ from shared.athena import Analysis, Biosample, Cohort, Dataset, Individual, Run
 from shared.dynamodb import Dataset as DynamoDataset
 from shared.utils import clear_tmp
 from smart_open import open as sopen
-from util import get_vcf_chromosome_maps
+from util import get_vcf_chromosome_maps, summarise_vcfs
 
 DATASETS_TABLE_NAME = os.environ["DYNAMO_DATASETS_TABLE"]
 INDEXER_LAMBDA = os.environ["INDEXER_LAMBDA"]
@@ -146,6 +146,10 @@ def update_dataset(body_dict):
 
     create_dataset(body_dict, vcf_chromosome_maps)
 
+    if summarise:
+        summarise_vcfs(vcf_locations)
+        pending.append("Summarising VCFs")
+
     return bundle_response(200, {"Completed": completed, "Running": pending})
 
 
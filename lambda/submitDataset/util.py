@@ -1,9 +1,19 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+
+import boto3
 
 from shared.utils import get_vcf_chromosomes
 from shared.dynamodb import VcfChromosomeMap
 
 
+SUMMARISE_VCF_LAMBDA = os.environ["SUMMARISE_VCF_LAMBDA"]
+
+
+aws_lambda = boto3.client("lambda")
+
+
 def get_vcf_chromosome_map(vcf_location):
     errored, error, chroms = get_vcf_chromosomes(vcf_location)
     vcf_chromosome_map = None
@@ -36,3 +46,13 @@ def get_vcf_chromosome_maps(vcf_locations):
         vcf_chromosome_maps.append(vcf_chromosome_map)
 
     return errored, errors, vcf_chromosome_maps
+
+
+def summarise_vcfs(vcf_locations):
+    """Profiles each vcf and builds its site index in the background"""
+    for vcf_location in vcf_locations:
+        aws_lambda.invoke(
+            FunctionName=SUMMARISE_VCF_LAMBDA,
+            InvocationType="Event",
+            Payload=json.dumps({"vcf_location": vcf_location}),
+        )
@@ -0,0 +1,534 @@
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import subprocess
+import time
+
+import boto3
+import botocore
+import numpy as np
+from pynamodb.exceptions import UpdateError
+
+from shared.utils import ENV_CONFIG, clear_tmp, get_vcf_chromosomes, parse_s3_url
+from shared.utils.genotypes import allele_matrix
+from shared.utils.site_index import (
+    BIN_BASES,
+    BloomFilter,
+    GenotypeBinWriter,
+    SiteBinWriter,
+    allele_hash,
+    load_allele_hashes,
+    load_checkpoint,
+    save_allele_hashes,
+    save_bloom,
+    save_checkpoint,
+    save_genotype_samples,
+    save_manifest,
+)
+from shared.utils.tabix_index import TabixIndex
+from shared.utils.vcf_text import INDEX_SUFFIXES, parse_header, parse_info
+from shared.dynamodb import ContigSummary, SummaryStatus, VcfSummary
+
+
+# checkpoints of the contigs read at once when finishing a summary
+THREADS = 32
+# sample names are left out of summaries that would exceed the item size
+SAMPLE_NAMES_MAX_BYTES = 256 * 1024
+# left of an invocation to close its bins and save the checkpoint
+CHECKPOINT_MARGIN_SECONDS = 60
+
+
+ContigResult = namedtuple(
+    "ContigResult",
+    [
+        "bins",
+        "counts",
+        "filled",
+        "records",
+        "first_position",
+        "last_position",
+        # first position left to summarise, None once the contig is done
+        "resume",
+    ],
+)
+
+
+s3 = boto3.client("s3")
+aws_lambda = boto3.client("lambda")
+
+
+def fill_counts(matrix, alt_count):
+    """INFO/AC and INFO/AN of a record from its genotypes, as bcftools +fill-tags"""
+    alt_counts = [int(np.count_nonzero(matrix == n)) for n in range(1, alt_count + 1)]
+    return alt_counts, int(np.count_nonzero(matrix >= 0))
+
+
+def read_header(vcf_location):
+    """Samples and INFO ids declared in the header"""
+    header = subprocess.run(
+        ["bcftools", "view", "--header-only", "--no-version", vcf_location],
+        stdout=subprocess.PIPE,
+        cwd="/tmp",
+        encoding="utf-8",
+        errors="replace",
+        check=True,
+    ).stdout
+    return parse_header(header)
+
+
+def summarise_contig(
+    vcf_location,
+    contig,
+    sample_count=0,
+    sidecar=False,
+    site_index=True,
+    checkpoint=None,
+    deadline=None,
+):
+    """
+    Profiles the records of contig and with site_index writes its sites to
+    the site index and the bloom filter of its alleles. With sample_count,
+    genotypes are read to fill the counts of records lacking INFO/AC or
+    INFO/AN, and with sidecar written to the genotype sidecar. Past the
+    deadline, it stops before the next bin and the result resumes from its
+    first record, continued by passing the result as checkpoint.
+    """
+    genotypes = "\t[%GT,]" if sample_count else ""
+    start = 1 if checkpoint is None else checkpoint["resume"]
+    args = [
+        "bcftools",
+        "query",
+        "--regions",
+        contig if checkpoint is None else f"{contig}:{start}-",
+        "--format",
+        f"%POS\t%REF\t%ALT\t%INFO{genotypes}\n",
+        vcf_location,
+    ]
+    query_process = subprocess.Popen(
+        args, stdout=subprocess.PIPE, cwd="/tmp", encoding="ascii"
+    )
+    if checkpoint is None:
+        bins = []
+        counts = True
+        filled = False
+        records = 0
+        first_position = None
+        position = None
+        allele_hashes = array("Q")
+    else:
+        bins = checkpoint["bins"]
+        counts = checkpoint["counts"]
+        filled = checkpoint["filled"]
+        records = checkpoint["records"]
+        first_position = checkpoint["first_position"]
+        position = checkpoint["last_position"]
+        allele_hashes = (
+            load_allele_hashes(vcf_location, contig) if site_index else array("Q")
+        )
+    bin = None
+    resume = None
+    writer = None
+    genotype_writer = None
+
+    for line in query_process.stdout:
+        fields = line.rstrip("\n").split("\t", 4)
+        # records overlapping start were read before the checkpoint
+        if int(fields[0]) < start:
+            continue
+        if int(fields[0]) // BIN_BASES != bin:
+            # each invocation summarises at least a bin
+            late = deadline is not None and time.time() > deadline
+            if late and bin is not None:
+                resume = int(fields[0])
+                break
+            bin = int(fields[0]) // BIN_BASES
+            if site_index:
+                if writer is not None:
+                    writer.close()
+                if genotype_writer is not None:
+                    genotype_writer.close()
+                writer = SiteBinWriter(vcf_location, contig, bin)
+                if sidecar:
+                    genotype_writer = GenotypeBinWriter(
+                        vcf_location, contig, bin, sample_count
+                    )
+                bins.append(bin)
+
+        position, reference, alts, info, *calls = fields
+        position = int(position)
+        records += 1
+        if first_position is None:
+            first_position = position
+        if not site_index:
+            continue
+
+        alts = alts.split(",")
+        alt_counts, total_count, variant_type = parse_info(info)
+        matrix = allele_matrix(calls[0]) if calls else None
+        if matrix is not None and (alt_counts is None or total_count is None):
+            alt_counts, total_count = fill_counts(matrix, len(alts))
+            filled = True
+        counts = counts and alt_counts is not None and total_count is not None
+        writer.write(position, reference, alts, alt_counts, total_count, variant_type)
+        allele_hashes.extend(allele_hash(position, reference, alt) for alt in alts)
+        if genotype_writer is not None:
+            genotype_writer.write(position, reference, alts, matrix)
+
+    if writer is not None:
+        writer.close()
+    if genotype_writer is not None:
+        genotype_writer.close()
+    if resume is not None:
+        query_process.terminate()
+        query_process.wait()
+    elif query_process.wait() != 0:
+        raise subprocess.CalledProcessError(query_process.returncode, args)
+
+    if resume is not None:
+        if site_index:
+            save_allele_hashes(vcf_location, contig, allele_hashes)
+        print(f"Summarised {vcf_location} {contig} up to {resume}")
+    else:
+        if site_index:
+            save_bloom(vcf_location, contig, BloomFilter.build(allele_hashes))
+        print(f"Summarised {vcf_location} {contig} into {len(bins)} bins")
+    return ContigResult(
+        bins, counts, filled, records, first_position, position, resume
+    )
+
+
+def read_index(bucket, key):
+    """Parsed index of a vcf and its size, the index is None if unreadable"""
+    for suffix in INDEX_SUFFIXES:
+        try:
+            body = s3.get_object(Bucket=bucket, Key=key + suffix)["Body"].read()
+        except botocore.exceptions.ClientError:
+            continue
+        try:
+            return TabixIndex.parse(body), len(body)
+        except Exception as error:
+            print(f"Unable to parse index of {key}\n", error)
+            return None, len(body)
+    return None, None
+
+
+def contig_summaries(index, contigs, results=None):
+    """
+    ContigSummary of each contig with records, bounded by the index or
+    exact with the results of summarise_contig
+    """
+    summaries = []
+    for contig in contigs:
+        indexed = index is not None and contig in index.contigs
+        if results is not None:
+            if not (result := results[contig]).records:
+                continue
+            bounds = (result.first_position, result.last_position)
+            records = result.records
+        elif indexed and (bounds := index.bounds(contig)) is not None:
+            records = index.contigs[contig].mapped
+        else:
+            continue
+        summaries.append(
+            ContigSummary(
+                contig=contig,
+                minPosition=bounds[0],
+                maxPosition=bounds[1],
+                recordCount=records,
+                compressedBytes=index.contig_bytes(contig) if indexed else None,
+            )
+        )
+    return summaries
+
+
+def save_summary(
+    vcf_location,
+    head,
+    index_size,
+    samples,
+    info_ids,
+    contigs,
+    status,
+    error=None,
+    run=None,
+    contigs_done=0,
+):
+    summary = VcfSummary(vcf_location)
+    summary.status = status
+    summary.error = error
+    summary.run = run
+    summary.contigsDone = contigs_done
+    summary.etag = head["ETag"].strip('"')
+    summary.vcfBytes = head["ContentLength"]
+    summary.indexBytes = index_size
+    summary.contigs = contigs
+    summary.recordCount = sum(contig.recordCount or 0 for contig in contigs)
+    summary.sampleCount = len(samples)
+    if sum(len(sample) for sample in samples) <= SAMPLE_NAMES_MAX_BYTES:
+        summary.sampleNames = samples
+    summary.hasAc = "AC" in info_ids
+    summary.hasAn = "AN" in info_ids
+    summary.hasEnd = "END" in info_ids
+    summary.hasSvtype = "SVTYPE" in info_ids
+    summary.save()
+
+
+def save_failure(vcf_location, error):
+    """Records that vcf_location could neither be summarised nor indexed"""
+    summary = VcfSummary(vcf_location)
+    summary.status = SummaryStatus.FAILED
+    summary.error = str(error)
+    summary.save()
+
+
+def summarise_vcf(vcf_location, context):
+    """
+    Starts summarising vcf_location, each contig is summarised by its own
+    invocation of this function, see summarise_vcf_contig
+    """
+    errored, error, contigs = get_vcf_chromosomes(vcf_location)
+    if errored:
+        print(error)
+        save_failure(vcf_location, error)
+        return
+
+    bucket, key = parse_s3_url(vcf_location)
+    head = s3.head_object(Bucket=bucket, Key=key)
+    etag = head["ETag"].strip('"')
+    samples, info_ids = read_header(vcf_location)
+    index, index_size = read_index(bucket, key)
+    # bounds from the index are cheap, and kept if the scan fails. The
+    # summary also counts the contigs of this run as they finish
+    save_summary(
+        vcf_location,
+        head,
+        index_size,
+        samples,
+        info_ids,
+        contig_summaries(index, contigs) if index is not None else [],
+        SummaryStatus.INDEXED if index is not None else SummaryStatus.PENDING,
+        run=context.aws_request_id,
+    )
+    site_index = ENV_CONFIG.CONFIG_VARIANT_SEARCH_SITE_INDEX
+    # genotypes are only read when needed, they are most of the cost
+    sidecar = (
+        site_index
+        and bool(samples)
+        and ENV_CONFIG.CONFIG_VARIANT_SEARCH_GENOTYPE_SIDECAR
+    )
+    missing_counts = site_index and not {"AC", "AN"} <= info_ids
+    sample_count = len(samples) if sidecar or missing_counts else 0
+    if sidecar:
+        save_genotype_samples(vcf_location, samples)
+    if missing_counts:
+        print(f"Filling INFO/AC and INFO/AN of {vcf_location} from genotypes")
+    if site_index:
+        # search ignores the index until every contig is summarised
+        save_manifest(
+            vcf_location,
+            {"vcf_location": vcf_location, "etag": etag, "status": "partial"},
+        )
+
+    event = {
+        "vcf_location": vcf_location,
+        "etag": etag,
+        # checkpoints of an earlier summary are not reused
+        "run": context.aws_request_id,
+        "contigs": contigs,
+        "sample_count": sample_count,
+        "sidecar": sidecar,
+        "site_index": site_index,
+    }
+    if not contigs:
+        finish_summary(event)
+        return
+    for contig in contigs:
+        aws_lambda.invoke(
+            FunctionName=context.function_name,
+            InvocationType="Event",
+            Payload=json.dumps({**event, "contig": contig}),
+        )
+    print(f"Summarising {len(contigs)} contigs of {vcf_location}")
+
+
+def summarise_vcf_contig(event, context):
+    """
+    Summarises a contig until the invocation is about to time out, then
+    saves a checkpoint and invokes this function again to resume from it.
+    The invocation finishing the last contig finishes the summary.
+    """
+    vcf_location = event["vcf_location"]
+    contig = event["contig"]
+    checkpoint = None
+    if event.get("resume"):
+        checkpoint = load_checkpoint(vcf_location, contig, event["run"])
+    deadline = (
+        time.time()
+        + context.get_remaining_time_in_millis() / 1000
+        - CHECKPOINT_MARGIN_SECONDS
+    )
+
+    try:
+        result = summarise_contig(
+            vcf_location,
+            contig,
+            event["sample_count"],
+            event["sidecar"],
+            event["site_index"],
+            checkpoint,
+            deadline,
+        )
+    # any error fails the contig, rather than leaving the summary partial
+    except Exception as error:
+        print(f"Unable to summarise {vcf_location} {contig}\n", error)
+        save_checkpoint(
+            vcf_location, contig, {"run": event["run"], "status": "failed"}
+        )
+    else:
+        status = "complete" if result.resume is None else "partial"
+        save_checkpoint(
+            vcf_location,
+            contig,
+            {"run": event["run"], "status": status, **result._asdict()},
+        )
+        if result.resume is not None:
+            aws_lambda.invoke(
+                FunctionName=context.function_name,
+                InvocationType="Event",
+                Payload=json.dumps({**event, "resume": True}),
+            )
+            return
+    if count_contig(vcf_location, event["run"]) == len(event["contigs"]):
+        finish_summary(event)
+
+
+def count_contig(vcf_location, run):
+    """
+    Contigs of run finished so far, counted atomically so that only the
+    invocation finishing the last one finishes the summary. None when a
+    later run has replaced the summary.
+    """
+    summary = VcfSummary(vcf_location)
+    try:
+        summary.update(
+            actions=[VcfSummary.contigsDone.add(1)],
+            condition=VcfSummary.run == run,
+        )
+    except UpdateError as error:
+        if error.cause_response_code != "ConditionalCheckFailedException":
+            raise
+        print(f"Summary of {vcf_location} is no longer of this run")
+        return None
+    return summary.contigsDone
+
+
+def finish_summary(event):
+    """
+    Saves the summary and the manifest of a vcf once every contig has been
+    summarised. If any could not be, the manifest is saved as failed and
+    the summary keeps the bounds read from the index, with the error.
+    """
+    vcf_location = event["vcf_location"]
+    contigs = event["contigs"]
+    with ThreadPoolExecutor(THREADS) as executor:
+        checkpoints = dict(
+            zip(
+                contigs,
+                executor.map(
+                    lambda contig: load_checkpoint(vcf_location, contig, event["run"]),
+                    contigs,
+                ),
+            )
+        )
+    bucket, key = parse_s3_url(vcf_location)
+    head = s3.head_object(Bucket=bucket, Key=key)
+    # every contig was counted after its checkpoint, so a missing one was lost
+    failed = [
+        contig
+        for contig, checkpoint in checkpoints.items()
+        if checkpoint is None or checkpoint["status"] != "complete"
+    ]
+    if head["ETag"].strip('"') != event["etag"]:
+        print(f"{vcf_location} changed while being summarised")
+        failed = contigs
+    samples, info_ids = read_header(vcf_location)
+    index, index_size = read_index(bucket, key)
+    if failed:
+        error = f"Unable to summarise contigs {', '.join(failed)} of {vcf_location}"
+        print(error)
+        if index is None:
+            save_failure(vcf_location, error)
+        else:
+            save_summary(
+                vcf_location,
+                head,
+                index_size,
+                samples,
+                info_ids,
+                contig_summaries(index, contigs),
+                SummaryStatus.INDEXED,
+                error,
+                run=event["run"],
+                contigs_done=len(contigs),
+            )
+        if event["site_index"]:
+            save_manifest(
+                vcf_location,
+                {
+                    "vcf_location": vcf_location,
+                    "etag": event["etag"],
+                    "status": "failed",
+                    "failed": failed,
+                },
+            )
+        return
+
+    results = {
+        contig: ContigResult(
+            **{field: checkpoint[field] for field in ContigResult._fields}
+        )
+        for contig, checkpoint in checkpoints.items()
+    }
+    save_summary(
+        vcf_location,
+        head,
+        index_size,
+        samples,
+        info_ids,
+        contig_summaries(index, contigs, results),
+        SummaryStatus.SUMMARISED,
+        run=event["run"],
+        contigs_done=len(contigs),
+    )
+    if not event["site_index"]:
+        return
+    save_manifest(
+        vcf_location,
+        {
+            "vcf_location": vcf_location,
+            "etag": event["etag"],
+            "status": "complete",
+            "bins": {contig: result.bins for contig, result in results.items()},
+            "blooms": contigs,
+            "genotypes": contigs if event["sidecar"] else [],
+            # counts are only answered from the index with AC and AN
+            "counts": all(result.counts for result in results.values()),
+            # some counts are only in the index, not in the vcf
+            "filled": any(result.filled for result in results.values()),
+        },
+    )
+    print(f"Summarised {len(contigs)} contigs of {vcf_location}")
+
+
+def lambda_handler(event, context):
+    print("Event Received: {}".format(json.dumps(event)))
+    if "contig" in event:
+        summarise_vcf_contig(event, context)
+    else:
+        summarise_vcf(event["vcf_location"], context)
+    clear_tmp()
+
+
+if __name__ == "__main__":
+    pass
@@ -49,7 +49,13 @@ locals {
     # authentication variables
     BEACON_ENABLE_AUTH = var.beacon-enable-auth
     # configurations
-    CONFIG_MAX_VARIANT_SEARCH_BASE_RANGE = var.config-max-variant-search-base-range
+    CONFIG_MAX_VARIANT_SEARCH_BASE_RANGE   = var.config-max-variant-search-base-range
+    CONFIG_VARIANT_SEARCH_SPLIT_BYTES      = var.config-variant-search-split-bytes
+    CONFIG_VARIANT_SEARCH_MAX_CONCURRENCY  = var.config-variant-search-max-concurrency
+    CONFIG_VARIANT_SEARCH_HEDGE_PERCENTILE = var.config-variant-search-hedge-percentile
+    CONFIG_VARIANT_SEARCH_FANOUT_WIDTH     = var.config-variant-search-fanout-width
+    CONFIG_VARIANT_SEARCH_SITE_INDEX       = var.config-variant-search-site-index
+    CONFIG_VARIANT_SEARCH_GENOTYPE_SIDECAR = var.config-variant-search-genotype-sidecar
   }
   # variant related variables
   variant_variables = {
@@ -124,6 +130,7 @@ module "lambda-submitDataset" {
     {
       DYNAMO_DATASETS_TABLE = aws_dynamodb_table.datasets.name
       INDEXER_LAMBDA        = module.lambda-indexer.lambda_function_name
+      SUMMARISE_VCF_LAMBDA  = module.lambda-summariseVcf.lambda_function_name
     },
     local.variant_variables,
     local.sbeacon_variables,
@@ -564,10 +571,14 @@ module "lambda-splitQuery" {
   source_path        = "${path.module}/lambda/splitQuery"
   tags               = var.common-tags
 
-  environment_variables = {
+  environment_variables = merge({
     PERFORM_QUERY_LAMBDA    = module.lambda-performQuery.lambda_function_name,
     PERFORM_QUERY_TOPIC_ARN = aws_sns_topic.performQuery.arn
-  }
+    },
+    local.sbeacon_variables,
+    local.athena_variables,
+    local.dynamodb_variables
+  )
 
   layers = [
     local.python_libraries_layer,
@@ -603,6 +614,38 @@ module "lambda-performQuery" {
     VARIANTS_BUCKET = aws_s3_bucket.variants-bucket.bucket
     },
     local.sbeacon_variables,
+    local.athena_variables,
+    local.dynamodb_variables
+  )
+}
+
+#
+# summariseVcf Lambda Function
+#
+module "lambda-summariseVcf" {
+  source = "terraform-aws-modules/lambda/aws"
+
+  function_name          = "summariseVcf"
+  description            = "Profiles a vcf into the VcfSummaries table and builds its site index answering boolean and count queries."
+  handler                = "lambda_function.lambda_handler"
+  runtime                = "python3.12"
+  memory_size            = 1769
+  timeout                = 900
+  ephemeral_storage_size = 1024
+  attach_policy_json     = true
+  policy_json            = data.aws_iam_policy_document.lambda-summariseVcf.json
+  source_path            = "${path.module}/lambda/summariseVcf"
+  tags                   = var.common-tags
+
+  layers = [
+    local.binaries_layer,
+    local.python_libraries_layer,
+    local.python_modules_layer
+  ]
+
+  environment_variables = merge(
+    local.sbeacon_variables,
+    local.athena_variables,
     local.dynamodb_variables
   )
 }
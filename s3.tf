@@ -89,6 +89,19 @@ resource "aws_s3_bucket_lifecycle_configuration" "metadata_bucket_lifecycle" {
       days = 2
     }
   }
+
+  rule {
+    id     = "clean-spilled-responses"
+    status = "Enabled"
+
+    filter {
+      prefix = "query-spill/"
+    }
+
+    expiration {
+      days = 1
+    }
+  }
 }
 
 # 
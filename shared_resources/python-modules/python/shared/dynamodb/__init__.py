@@ -1,3 +1,11 @@
 from .datasets import Dataset, VcfChromosomeMap
 from .ontologies import Anscestors, Descendants, Ontology, TermLabels
-from .variant_queries import VariantQuery, VariantResponse, VariantResponseIndex, S3Location
+from .variant_queries import (
+    VariantQuery,
+    VariantResponse,
+    VariantResponseIndex,
+    S3Location,
+    cancel_query,
+    is_query_cancelled,
+)
+from .vcf_summaries import VcfSummary, ContigSummary, SummaryStatus
@@ -1,5 +1,6 @@
 from datetime import datetime, timezone, timedelta
 from enum import Enum
+import time
 
 import boto3
 from pynamodb.models import Model
@@ -18,6 +19,8 @@ from shared.utils import ENV_DYNAMO
 
 SESSION = boto3.session.Session()
 REGION = SESSION.region_name
+# workers check whether their query was cancelled at most this often
+CANCELLATION_POLL_SECONDS = 1
 
 
 def get_current_time_utc():
@@ -44,6 +47,7 @@ class VariantQuery(Model):
     elapsedTime = NumberAttribute(default_for_new=-1)
     timeToExist = TTLAttribute(default_for_new=timedelta(minutes=5))
     complete = BooleanAttribute(default_for_new=False)
+    cancelled = BooleanAttribute(null=True)
 
     # atomically increment
     def getResponseNumber(self):
@@ -65,6 +69,43 @@ class VariantQuery(Model):
         )
 
 
+# query id -> (time of last check, cancelled)
+cancellations = {}
+
+
+def cancel_query(query_id):
+    """Flags a query so its outstanding splitQuery/performQuery work stops"""
+    VariantQuery(query_id).update(
+        actions=[
+            VariantQuery.cancelled.set(True),
+            VariantQuery.timeToExist.set(timedelta(minutes=5)),
+        ]
+    )
+    cancellations[query_id] = (time.time(), True)
+
+
+def is_query_cancelled(query_id):
+    """Polls the cancellation flag, at most once per CANCELLATION_POLL_SECONDS"""
+    now = time.time()
+    checked, cancelled = cancellations.get(query_id, (0, False))
+    if cancelled or now - checked < CANCELLATION_POLL_SECONDS:
+        return cancelled
+
+    try:
+        cancelled = bool(VariantQuery.get(query_id, attributes_to_get=["cancelled"]).cancelled)
+    except VariantQuery.DoesNotExist:
+        cancelled = False
+    except Exception as e:
+        print("Unable to check cancellation\n", e)
+        cancelled = False
+
+    # forget queries that finished long ago in warm containers
+    if len(cancellations) > 1000:
+        cancellations.clear()
+    cancellations[query_id] = (now, cancelled)
+    return cancelled
+
+
 class VariantResponseIndex(LocalSecondaryIndex):
     class Meta:
         index_name = "responseNumber_index"
@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+
+import boto3
+from pynamodb.attributes import (
+    BooleanAttribute,
+    ListAttribute,
+    MapAttribute,
+    NumberAttribute,
+    UnicodeAttribute,
+    UTCDateTimeAttribute,
+)
+from pynamodb.models import Model
+from strenum import StrEnum
+
+from shared.utils import ENV_DYNAMO
+
+
+SESSION = boto3.session.Session()
+REGION = SESSION.region_name
+
+
+def get_current_time_utc():
+    return datetime.now(timezone.utc)
+
+
+class SummaryStatus(StrEnum):
+    # being summarised from a vcf whose index could not be read
+    PENDING = "pending"
+    # bounds of the contigs read from the index of the vcf, before or
+    # without a scan of its records
+    INDEXED = "indexed"
+    # bounds and counts of the contigs read from every record
+    SUMMARISED = "summarised"
+    # neither, the summary only records the error
+    FAILED = "failed"
+
+
+class ContigSummary(MapAttribute):
+    contig = UnicodeAttribute()
+    # POS of the first and last records, bounds of them when indexed
+    minPosition = NumberAttribute()
+    maxPosition = NumberAttribute()
+    # null when indexed from an index without record counts
+    recordCount = NumberAttribute(null=True)
+    compressedBytes = NumberAttribute(null=True)
+
+
+# vcf summaries table, profiles written by summariseVcf at submission
+class VcfSummary(Model):
+    class Meta:
+        table_name = ENV_DYNAMO.DYNAMO_VCF_SUMMARIES_TABLE
+        region = REGION
+
+    vcfLocation = UnicodeAttribute(hash_key=True)
+    status = UnicodeAttribute(default=SummaryStatus.SUMMARISED)
+    # why the vcf could not be summarised, even if it was indexed
+    error = UnicodeAttribute(null=True)
+    # summariseVcf invocation summarising the vcf, and its contigs finished
+    run = UnicodeAttribute(null=True)
+    contigsDone = NumberAttribute(default=0)
+    # the summary describes only this version of the vcf
+    etag = UnicodeAttribute(null=True)
+    vcfBytes = NumberAttribute(null=True)
+    indexBytes = NumberAttribute(null=True)
+    contigs = ListAttribute(of=ContigSummary, default=list)
+    recordCount = NumberAttribute(default=0)
+    sampleCount = NumberAttribute(default=0)
+    # empty when the names do not fit in an item
+    sampleNames = ListAttribute(of=UnicodeAttribute, default=list)
+    hasAc = BooleanAttribute(default=False)
+    hasAn = BooleanAttribute(default=False)
+    hasEnd = BooleanAttribute(default=False)
+    hasSvtype = BooleanAttribute(default=False)
+    updateDateTime = UTCDateTimeAttribute(default_for_new=get_current_time_utc)
+
+    def contig(self, contig):
+        """ContigSummary of contig, None when the vcf has no records on it"""
+        return next((c for c in self.contigs if c.contig == contig), None)
+
+
+if __name__ == "__main__":
+    pass
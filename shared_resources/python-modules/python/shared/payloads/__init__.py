@@ -1,2 +1,4 @@
 from .lambda_payloads import PerformQueryPayload, SplitQueryPayload
 from .lambda_responses import PerformQueryResponse, SplitQueryResponse
+from .compact_responses import encode_responses, decode_responses
+from .chunk_templates import encode_chunk, decode_chunk
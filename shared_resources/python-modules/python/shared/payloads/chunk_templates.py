@@ -0,0 +1,75 @@
+import base64
+import gzip
+import json
+
+
+TEMPLATE_KEY = "shared"
+# chunks larger than this are sent gzipped
+COMPRESS_ABOVE_BYTES = 100 * 1024
+
+
+def pack_payloads(payloads):
+    """
+    Packs the performQuery payloads of a splitQuery chunk as a template of
+    the parameters they share and a task per payload holding the others.
+    Sample lists are sent once, tasks refer to them by index.
+    """
+    shared = {
+        key: value
+        for key, value in payloads[0].items()
+        if key != "samples" and all(key in p and p[key] == value for p in payloads)
+    }
+    sample_lists = []
+    # samples -> index in sample_lists
+    sample_indexes = {}
+    tasks = []
+
+    for payload in payloads:
+        task = {key: value for key, value in payload.items() if key not in shared}
+        if "samples" in task:
+            samples = tuple(task["samples"])
+            if samples not in sample_indexes:
+                sample_indexes[samples] = len(sample_lists)
+                sample_lists.append(task["samples"])
+            task["samples"] = sample_indexes[samples]
+        tasks.append(task)
+
+    return {TEMPLATE_KEY: shared, "sample_lists": sample_lists, "tasks": tasks}
+
+
+def is_packed(chunk):
+    return isinstance(chunk, dict) and TEMPLATE_KEY in chunk
+
+
+def unpack_payloads(chunk):
+    """Expands a chunk of pack_payloads back to its payloads"""
+    payloads = []
+    for task in chunk["tasks"]:
+        payload = {**chunk[TEMPLATE_KEY], **task}
+        if "samples" in task:
+            payload["samples"] = chunk["sample_lists"][task["samples"]]
+        payloads.append(payload)
+    return payloads
+
+
+def encode_chunk(payloads):
+    """Payload of a splitQuery invocation for a chunk of performQuery payloads"""
+    # stringified payload, parameters shared by the payloads are sent once
+    payload_str = json.dumps(pack_payloads(payloads))
+
+    if len(payload_str) > COMPRESS_ABOVE_BYTES:
+        payload_str = json.dumps(
+            base64.b64encode(gzip.compress(payload_str.encode())).decode()
+        )
+    return payload_str
+
+
+def decode_chunk(event):
+    """Payloads of a splitQuery invocation event, as built by encode_chunk"""
+    # if gzipped
+    if isinstance(event, str):
+        event = json.loads(gzip.decompress(base64.b64decode(event.encode())))
+    # shared query parameters and sample lists are expanded into each payload
+    if is_packed(event):
+        event = unpack_payloads(event)
+    return event
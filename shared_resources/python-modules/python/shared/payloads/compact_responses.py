@@ -0,0 +1,166 @@
+import base64
+import json
+import zlib
+
+import jsons
+
+from .lambda_responses import PerformQueryResponse
+
+
+# key of an encoded batch of responses in a lambda response
+COMPACT_KEY = "compact_responses"
+
+
+# per response columns, sent as json next to the compressed variants and samples
+RESPONSE_COLUMNS = (
+    "dataset_id",
+    "exists",
+    "all_alleles_count",
+    "call_count",
+    "chromosome",
+)
+
+
+def compress(data: bytes):
+    return base64.b64encode(zlib.compress(data, 6)).decode()
+
+
+def decompress(blob: str):
+    return zlib.decompress(base64.b64decode(blob))
+
+
+def encode_responses(responses, samples):
+    """
+    Encodes the responses of a performQuery invocation as columns. Each
+    response is a dict with dataset_id, exists, all_alleles_count,
+    call_count, chromosome, variants as (position, reference, alternate,
+    variant_type) tuples and sample_indexes into samples. The variants of
+    all responses are formatted once as in PerformQueryResponse, one per
+    line, and the samples are sent as a dictionary shared by the responses,
+    holding only those carrying a variant. Both are zlib compressed and
+    base64 encoded.
+    """
+    used = sorted({n for response in responses for n in response["sample_indexes"]})
+    dictionary = {n: code for code, n in enumerate(used)}
+    encoded = {field: [] for field in RESPONSE_COLUMNS}
+    encoded["variant_counts"] = []
+    encoded["sample_counts"] = []
+    variants = []
+    columns = {"sample_codes": [], "samples": [samples[n] for n in used]}
+
+    for response in responses:
+        for field in RESPONSE_COLUMNS:
+            encoded[field].append(response[field])
+        encoded["variant_counts"].append(len(response["variants"]))
+        # ["Chr1 123 A G SNP"]
+        variants += [
+            f"{response['chromosome']}\t{position}\t{reference}\t{alternate}\t{variant_type}"
+            for position, reference, alternate, variant_type in response["variants"]
+        ]
+        encoded["sample_counts"].append(len(response["sample_indexes"]))
+        columns["sample_codes"] += sorted(
+            dictionary[n] for n in response["sample_indexes"]
+        )
+
+    # plain text, json would escape every tab and unescape it when decoded
+    encoded["variants"] = compress("\n".join(variants).encode())
+    encoded["columns"] = compress(json.dumps(columns, separators=(",", ":")).encode())
+    return {COMPACT_KEY: encoded}
+
+
+def is_compact(response):
+    return isinstance(response, dict) and COMPACT_KEY in response
+
+
+class CompactColumns:
+    """Variants and sample columns of a batch, each decoded when first read"""
+
+    __slots__ = ("encoded", "_variants", "_columns")
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+        self._variants = None
+        self._columns = None
+
+    @property
+    def variants(self):
+        if self._variants is None:
+            text = decompress(self.encoded["variants"]).decode()
+            self._variants = text.split("\n") if text else []
+        return self._variants
+
+    def __getitem__(self, field):
+        if self._columns is None:
+            self._columns = json.loads(decompress(self.encoded["columns"]))
+        return self._columns[field]
+
+
+class CompactQueryResponse:
+    """
+    Response of performQuery decoded from encode_responses. It has the
+    attributes of PerformQueryResponse, variants and sample_names are only
+    formatted when they are first read.
+    """
+
+    __slots__ = (
+        "dataset_id",
+        "exists",
+        "all_alleles_count",
+        "call_count",
+        "chromosome",
+        "columns",
+        "variant_slice",
+        "sample_slice",
+    )
+
+    def __init__(self, encoded, n, columns, variant_slice, sample_slice):
+        self.dataset_id = encoded["dataset_id"][n]
+        self.exists = encoded["exists"][n]
+        self.all_alleles_count = encoded["all_alleles_count"][n]
+        self.call_count = encoded["call_count"][n]
+        self.chromosome = encoded["chromosome"][n]
+        self.columns = columns
+        self.variant_slice = variant_slice
+        self.sample_slice = sample_slice
+
+    @property
+    def variants(self):
+        # ["Chr1 123 A G SNP"]
+        if self.variant_slice.start == self.variant_slice.stop:
+            return []
+        return self.columns.variants[self.variant_slice]
+
+    @property
+    def sample_names(self):
+        if self.sample_slice.start == self.sample_slice.stop:
+            return []
+        samples = self.columns["samples"]
+        codes = self.columns["sample_codes"][self.sample_slice]
+        return [samples[code] for code in codes]
+
+
+def decode_responses(responses):
+    """
+    Yields the responses of a splitQuery invocation, expanding encoded
+    batches. Responses that are not encoded are deserialised as before.
+    """
+    for response in responses:
+        if not is_compact(response):
+            yield jsons.load(response, PerformQueryResponse)
+            continue
+
+        encoded = response[COMPACT_KEY]
+        columns = CompactColumns(encoded)
+        variant_start = sample_start = 0
+        for n, (variant_count, sample_count) in enumerate(
+            zip(encoded["variant_counts"], encoded["sample_counts"])
+        ):
+            yield CompactQueryResponse(
+                encoded,
+                n,
+                columns,
+                slice(variant_start, variant_start + variant_count),
+                slice(sample_start, sample_start + sample_count),
+            )
+            variant_start += variant_count
+            sample_start += sample_count
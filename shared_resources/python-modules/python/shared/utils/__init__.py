@@ -8,5 +8,11 @@ from .lambda_utils import (
     ENV_COGNITO,
     make_temp_file,
     clear_tmp,
+    preserve_tmp,
+    parse_s3_url,
 )
 from .lambda_utils import LambdaClient
+from .async_lambda import AsyncLambdaClient
+from .concurrency_limiter import lambda_limiter
+from .response_spill import spill_response, resolve_spilled
+from .variant_matchers import compile_matcher
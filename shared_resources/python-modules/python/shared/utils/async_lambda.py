@@ -0,0 +1,294 @@
+import asyncio
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+import queue
+import threading
+import time
+from urllib.parse import quote
+
+import boto3
+import botocore
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+from .concurrency_limiter import lambda_limiter
+from .lambda_utils import RETRYABLE_ERRORS, LambdaClient
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# async (pooled aiohttp connections) or threads (blocking boto3 invocations)
+INVOKE_ENGINE = os.environ.get("LAMBDA_INVOKE_ENGINE", "async")
+# e.g. the address of benchmarks/stub_lambda.py for load testing
+LAMBDA_ENDPOINT_URL = os.environ.get("LAMBDA_ENDPOINT_URL")
+# threads of the blocking fallback, shared by every stream of the container
+THREADS = 200
+READ_TIMEOUT = 300
+# recent latencies per function from which the hedging delay is learned
+LATENCY_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+# at most this fraction of the payloads of a stream is sent twice
+HEDGE_FRACTION = 0.1
+
+
+class AsyncLambdaClient:
+    """
+    Invokes a lambda function once per payload from an event loop running in
+    a background thread of the container, so thousands of invocations can be
+    in flight without a thread each. Responses are streamed back to the
+    calling thread in the order they complete.
+
+    Requests are signed with botocore and sent over a single aiohttp
+    connection pool. Without aiohttp, or with LAMBDA_INVOKE_ENGINE=threads,
+    invocations run on a bounded thread pool instead. Either way every
+    invocation holds a slot of the container's lambda_limiter.
+    """
+
+    def __init__(self, engine=INVOKE_ENGINE, endpoint_url=LAMBDA_ENDPOINT_URL):
+        if engine == "async" and aiohttp is None:
+            print("aiohttp is not installed, invoking lambdas from threads")
+            engine = "threads"
+        self.engine = engine
+        session = boto3.session.Session()
+        self.region = session.region_name
+        self.credentials = session.get_credentials()
+        self.endpoint_url = (
+            endpoint_url or f"https://lambda.{self.region}.amazonaws.com"
+        ).rstrip("/")
+        self.sync_client = LambdaClient(endpoint_url=endpoint_url)
+        self.executor = ThreadPoolExecutor(THREADS)
+        self.lock = threading.Lock()
+        self.loop = None
+        self.http = None
+        self.limiter = lambda_limiter
+        # function name -> seconds of its recent invocations
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def _start(self):
+        # a single loop per container, kept across warm invocations
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        return self.loop
+
+    def close(self):
+        """Releases the connections, the event loop and the threads"""
+        with self.lock:
+            loop, self.loop = self.loop, None
+        if loop is not None:
+            if self.http is not None:
+                asyncio.run_coroutine_threadsafe(self.http.close(), loop).result()
+                self.http = None
+            loop.call_soon_threadsafe(loop.stop)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def hedge_delay(self, function_name, percentile):
+        """Seconds after which an invocation is a straggler, None until learned"""
+        latencies = sorted(self.latencies[function_name])
+        # hedges of the thread engine would only queue for a busy thread
+        if not percentile or self.engine == "threads":
+            return None
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def stream(
+        self,
+        function_name,
+        payloads,
+        concurrency,
+        before_invoke=None,
+        hedge_percentile=None,
+    ):
+        """
+        Invokes function_name with each payload (str), at most concurrency
+        at a time. Yields (n, response payload, seconds) as invocations
+        complete, n being the index of the payload and seconds the time the
+        answering invocation took once it was let through the limiter.
+        before_invoke(n) is checked just before payload n is sent, when it
+        returns False the payload is skipped and yielded with a response of
+        None.
+        With hedge_percentile, a payload still running after that percentile
+        of the recent latencies of function_name is sent again and the
+        first response wins, each payload is still yielded once.
+        Closing the generator cancels the invocations not yet completed.
+        """
+        if not payloads:
+            return
+        results = queue.SimpleQueue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._invoke_all(
+                function_name,
+                payloads,
+                concurrency,
+                before_invoke,
+                results,
+                hedge_percentile,
+            ),
+            self._start(),
+        )
+
+        try:
+            for _ in payloads:
+                n, response, seconds, error = results.get()
+                if error is not None:
+                    raise error
+                yield n, response, seconds
+            future.result()
+        finally:
+            future.cancel()
+
+    async def _invoke_all(
+        self,
+        function_name,
+        payloads,
+        concurrency,
+        before_invoke,
+        results,
+        hedge_percentile,
+    ):
+        loop = asyncio.get_running_loop()
+        # workers take the next payload when they are free, so only
+        # concurrency invocations and their responses are held at a time
+        pending = enumerate(payloads)
+        # the delay is fixed for the stream, its own stragglers would raise it
+        delay = self.hedge_delay(function_name, hedge_percentile)
+        hedges = [math.ceil(len(payloads) * HEDGE_FRACTION)]
+
+        async def worker():
+            for n, payload in pending:
+                try:
+                    if before_invoke is not None and not await loop.run_in_executor(
+                        self.executor, before_invoke, n
+                    ):
+                        results.put((n, None, 0, None))
+                        continue
+                    if delay is None:
+                        response, seconds = await self._invoke(function_name, payload)
+                    else:
+                        response, seconds = await self._invoke_hedged(
+                            function_name, payload, delay, hedges
+                        )
+                    results.put((n, response, seconds, None))
+                except Exception as error:
+                    results.put((n, None, 0, error))
+
+        await asyncio.gather(
+            *(worker() for _ in range(max(1, min(concurrency, len(payloads)))))
+        )
+
+    async def _invoke_hedged(self, function_name, payload, delay, hedges):
+        sent = asyncio.Event()
+        tasks = {asyncio.ensure_future(self._invoke(function_name, payload, sent))}
+        try:
+            # the delay counts from the request, not from the wait for a slot
+            waiting = asyncio.ensure_future(sent.wait())
+            await asyncio.wait(tasks | {waiting}, return_when=asyncio.FIRST_COMPLETED)
+            waiting.cancel()
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and hedges[0] > 0:
+                hedges[0] -= 1
+                print(f"Hedging {function_name} invocation after {delay:.2f}s")
+                tasks.add(asyncio.ensure_future(self._invoke(function_name, payload)))
+
+            # the first successful response wins, the other one is dropped
+            while True:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                if not tasks:
+                    return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _invoke(self, function_name, payload, sent=None):
+        """
+        Response payload of a single invocation and its seconds, not counting
+        the wait for the limiter
+        """
+        if self.engine == "threads":
+            if sent is not None:
+                sent.set()
+            start = time.time()
+            response = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._invoke_blocking, function_name, payload
+            )
+            seconds = time.time() - start
+            self.latencies[function_name].append(seconds)
+            return response, seconds
+
+        if self.http is None:
+            self.http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0),
+                timeout=aiohttp.ClientTimeout(total=READ_TIMEOUT),
+            )
+        url = f"{self.endpoint_url}/2015-03-31/functions/{quote(function_name, safe='')}/invocations"
+        body = payload.encode()
+        attempt = 0
+
+        while True:
+            granted = await self.limiter.acquire_async()
+            if sent is not None:
+                sent.set()
+            succeeded = throttled = False
+            try:
+                # signed once a slot is free, signatures expire
+                request = AWSRequest(
+                    method="POST",
+                    url=url,
+                    data=body,
+                    headers={"X-Amz-Invocation-Type": "RequestResponse"},
+                )
+                SigV4Auth(
+                    self.credentials.get_frozen_credentials(), "lambda", self.region
+                ).add_auth(request)
+                async with self.http.post(
+                    url, data=body, headers=dict(request.headers.items())
+                ) as response:
+                    content = await response.read()
+                    status = response.status
+                    code = response.headers.get("x-amzn-ErrorType", "").split(":")[0]
+                    if not code and status >= 500:
+                        code = "ServiceException"
+                succeeded = status < 300
+                throttled = code == "TooManyRequestsException"
+            finally:
+                self.limiter.release(granted, throttled, failed=not succeeded)
+            if succeeded:
+                seconds = time.time() - granted
+                self.latencies[function_name].append(seconds)
+                return content, seconds
+
+            error = botocore.exceptions.ClientError(
+                {
+                    "Error": {"Code": code, "Message": content.decode()},
+                    "ResponseMetadata": {"HTTPStatusCode": status},
+                },
+                "Invoke",
+            )
+            # same handling as LambdaClient.invoke
+            if code not in RETRYABLE_ERRORS:
+                raise error
+            if (delay := self.limiter.retry_delay(attempt)) is None:
+                print("Lambda retry budget exhausted")
+                raise error
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _invoke_blocking(self, function_name, payload):
+        response = self.sync_client.invoke(
+            FunctionName=function_name,
+            InvocationType="RequestResponse",
+            Payload=payload,
+        )
+        return response["Payload"].read()
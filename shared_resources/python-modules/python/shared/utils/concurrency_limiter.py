@@ -0,0 +1,176 @@
+import asyncio
+from collections import deque
+import json
+import os
+import random
+import threading
+import time
+
+
+# in-flight window of lambda invocations per container
+INITIAL_CONCURRENCY = 50
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 1000
+# the window shrinks to this fraction on a throttle
+DECREASE_FACTOR = 0.5
+# exponential backoff with full jitter
+BACKOFF_BASE_SECONDS = 0.1
+BACKOFF_CAP_SECONDS = 10
+# retries are paid from a budget refilled by successful invocations, so an
+# account that keeps throttling fails calls rather than retrying forever
+RETRY_BUDGET = 100
+RETRY_BUDGET_REFILL = 0.2
+
+
+class ConcurrencyLimiter:
+    """
+    AIMD window over the lambda invocations of a container, shared by
+    threads (acquire) and coroutines (acquire_async). As in TCP, the window
+    doubles every round trip until the first throttle (slow start), then
+    grows by one per window of successful invocations and halves on each
+    throttle.
+    """
+
+    def __init__(
+        self,
+        initial=INITIAL_CONCURRENCY,
+        minimum=MIN_CONCURRENCY,
+        maximum=MAX_CONCURRENCY,
+    ):
+        self.lock = threading.Lock()
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        # no throttle seen below this window yet
+        self.threshold = float(maximum)
+        self.in_flight = 0
+        # callables handing a freed slot to a waiting thread or coroutine
+        self.waiters = deque()
+        self.last_decrease = 0
+        self.budget = float(RETRY_BUDGET)
+        # counters since the container started
+        self.invocations = 0
+        self.throttles = 0
+        self.retries = 0
+        self.exhausted = 0
+
+    def _take(self):
+        if not self.waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            self.invocations += 1
+            return True
+        return False
+
+    def acquire(self):
+        """Waits for a slot, returns the time it was granted for release"""
+        with self.lock:
+            if self._take():
+                return time.time()
+            ready = threading.Event()
+            self.waiters.append(ready.set)
+        ready.wait()
+        return time.time()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        waiter = lambda: loop.call_soon_threadsafe(self._hand_over, ready)
+        with self.lock:
+            if self._take():
+                return time.time()
+            self.waiters.append(waiter)
+
+        try:
+            await ready
+            return time.time()
+        except asyncio.CancelledError:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    waiter = None
+            # the slot was handed over before the coroutine was cancelled
+            if waiter is not None and ready.done() and not ready.cancelled():
+                self.release(failed=True)
+            raise
+
+    def _hand_over(self, ready):
+        if ready.cancelled():
+            self.release(failed=True)
+        else:
+            ready.set_result(None)
+
+    def release(self, granted=None, throttled=False, failed=False):
+        with self.lock:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                # throttles of invocations sent before the last decrease
+                # are part of the burst that already shrank the window
+                if granted is None or granted > self.last_decrease:
+                    self.last_decrease = time.time()
+                    self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+                    self.threshold = self.limit
+            elif not failed:
+                increase = 1 if self.limit < self.threshold else 1 / self.limit
+                self.limit = min(self.maximum, self.limit + increase)
+                self.budget = min(RETRY_BUDGET, self.budget + RETRY_BUDGET_REFILL)
+
+            wake = []
+            while self.waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self.invocations += 1
+                wake.append(self.waiters.popleft())
+        for waiter in wake:
+            waiter()
+
+    def retry_delay(self, attempt):
+        """Seconds to wait before retry number attempt, None when the budget is spent"""
+        with self.lock:
+            if self.budget < 1:
+                self.exhausted += 1
+                return None
+            self.budget -= 1
+            self.retries += 1
+        return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt))
+
+    def gauges(self):
+        with self.lock:
+            return {
+                "ConcurrencyLimit": int(self.limit),
+                "InFlight": self.in_flight,
+                "Waiting": len(self.waiters),
+                "RetryBudget": int(self.budget),
+                "Invocations": self.invocations,
+                "Throttles": self.throttles,
+                "Retries": self.retries,
+                "RetryBudgetExhausted": self.exhausted,
+            }
+
+    def log_metrics(self, function_name=None, namespace="sBeacon/LambdaInvocations"):
+        """Prints the gauges in CloudWatch embedded metric format"""
+        function_name = function_name or os.environ.get(
+            "AWS_LAMBDA_FUNCTION_NAME", "local"
+        )
+        gauges = self.gauges()
+        print(
+            json.dumps(
+                {
+                    "_aws": {
+                        "Timestamp": int(time.time() * 1000),
+                        "CloudWatchMetrics": [
+                            {
+                                "Namespace": namespace,
+                                "Dimensions": [["FunctionName"]],
+                                "Metrics": [{"Name": name} for name in gauges],
+                            }
+                        ],
+                    },
+                    "FunctionName": function_name,
+                    **gauges,
+                }
+            )
+        )
+
+
+# shared by every LambdaClient and AsyncLambdaClient of the container
+lambda_limiter = ConcurrencyLimiter()
@@ -0,0 +1,136 @@
+import re
+
+import numpy as np
+
+
+COMMA = ord(",")
+DOT = ord(".")
+ZERO = ord("0")
+NINE = ord("9")
+allele_pattern = re.compile(rb"[0-9]+|\.")
+
+
+def allele_matrix(genotypes):
+    """
+    Decodes [%GT,] text such as "0|1,0/0,./.,1," into a
+    (samples, ploidy) int8 matrix of allele indexes. Missing alleles and the
+    padding of samples with a lower ploidy are -1.
+    """
+    if isinstance(genotypes, str):
+        genotypes = genotypes.encode("ascii")
+    if not genotypes:
+        return np.empty((0, 0), dtype=np.int8)
+
+    data = np.frombuffer(genotypes, dtype=np.uint8)
+    digits = (data >= ZERO) & (data <= NINE)
+    # multi-digit alleles are rare, decode those records one sample at a time
+    if (digits[1:] & digits[:-1]).any():
+        return _allele_matrix_slow(genotypes)
+
+    commas = data == COMMA
+    sample_count = int(commas.sum()) + (0 if commas[-1] else 1)
+    positions = np.flatnonzero(digits | (data == DOT))
+    if not positions.size:
+        return np.full((sample_count, 1), -1, dtype=np.int8)
+
+    # an allele belongs to the sample of the number of commas before it
+    samples = np.cumsum(commas)[positions]
+    # position of each allele within its sample
+    first = np.flatnonzero(np.diff(samples, prepend=-1))
+    ordinals = np.arange(positions.size) - np.repeat(
+        first, np.diff(first, append=positions.size)
+    )
+
+    matrix = np.full((sample_count, int(ordinals.max()) + 1), -1, dtype=np.int8)
+    matrix[samples, ordinals] = np.where(
+        digits[positions], data[positions] - ZERO, -1
+    ).astype(np.int8)
+    return matrix
+
+
+def _allele_matrix_slow(genotypes):
+    return _fill(
+        [
+            [-1 if allele == b"." else int(allele) for allele in allele_pattern.findall(gt)]
+            for gt in bytes(genotypes).rstrip(b",").split(b",")
+        ]
+    )
+
+
+def tuples_matrix(calls):
+    """Same as allele_matrix, but for GT tuples such as those of pysam"""
+    return _fill(
+        [[-1 if allele is None else allele for allele in call or ()] for call in calls]
+    )
+
+
+def _fill(calls):
+    ploidy = max(max(map(len, calls), default=0), 1)
+    largest = max((max(call, default=-1) for call in calls), default=-1)
+    # int8 cannot hold more than 127 alternate alleles
+    matrix = np.full(
+        (len(calls), ploidy), -1, dtype=np.int8 if largest <= 127 else np.int16
+    )
+    for n, call in enumerate(calls):
+        matrix[n, : len(call)] = call
+    return matrix
+
+
+class GenotypeCounts:
+    """
+    Counts of the hit alleles of a single record, computed from its allele
+    matrix with array operations.
+    hit_indexes are the indexes of the hit ALTs, i.e. allele index - 1
+    """
+
+    def __init__(self, matrix, hit_indexes):
+        self.matrix = matrix
+        self.hits = np.isin(matrix, np.asarray(hit_indexes) + 1)
+
+    @property
+    def call_count(self):
+        return int(np.count_nonzero(self.hits))
+
+    @property
+    def total_count(self):
+        return int(np.count_nonzero(self.matrix >= 0))
+
+    @property
+    def hit_alleles(self):
+        """Allele indexes of the hit ALTs that are called in any sample"""
+        return np.unique(self.matrix[self.hits]).tolist()
+
+    @property
+    def carriers(self):
+        """Indexes of the samples carrying a hit ALT"""
+        return np.flatnonzero(self.hits.any(axis=1)).tolist()
+
+
+class PackedGenotypeCounts:
+    """
+    Same as GenotypeCounts, from the rows of a record in a genotype sidecar
+    restricted to the chosen samples, see site_index.GenotypeBin.
+    Rows hold the called alleles of each sample, then the copies of each ALT,
+    capped at 3, so counts are exact up to triploid calls.
+    """
+
+    def __init__(self, rows, hit_indexes):
+        self.hit_indexes = np.asarray(hit_indexes)
+        self.called = rows[0]
+        self.copies = rows[self.hit_indexes + 1]
+
+    @property
+    def call_count(self):
+        return int(self.copies.sum(dtype=np.int64))
+
+    @property
+    def total_count(self):
+        return int(self.called.sum(dtype=np.int64))
+
+    @property
+    def hit_alleles(self):
+        return (self.hit_indexes[self.copies.any(axis=1)] + 1).tolist()
+
+    @property
+    def carriers(self):
+        return np.flatnonzero(self.copies.any(axis=0)).tolist()
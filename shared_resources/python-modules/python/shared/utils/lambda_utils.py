@@ -3,13 +3,18 @@ import tempfile
 import shutil
 import os
 import time
-import random
+from urllib.parse import urlparse
 
 import botocore
 import boto3
 
+from .concurrency_limiter import lambda_limiter
 
-THROTTLE_DELAYS = [0.1 * i for i in range(1, 6)]
+
+# errors of the Invoke API worth retrying after a backoff
+RETRYABLE_ERRORS = ("TooManyRequestsException", "ServiceException")
+# paths in /tmp that survive clear_tmp, used by caches of warm containers
+PRESERVED_TMP_PATHS = set()
 
 
 # from https://bitbucket.csiro.au/users/jai014/repos/covidbeacon/browse
@@ -27,7 +32,7 @@ class Timer:
 
 # from https://bitbucket.csiro.au/users/jai014/repos/covidbeacon/browse
 class LambdaClient:
-    def __init__(self):
+    def __init__(self, endpoint_url=None):
         lambda_config = botocore.config.Config(
             read_timeout=300,
             max_pool_connections=500,
@@ -35,24 +40,32 @@ class LambdaClient:
                 "total_max_attempts": 1,
             },
         )
-        self.client = boto3.client("lambda", config=lambda_config)
+        self.client = boto3.client(
+            "lambda", config=lambda_config, endpoint_url=endpoint_url
+        )
+        self.limiter = lambda_limiter
 
     def invoke(self, **kwargs):
+        attempt = 0
         while True:
+            granted = self.limiter.acquire()
+            succeeded = throttled = False
             try:
                 response = self.client.invoke(**kwargs)
+                succeeded = True
+                return response
             except botocore.exceptions.ClientError as error:
-                response = error.response
-                if response["Error"]["Code"] == "TooManyRequestsException":
-                    time.sleep(random.choice(THROTTLE_DELAYS))
-                    continue
-                elif response["Error"]["Code"] == "ServiceException":
-                    time.sleep(random.choice(THROTTLE_DELAYS))
-                    continue
-                else:
+                code = error.response["Error"]["Code"]
+                throttled = code == "TooManyRequestsException"
+                if code not in RETRYABLE_ERRORS:
                     raise error
-            else:
-                return response
+                if (delay := self.limiter.retry_delay(attempt)) is None:
+                    print("Lambda retry budget exhausted")
+                    raise error
+            finally:
+                self.limiter.release(granted, throttled, failed=not succeeded)
+            attempt += 1
+            time.sleep(delay)
 
 
 class BeaconEnvironment:
@@ -294,12 +307,54 @@ class ConfigEnvironment:
     def CONFIG_MAX_VARIANT_SEARCH_BASE_RANGE(self):
         return int(os.environ["CONFIG_MAX_VARIANT_SEARCH_BASE_RANGE"])
 
+    @property
+    def CONFIG_VARIANT_SEARCH_SPLIT_BYTES(self):
+        return int(os.environ["CONFIG_VARIANT_SEARCH_SPLIT_BYTES"])
+
+    @property
+    def CONFIG_VARIANT_SEARCH_MAX_CONCURRENCY(self):
+        return int(os.environ["CONFIG_VARIANT_SEARCH_MAX_CONCURRENCY"])
+
+    @property
+    def CONFIG_VARIANT_SEARCH_HEDGE_PERCENTILE(self):
+        return float(os.environ["CONFIG_VARIANT_SEARCH_HEDGE_PERCENTILE"])
+
+    @property
+    def CONFIG_VARIANT_SEARCH_FANOUT_WIDTH(self):
+        return int(os.environ["CONFIG_VARIANT_SEARCH_FANOUT_WIDTH"])
+
+    @property
+    def CONFIG_VARIANT_SEARCH_SITE_INDEX(self):
+        return os.environ["CONFIG_VARIANT_SEARCH_SITE_INDEX"].strip().lower() in (
+            "true",
+            "1",
+        )
+
+    @property
+    def CONFIG_VARIANT_SEARCH_GENOTYPE_SIDECAR(self):
+        return os.environ[
+            "CONFIG_VARIANT_SEARCH_GENOTYPE_SIDECAR"
+        ].strip().lower() in ("true", "1")
+
+
+def parse_s3_url(url):
+    parsed = urlparse(url)
+    if parsed.scheme != "s3":
+        return None, None
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def preserve_tmp(path):
+    PRESERVED_TMP_PATHS.add(os.path.normpath(path))
+
 
 def clear_tmp():
     try:
         for file_name in os.listdir("/tmp"):
             file_path = "/tmp/" + file_name
-            if os.path.isfile(file_path):
+            if file_path in PRESERVED_TMP_PATHS:
+                continue
+            elif os.path.isfile(file_path):
                 os.unlink(file_path)
             elif os.path.isdir(file_path):
                 shutil.rmtree(file_path)
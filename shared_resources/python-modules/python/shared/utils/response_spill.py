@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import json
+import uuid
+
+import boto3
+
+from .lambda_utils import ENV_ATHENA, parse_s3_url
+
+
+# synchronous lambda responses are limited to 6 MB, leave room for the
+# responses of other payloads combined by splitQuery
+SPILL_THRESHOLD_BYTES = 4 * 1024 * 1024
+# expired by the lifecycle rules of the metadata bucket
+SPILL_PREFIX = "query-spill/"
+SPILL_KEY = "spilled_response"
+THREADS = 32
+
+
+s3 = boto3.client("s3")
+executor = ThreadPoolExecutor(THREADS)
+
+
+def spill_response(response, threshold=SPILL_THRESHOLD_BYTES):
+    """
+    Returns response itself when its json is small enough to be returned by
+    a lambda, otherwise writes it gzipped to the metadata bucket and returns
+    a pointer to it, resolved by resolve_spilled
+    """
+    body = json.dumps(response)
+    if len(body) <= threshold:
+        return response
+
+    bucket = ENV_ATHENA.ATHENA_METADATA_BUCKET
+    key = f"{SPILL_PREFIX}{uuid.uuid4().hex}.json.gz"
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=gzip.compress(body.encode(), compresslevel=1),
+        ContentEncoding="gzip",
+        ContentType="application/json",
+    )
+    print(f"Spilled {len(body)} bytes of response to s3://{bucket}/{key}")
+    return {SPILL_KEY: f"s3://{bucket}/{key}"}
+
+
+def is_spilled(response):
+    return isinstance(response, dict) and SPILL_KEY in response
+
+
+def load_spilled(response):
+    bucket, key = parse_s3_url(response[SPILL_KEY])
+    body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    return json.loads(gzip.decompress(body))
+
+
+def resolve_spilled(responses):
+    """
+    Replaces the pointers in a response of splitQuery, the response itself
+    or any of its items, by the responses they point to. Items are fetched
+    in parallel, those holding a list of responses are flattened. Responses
+    of delegated splitQuery invocations can hold pointers themselves, they
+    are resolved in turn.
+    """
+    if is_spilled(responses):
+        responses = load_spilled(responses)
+
+    while spilled := [n for n, response in enumerate(responses) if is_spilled(response)]:
+        loaded = dict(
+            zip(spilled, executor.map(load_spilled, [responses[n] for n in spilled]))
+        )
+        resolved = []
+        for n, response in enumerate(responses):
+            response = loaded.get(n, response)
+            # payloads of several regions return a response per region
+            if isinstance(response, list):
+                resolved.extend(response)
+            else:
+                resolved.append(response)
+        responses = resolved
+    return responses
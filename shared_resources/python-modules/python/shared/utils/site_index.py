@@ -0,0 +1,538 @@
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import math
+import struct
+import threading
+
+import boto3
+import botocore
+import numpy as np
+import pyorc
+from pyorc.predicates import PredicateColumn
+
+from .lambda_utils import ENV_ATHENA, parse_s3_url
+
+
+# sites of a vcf, summarised by summariseVcf, are kept under
+# SITE_INDEX_PREFIX/<hash of vcf>/contig=<contig>/bin=<n>.orc
+SITE_INDEX_PREFIX = "site-index/"
+BIN_BASES = 100000
+SITE_SCHEMA = (
+    "struct<pos:int,ref:string,alt:array<string>,ac:array<int>,an:int,vt:string>"
+)
+# rows per row group, groups outside the queried positions are skipped
+ROW_INDEX_STRIDE = 1000
+# bloom filters of pos:ref:alt keys, one per contig of a vcf
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+# bloom filters kept in memory per container
+BLOOM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# manifests kept in memory per container, enough for the vcfs of a dataset
+MANIFEST_CACHE_ENTRIES = 4096
+# genotype sidecar bins, see GenotypeBin
+GENOTYPE_MAGIC = b"SBGT"
+GENOTYPE_HEADER = struct.Struct("<4sIII")
+# copies of an allele are capped to fit 2 bits
+GENOTYPE_MAX_COPIES = 3
+THREADS = 32
+
+
+s3 = boto3.client("s3")
+executor = ThreadPoolExecutor(THREADS)
+
+
+def index_prefix(vcf_location):
+    return f"{SITE_INDEX_PREFIX}{hashlib.sha1(vcf_location.encode()).hexdigest()}/"
+
+
+def manifest_key(vcf_location):
+    return f"{index_prefix(vcf_location)}manifest.json"
+
+
+def bin_key(vcf_location, contig, bin):
+    return f"{index_prefix(vcf_location)}contig={contig}/bin={bin}.orc"
+
+
+def bloom_key(vcf_location, contig):
+    return f"{index_prefix(vcf_location)}contig={contig}/bloom.bin"
+
+
+def genotype_key(vcf_location, contig, bin):
+    return f"{index_prefix(vcf_location)}contig={contig}/bin={bin}.gt"
+
+
+def genotype_samples_key(vcf_location):
+    return f"{index_prefix(vcf_location)}samples.json"
+
+
+def checkpoint_key(vcf_location, contig):
+    return f"{index_prefix(vcf_location)}contig={contig}/checkpoint.json"
+
+
+def allele_hashes_key(vcf_location, contig):
+    return f"{index_prefix(vcf_location)}contig={contig}/alleles.bin"
+
+
+def allele_hash(position, reference, alt):
+    """64 bit hash of an allele, bases are compared case insensitively"""
+    key = f"{position}:{reference.upper()}:{alt.upper()}".encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    """
+    Bloom filter over allele hashes, probed at k bits derived from the two
+    halves of the hash (Kirsch and Mitzenmacher)
+    """
+
+    def __init__(self, bits, hashes, body):
+        self.bits = bits
+        self.hashes = hashes
+        self.body = body
+
+    @classmethod
+    def build(cls, allele_hashes, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+        allele_hashes = np.asarray(allele_hashes, dtype=np.uint64)
+        count = max(1, len(allele_hashes))
+        bits = math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2)
+        bits = max(64, (bits + 7) // 8 * 8)
+        hashes = max(1, round(bits / count * math.log(2)))
+
+        first = allele_hashes & np.uint64(0xFFFFFFFF)
+        second = (allele_hashes >> np.uint64(32)) | np.uint64(1)
+        flags = np.zeros(bits, dtype=bool)
+        for n in range(hashes):
+            flags[(first + np.uint64(n) * second) % np.uint64(bits)] = True
+        return cls(bits, hashes, np.packbits(flags, bitorder="little").tobytes())
+
+    def __contains__(self, allele_hash):
+        first = allele_hash & 0xFFFFFFFF
+        second = (allele_hash >> 32) | 1
+        for n in range(self.hashes):
+            bit = (first + n * second) % self.bits
+            if not self.body[bit >> 3] >> (bit & 7) & 1:
+                return False
+        return True
+
+    def to_bytes(self):
+        return struct.pack("<QI", self.bits, self.hashes) + self.body
+
+    @classmethod
+    def from_bytes(cls, data):
+        bits, hashes = struct.unpack_from("<QI", data)
+        return cls(bits, hashes, data[12:])
+
+
+class SiteBinWriter:
+    """
+    Writes the sites of a single bin of a contig as ORC, a row per vcf
+    record with its ALT alleles, INFO/AC, INFO/AN and variant type
+    """
+
+    def __init__(self, vcf_location, contig, bin):
+        self.key = bin_key(vcf_location, contig, bin)
+        self.body = io.BytesIO()
+        self.writer = pyorc.Writer(
+            self.body,
+            SITE_SCHEMA,
+            compression=pyorc.CompressionKind.ZSTD,
+            row_index_stride=ROW_INDEX_STRIDE,
+        )
+
+    def write(self, position, reference, alts, alt_counts, total_count, variant_type):
+        self.writer.write(
+            (position, reference, alts, alt_counts, total_count, variant_type)
+        )
+
+    def close(self):
+        self.writer.close()
+        s3.put_object(
+            Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+            Key=self.key,
+            Body=self.body.getvalue(),
+        )
+
+
+def pack_rows(rows):
+    """Packs a (rows, samples) matrix of values below 4 into 2 bits each"""
+    samples = rows.shape[1]
+    padded = np.zeros((rows.shape[0], -(-samples // 4) * 4), dtype=np.uint8)
+    padded[:, :samples] = rows
+    quads = padded.reshape(rows.shape[0], -1, 4)
+    return quads[:, :, 0] | quads[:, :, 1] << 2 | quads[:, :, 2] << 4 | quads[:, :, 3] << 6
+
+
+def select_samples(packed, sample_indexes):
+    """(rows, samples) values of sample_indexes, read from packed rows"""
+    shifts = ((sample_indexes & 3) << 1).astype(np.uint8)
+    return packed[:, sample_indexes >> 2] >> shifts & 3
+
+
+class GenotypeBinWriter:
+    """
+    Writes the genotypes of a single bin of a contig, for every record the
+    called alleles of each sample, then the copies of each ALT, as rows of
+    2 bit values. See GenotypeBin for the layout.
+    """
+
+    def __init__(self, vcf_location, contig, bin, sample_count):
+        self.key = genotype_key(vcf_location, contig, bin)
+        self.sample_count = sample_count
+        self.record_hashes = array("Q")
+        self.first_rows = array("I", [0])
+        self.rows = []
+
+    def write(self, position, reference, alts, matrix):
+        """matrix is the (samples, ploidy) allele matrix of the record"""
+        copies = matrix[:, :, np.newaxis] == np.arange(1, len(alts) + 1)
+        rows = np.vstack(
+            [np.count_nonzero(matrix >= 0, axis=1), copies.sum(axis=1).T]
+        )
+        self.rows.append(pack_rows(np.minimum(rows, GENOTYPE_MAX_COPIES)))
+        self.record_hashes.append(allele_hash(position, reference, ",".join(alts)))
+        self.first_rows.append(self.first_rows[-1] + len(rows))
+
+    def close(self):
+        header = GENOTYPE_HEADER.pack(
+            GENOTYPE_MAGIC,
+            self.sample_count,
+            len(self.record_hashes),
+            self.first_rows[-1],
+        )
+        s3.put_object(
+            Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+            Key=self.key,
+            Body=b"".join(
+                [
+                    header,
+                    self.record_hashes.tobytes(),
+                    self.first_rows.tobytes(),
+                    *(rows.tobytes() for rows in self.rows),
+                ]
+            ),
+        )
+
+
+class GenotypeBin:
+    """
+    Genotypes of a bin written by GenotypeBinWriter, read through
+    read(offset, size) such as ranged gets of the object. Laid out as
+        header      magic, samples, records, rows
+        uint64      hash of POS:REF:ALT of each record
+        uint32      first row of each record, and the number of rows
+        uint8       rows of 2 bit values, 4 samples per byte
+    """
+
+    def __init__(self, read):
+        magic, samples, records, rows = GENOTYPE_HEADER.unpack(
+            read(0, GENOTYPE_HEADER.size)
+        )
+        if magic != GENOTYPE_MAGIC:
+            raise ValueError("Not a genotype sidecar bin")
+        self.sample_count = samples
+        self.row_bytes = -(-samples // 4)
+        index = read(GENOTYPE_HEADER.size, records * 12 + 4)
+        record_hashes = np.frombuffer(index, np.uint64, records)
+        self.first_rows = np.frombuffer(index, np.uint32, records + 1, records * 8)
+        self.records = dict(zip(record_hashes.tolist(), range(records)))
+        self.matrix_offset = GENOTYPE_HEADER.size + len(index)
+        self.read = read
+
+    def rows(self, position, reference, alts):
+        """Packed rows of a record, None when it is not in the bin"""
+        record = self.records.get(allele_hash(position, reference, ",".join(alts)))
+        if record is None:
+            return None
+        first, last = self.first_rows[record : record + 2].tolist()
+        data = self.read(
+            self.matrix_offset + first * self.row_bytes, (last - first) * self.row_bytes
+        )
+        return np.frombuffer(data, np.uint8).reshape(last - first, self.row_bytes)
+
+
+def save_genotype_samples(vcf_location, samples):
+    """Sample names of the columns of the genotype sidecar"""
+    s3.put_object(
+        Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+        Key=genotype_samples_key(vcf_location),
+        Body=json.dumps(samples),
+    )
+
+
+def save_bloom(vcf_location, contig, bloom):
+    s3.put_object(
+        Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+        Key=bloom_key(vcf_location, contig),
+        Body=bloom.to_bytes(),
+    )
+
+
+def save_manifest(vcf_location, manifest):
+    """
+    Written with status "partial" when summarising starts, then "complete"
+    once every bin is or "failed", so an index is never read half built
+    """
+    s3.put_object(
+        Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+        Key=manifest_key(vcf_location),
+        Body=json.dumps(manifest),
+    )
+
+
+def save_checkpoint(vcf_location, contig, checkpoint):
+    """Progress of summarising contig, see summariseVcf"""
+    s3.put_object(
+        Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+        Key=checkpoint_key(vcf_location, contig),
+        Body=json.dumps(checkpoint),
+    )
+
+
+def save_allele_hashes(vcf_location, contig, allele_hashes):
+    """Alleles of the bloom filter of a contig summarised in part"""
+    s3.put_object(
+        Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+        Key=allele_hashes_key(vcf_location, contig),
+        Body=allele_hashes.tobytes(),
+    )
+
+
+def load_checkpoint(vcf_location, contig, run):
+    """Checkpoint of contig saved by run, None without one"""
+    try:
+        body = s3.get_object(
+            Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+            Key=checkpoint_key(vcf_location, contig),
+        )["Body"].read()
+    except botocore.exceptions.ClientError:
+        return None
+    checkpoint = json.loads(body)
+    return checkpoint if checkpoint["run"] == run else None
+
+
+def load_allele_hashes(vcf_location, contig):
+    body = s3.get_object(
+        Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+        Key=allele_hashes_key(vcf_location, contig),
+    )["Body"].read()
+    return array("Q", body)
+
+
+class SiteIndexes:
+    """
+    Manifests and bloom filters of the site indexes, cached per container.
+    An index is only used while the ETag of the vcf is the one it was built
+    from, its counts only when every record of the vcf had INFO/AC and
+    INFO/AN.
+    """
+
+    def __init__(
+        self,
+        bloom_cache_max_bytes=BLOOM_CACHE_MAX_BYTES,
+        manifest_cache_entries=MANIFEST_CACHE_ENTRIES,
+    ):
+        self.lock = threading.Lock()
+        # vcf -> complete manifest, least recently used first
+        self.manifests = OrderedDict()
+        self.manifest_cache_entries = manifest_cache_entries
+        # (vcf, etag, contig) -> BloomFilter, least recently used first
+        self.blooms = OrderedDict()
+        self.bloom_cache_bytes = 0
+        self.bloom_cache_max_bytes = bloom_cache_max_bytes
+
+    def _load(self, vcf_location):
+        bucket, key = parse_s3_url(vcf_location)
+        try:
+            etag = s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+        except botocore.exceptions.ClientError as error:
+            print(f"Unable to read ETag of {vcf_location}\n", error)
+            return None
+
+        with self.lock:
+            manifest = self.manifests.get(vcf_location)
+            if manifest is not None:
+                self.manifests.move_to_end(vcf_location)
+        if manifest is not None and manifest["etag"] == etag:
+            return manifest
+
+        try:
+            body = s3.get_object(
+                Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+                Key=manifest_key(vcf_location),
+            )["Body"].read()
+            manifest = json.loads(body)
+        except botocore.exceptions.ClientError:
+            return None
+        if manifest["etag"] != etag:
+            return None
+        # manifests written before summarising was checkpointed are complete,
+        # others are read again until they are
+        if (status := manifest.get("status", "complete")) != "complete":
+            print(f"Site index of {vcf_location} is {status}")
+            return None
+
+        with self.lock:
+            self.manifests[vcf_location] = manifest
+            self.manifests.move_to_end(vcf_location)
+            while len(self.manifests) > self.manifest_cache_entries:
+                self.manifests.popitem(last=False)
+        return manifest
+
+    def load(self, vcf_locations):
+        """Manifests of the up to date indexes of vcf_locations, by vcf"""
+        manifests = executor.map(self._load, vcf_locations)
+        return {
+            vcf: manifest
+            for vcf, manifest in zip(vcf_locations, manifests)
+            if manifest is not None
+        }
+
+    def bloom(self, vcf_location, manifest, contig):
+        """Bloom filter of the alleles of contig, None without one"""
+        if contig not in manifest.get("blooms", []):
+            return None
+        key = (vcf_location, manifest["etag"], contig)
+        with self.lock:
+            if key in self.blooms:
+                self.blooms.move_to_end(key)
+                return self.blooms[key]
+
+        try:
+            body = s3.get_object(
+                Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+                Key=bloom_key(vcf_location, contig),
+            )["Body"].read()
+        except botocore.exceptions.ClientError as error:
+            print(f"Unable to read bloom filter of {vcf_location} {contig}\n", error)
+            return None
+        bloom = BloomFilter.from_bytes(body)
+
+        with self.lock:
+            if key not in self.blooms:
+                self.blooms[key] = bloom
+                self.bloom_cache_bytes += len(bloom.body)
+            while self.bloom_cache_bytes > self.bloom_cache_max_bytes and self.blooms:
+                _, evicted = self.blooms.popitem(last=False)
+                self.bloom_cache_bytes -= len(evicted.body)
+        return bloom
+
+    def may_contain(self, vcf_location, manifest, contig, positions, reference, alt):
+        """False only when no allele reference>alt starts at positions"""
+        bloom = self.bloom(vcf_location, manifest, contig)
+        if bloom is None:
+            return True
+        return any(
+            allele_hash(position, reference, alt) in bloom for position in positions
+        )
+
+
+def _read_bin(vcf_location, contig, bin, start, end):
+    try:
+        body = s3.get_object(
+            Bucket=ENV_ATHENA.ATHENA_METADATA_BUCKET,
+            Key=bin_key(vcf_location, contig, bin),
+        )["Body"].read()
+    except botocore.exceptions.ClientError as error:
+        print(f"Unable to read sites of {vcf_location} {contig}:{bin}\n", error)
+        raise
+    position = PredicateColumn(pyorc.TypeKind.INT, "pos")
+    reader = pyorc.Reader(
+        io.BytesIO(body), predicate=(position >= start) & (position <= end)
+    )
+    return [row for row in reader if start <= row[0] <= end]
+
+
+class SiteCounts:
+    """
+    INFO/AC and INFO/AN of the records of a vcf read from its site index,
+    which holds them even for records lacking them in the vcf. Bins are read
+    whole on first use.
+    """
+
+    def __init__(self, vcf_location, manifest):
+        self.vcf_location = vcf_location
+        self.manifest = manifest
+        # (contig, bin) -> (pos, ref, alts) -> (ac, an)
+        self.bins = dict()
+
+    def counts(self, contig, position, reference, alts):
+        """(alt_counts, total_count), None for counts the index lacks"""
+        key = (contig, position // BIN_BASES)
+        if key not in self.bins:
+            bin = key[1]
+            rows = []
+            if bin in self.manifest["bins"].get(contig, []):
+                rows = _read_bin(
+                    self.vcf_location,
+                    contig,
+                    bin,
+                    bin * BIN_BASES,
+                    (bin + 1) * BIN_BASES - 1,
+                )
+            self.bins[key] = {
+                (pos, ref, tuple(alt)): (ac, an) for pos, ref, alt, ac, an, _ in rows
+            }
+        return self.bins[key].get((position, reference, tuple(alts)), (None, None))
+
+
+def query_site_index(
+    vcf_location,
+    manifest,
+    contig,
+    start,
+    end,
+    reference_bases,
+    match,
+    boolean=False,
+    include_details=True,
+):
+    """
+    Same counts as a performQuery payload of the single region
+    contig:start-end, read from the site index. Returns (exists, call_count,
+    all_alleles_count, variants). Like performQuery, records are no longer
+    counted once a hit answers a boolean query or a query without details,
+    so those counts are only comparable when the payloads also covered the
+    range in a single region.
+    """
+    bins = set(manifest["bins"].get(contig, []))
+    rows = executor.map(
+        lambda bin: _read_bin(vcf_location, contig, bin, start, end),
+        [
+            bin
+            for bin in range(start // BIN_BASES, end // BIN_BASES + 1)
+            if bin in bins
+        ],
+    )
+    call_count = 0
+    all_alleles_count = 0
+    variants = []
+
+    for position, reference, alts, alt_counts, total_count, variant_type in (
+        row for bin_rows in rows for row in bin_rows
+    ):
+        if reference.upper() != reference_bases and reference_bases != "N":
+            continue
+        hit_indexes = [i for i, alt in enumerate(alts) if match(reference, alt)]
+        if not hit_indexes:
+            continue
+        # ["Chr1 123 A G SNP"]
+        variants += [
+            f"{contig}\t{position}\t{reference}\t{alts[i]}\t{variant_type}"
+            for i in hit_indexes
+            if alt_counts[i] != 0
+        ]
+        call_count += sum(alt_counts[i] for i in hit_indexes)
+        # without details performQuery leaves out the AN of the first hit
+        if call_count and not include_details:
+            break
+        all_alleles_count += total_count
+        if call_count and boolean:
+            break
+
+    return call_count > 0, call_count, all_alleles_count, variants
+
+
+site_indexes = SiteIndexes()
@@ -0,0 +1,242 @@
+import gzip
+import struct
+
+
+TBI_MAGIC = b"TBI\x01"
+CSI_MAGIC = b"CSI\x01"
+# tabix indexes are a CSI index with fixed parameters
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+
+def bin_first(level):
+    return ((1 << (3 * level)) - 1) // 7
+
+
+def bin_parent(bin):
+    return (bin - 1) >> 3
+
+
+def reg2bins(beg, end, min_shift, depth):
+    """
+    Bins overlapping the 0-based half open interval [beg, end)
+    port of reg2bins from htslib/hts.c
+    """
+    if beg >= end:
+        return []
+    shift = min_shift + depth * 3
+    end = min(end, 1 << shift) - 1
+    bins = []
+    offset = 0
+
+    for level in range(depth + 1):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+        shift -= 3
+        offset += 1 << (level * 3)
+
+    return bins
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def read(self, size):
+        value = self.data[self.pos : self.pos + size]
+        self.pos += size
+        return value
+
+
+class ContigIndex:
+    def __init__(self):
+        # bin -> list of (begin, end) virtual offsets
+        self.bins = {}
+        # bin -> smallest virtual offset of the bin (CSI only)
+        self.loffsets = {}
+        # virtual offset of the first record in each 16 kbp window (TBI only)
+        self.linear = []
+        # compressed offset past the last record, computed on first use
+        self.end_offset = None
+        # records of the contig, from the pseudo bin when the index has one
+        self.mapped = None
+
+
+class TabixIndex:
+    """
+    In memory representation of a tabix (.tbi) or CSI (.csi) index of a
+    bgzipped VCF. Used to resolve genomic regions to BGZF virtual offsets
+    without going through htslib.
+    """
+
+    def __init__(self, min_shift, depth, names, contigs):
+        self.min_shift = min_shift
+        self.depth = depth
+        self.names = names
+        self.contigs = dict(zip(names, contigs))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as index_file:
+            return cls.parse(index_file.read())
+
+    @classmethod
+    def parse(cls, data):
+        # both formats are BGZF compressed, which is valid multi-member gzip
+        reader = _Reader(gzip.decompress(data))
+        magic = reader.read(4)
+
+        if magic == TBI_MAGIC:
+            min_shift, depth, is_csi = TBI_MIN_SHIFT, TBI_DEPTH, False
+            n_ref, *_, l_nm = reader.unpack("<8i")
+            names = cls._parse_names(reader.read(l_nm))
+        elif magic == CSI_MAGIC:
+            min_shift, depth, l_aux = reader.unpack("<3i")
+            is_csi = True
+            aux = _Reader(reader.read(l_aux))
+            *_, l_nm = aux.unpack("<7i")
+            names = cls._parse_names(aux.read(l_nm))
+            (n_ref,) = reader.unpack("<i")
+        else:
+            raise ValueError("Not a tabix or CSI index")
+
+        pseudo_bin = bin_first(depth + 1) + 1
+        contigs = []
+
+        for _ in range(n_ref):
+            contig = ContigIndex()
+            (n_bin,) = reader.unpack("<i")
+            for _ in range(n_bin):
+                if is_csi:
+                    bin, loffset, n_chunk = reader.unpack("<IQi")
+                else:
+                    bin, n_chunk = reader.unpack("<Ii")
+                chunks = reader.unpack(f"<{2 * n_chunk}Q")
+                # pseudo bin holds mapped/unmapped counts, not offsets
+                if bin == pseudo_bin:
+                    if n_chunk == 2:
+                        contig.mapped = chunks[2]
+                    continue
+                contig.bins[bin] = list(zip(chunks[::2], chunks[1::2]))
+                if is_csi:
+                    contig.loffsets[bin] = loffset
+            if not is_csi:
+                (n_intv,) = reader.unpack("<i")
+                contig.linear = list(reader.unpack(f"<{n_intv}Q"))
+            contigs.append(contig)
+
+        return cls(min_shift, depth, names, contigs)
+
+    @staticmethod
+    def _parse_names(data):
+        return [name.decode() for name in data.split(b"\x00") if name]
+
+    def min_offset(self, contig, beg):
+        index = self.contigs[contig]
+
+        if index.linear:
+            window = beg >> self.min_shift
+            return index.linear[min(window, len(index.linear) - 1)]
+
+        bin = bin_first(self.depth) + (beg >> self.min_shift)
+        while bin > 0:
+            if bin in index.loffsets:
+                return index.loffsets[bin]
+            bin = bin_parent(bin)
+        return index.loffsets.get(0, 0)
+
+    def end_offset(self, contig):
+        """Compressed offset just past the last record of contig"""
+        index = self.contigs[contig]
+        # split planning asks for it once per window of a region
+        if index.end_offset is None:
+            index.end_offset = max(
+                (
+                    chunk_end
+                    for chunks in index.bins.values()
+                    for _, chunk_end in chunks
+                ),
+                default=0,
+            ) >> 16
+        return index.end_offset
+
+    def bin_span(self, bin):
+        """0-based half open interval of the bases of bin"""
+        level = 0
+        while level < self.depth and bin >= bin_first(level + 1):
+            level += 1
+        shift = self.min_shift + 3 * (self.depth - level)
+        beg = (bin - bin_first(level)) << shift
+        return beg, beg + (1 << shift)
+
+    def bounds(self, contig):
+        """
+        1-based first and last positions the records of contig may start at,
+        None without records. Bounds are exact to a window for most records,
+        those spanning several windows are indexed in larger bins.
+        """
+        index = self.contigs[contig]
+        if not index.bins:
+            return None
+        spans = [self.bin_span(bin) for bin in index.bins]
+        first = min(beg for beg, _ in spans) + 1
+        last = max(end for _, end in spans)
+        # every record starts before the end of the last window
+        if index.linear:
+            last = min(last, len(index.linear) << self.min_shift)
+        return first, last
+
+    def contig_bytes(self, contig):
+        """Compressed bytes of the records of contig"""
+        first_offset = min(
+            (
+                chunk_beg
+                for chunks in self.contigs[contig].bins.values()
+                for chunk_beg, _ in chunks
+            ),
+            default=0,
+        )
+        return self.end_offset(contig) - (first_offset >> 16)
+
+    def compressed_offset(self, contig, pos):
+        """
+        Compressed offset of the BGZF block holding the first record at or
+        after the 1-based pos, used to estimate the bytes of a region
+        """
+        index = self.contigs[contig]
+        beg = max(pos - 1, 0)
+        if index.linear and beg >> self.min_shift >= len(index.linear):
+            return self.end_offset(contig)
+        return min(self.min_offset(contig, beg) >> 16, self.end_offset(contig))
+
+    def chunks(self, contig, start, end):
+        """
+        Merged (begin, end) virtual offsets of the chunks that may hold records
+        overlapping the 1-based closed interval [start, end]
+        """
+        if contig not in self.contigs:
+            return []
+        index = self.contigs[contig]
+        beg = max(start - 1, 0)
+        min_offset = self.min_offset(contig, beg)
+        chunks = sorted(
+            chunk
+            for bin in reg2bins(beg, end, self.min_shift, self.depth)
+            for chunk in index.bins.get(bin, [])
+            if chunk[1] > min_offset
+        )
+        merged = []
+
+        for chunk_beg, chunk_end in chunks:
+            chunk_beg = max(chunk_beg, min_offset)
+            if merged and chunk_beg <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+            else:
+                merged.append([chunk_beg, chunk_end])
+
+        return [tuple(chunk) for chunk in merged]
@@ -0,0 +1,106 @@
+from functools import lru_cache
+import re
+
+
+# symbolic alleles such as <DEL> or <CN2> are recognised by their prefix
+def is_symbolic(alt):
+    return alt.startswith("<")
+
+
+def compile_matcher(
+    alternate_bases="N",
+    variant_type=None,
+    variant_min_length=0,
+    variant_max_length=float("inf"),
+):
+    """
+    Builds the predicate deciding whether a single ALT allele of a record
+    with the given REF is a hit, once per query. The predicate is specialised
+    for the requested variant type and skips the length check when the
+    length is unbounded. Called as match(reference, alt).
+    """
+    if alternate_bases != "N":
+        matches = _alt_matcher(alternate_bases)
+    elif variant_type is not None:
+        matches = _type_matcher(variant_type)
+    else:
+        matches = None
+
+    if variant_min_length <= 0 and variant_max_length == float("inf"):
+        return matches or (lambda reference, alt: True)
+
+    def within_bounds(alt):
+        return variant_min_length <= len(alt) <= variant_max_length
+
+    if matches is None:
+        return lambda reference, alt: within_bounds(alt)
+    return lambda reference, alt: within_bounds(alt) and matches(reference, alt)
+
+
+def _alt_matcher(alternate_bases):
+    return lambda reference, alt: alt.upper() == alternate_bases
+
+
+def _type_matcher(variant_type):
+    prefix = f"<{variant_type}"
+
+    if variant_type == "DEL":
+
+        def matches(reference, alt):
+            if is_symbolic(alt):
+                return alt.startswith(prefix) or alt == "<CN0>"
+            return len(alt) < len(reference)
+
+    elif variant_type == "SNP":
+
+        def matches(reference, alt):
+            return len(alt) == len(reference)
+
+    elif variant_type == "INDEL":
+
+        def matches(reference, alt):
+            return len(alt) != len(reference)
+
+    elif variant_type == "INS":
+
+        def matches(reference, alt):
+            if is_symbolic(alt):
+                return alt.startswith(prefix)
+            return len(alt) > len(reference)
+
+    elif variant_type == "DUP":
+        duplication = _memo(lambda reference: re.compile(f"({reference}){{2,}}"))
+
+        def matches(reference, alt):
+            if is_symbolic(alt):
+                return alt.startswith(prefix) or (
+                    alt.startswith("<CN") and alt not in ("<CN0>", "<CN1>")
+                )
+            return duplication(reference).fullmatch(alt) is not None
+
+    elif variant_type == "DUP:TANDEM":
+
+        def matches(reference, alt):
+            if is_symbolic(alt):
+                return alt.startswith(prefix) or alt == "<CN2>"
+            return alt == reference + reference
+
+    elif variant_type == "CNV":
+        copies = _memo(lambda reference: re.compile(f"\\.|({reference})*"))
+
+        def matches(reference, alt):
+            if is_symbolic(alt):
+                return alt.startswith((prefix, "<CN", "<DEL", "<DUP"))
+            return copies(reference).fullmatch(alt) is not None
+
+    else:
+        # For structural variants that aren't otherwise recognisable
+        def matches(reference, alt):
+            return alt.startswith(prefix)
+
+    return matches
+
+
+def _memo(compile_pattern):
+    # the same REF recurs throughout a region, compile its pattern once
+    return lru_cache(maxsize=4096)(compile_pattern)
@@ -0,0 +1,38 @@
+# indexes of a vcf are looked up next to it, tabix first
+INDEX_SUFFIXES = (".tbi", ".csi")
+
+
+def parse_info(info):
+    """
+    AC, AN and the variant type of an INFO column. Note AC and AN cannot be
+    requested explicitly from bcftools query, as it fails when they are not
+    in the header.
+    """
+    alt_counts = None
+    total_count = None
+    variant_type = "N/A"
+
+    for field in info.split(";"):
+        if field.startswith("AC="):
+            alt_counts = [int(c) for c in field[3:].split(",")]
+        elif field.startswith("AN="):
+            total_count = int(field[3:])
+        elif field.startswith("VT="):
+            variant_type = field[3:]
+        elif field.startswith("SVTYPE=") and variant_type == "N/A":
+            variant_type = field[7:]
+
+    return alt_counts, total_count, variant_type
+
+
+def parse_header(header):
+    """Samples and INFO ids declared in the text of a vcf header"""
+    samples = []
+    info_ids = set()
+    for line in header.splitlines():
+        if line.startswith("##INFO=<ID="):
+            info_ids.add(line[11:].split(",", 1)[0])
+        elif line.startswith("#CHROM"):
+            samples = line.split("\t")[9:]
+            break
+    return samples, info_ids
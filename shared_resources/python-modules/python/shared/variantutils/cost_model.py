@@ -0,0 +1,121 @@
+import json
+import math
+import threading
+import time
+
+import boto3
+import botocore
+
+from shared.utils import ENV_ATHENA, ENV_CONFIG
+
+
+COST_MODEL_KEY = "variant-search/cost-model.json"
+# the persisted model is reloaded and saved at most this often per container
+COST_MODEL_REFRESH_SECONDS = 60
+# weight of the persisted observations each time new ones are merged in
+COST_MODEL_DECAY = 0.95
+# seconds per payload and per splitQuery invocation, used until calibrated
+DEFAULT_PAYLOAD_LATENCY = 0.05
+DEFAULT_INVOCATION_OVERHEAD = 0.05
+# observations needed before the fitted values are trusted
+MIN_OBSERVATIONS = 20
+
+
+s3 = boto3.client("s3")
+
+
+class CostModel:
+    """
+    Latency model of a variant search fanned out as P splitQuery invocations
+    of N/P payloads each;
+
+        T(P) = payload_latency * N / P + invocation_overhead * P
+
+    Each completed invocation is observed as (payloads, seconds) and the two
+    coefficients are the least squares fit of seconds = overhead + latency *
+    payloads. Sums of the fit are persisted per deployment in the metadata
+    bucket, decayed as new observations arrive so the model follows changes
+    in the data and the lambda configuration.
+    """
+
+    def __init__(self, bucket, key=COST_MODEL_KEY):
+        self.bucket = bucket
+        self.key = key
+        self.lock = threading.Lock()
+        # sums over observations: count, x, y, x^2, x*y
+        self.sums = [0.0] * 5
+        # observations of this container that are not persisted yet
+        self.pending = [0.0] * 5
+        self.refreshed = 0
+
+    def _load(self):
+        try:
+            body = s3.get_object(Bucket=self.bucket, Key=self.key)["Body"].read()
+            return json.loads(body)["sums"]
+        except (botocore.exceptions.ClientError, KeyError, ValueError) as e:
+            print("Using default cost model\n", e)
+            return [0.0] * 5
+
+    def refresh(self):
+        """Merges pending observations into the persisted model"""
+        if time.time() - self.refreshed < COST_MODEL_REFRESH_SECONDS:
+            return
+        self.refreshed = time.time()
+        stored = self._load()
+
+        with self.lock:
+            pending, self.pending = self.pending, [0.0] * 5
+        merged = [
+            COST_MODEL_DECAY * old + new if pending[0] else old
+            for old, new in zip(stored, pending)
+        ]
+
+        if pending[0]:
+            try:
+                s3.put_object(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    Body=json.dumps({"sums": merged, "updated": self.refreshed}),
+                )
+            except botocore.exceptions.ClientError as e:
+                print("Unable to save cost model\n", e)
+        with self.lock:
+            self.sums = [total + new for total, new in zip(merged, self.pending)]
+
+    def observe(self, payloads, seconds):
+        observation = [1, payloads, seconds, payloads * payloads, payloads * seconds]
+        with self.lock:
+            self.pending = [a + b for a, b in zip(self.pending, observation)]
+            self.sums = [a + b for a, b in zip(self.sums, observation)]
+
+    def coefficients(self):
+        """(payload_latency, invocation_overhead) in seconds"""
+        with self.lock:
+            n, x, y, xx, xy = self.sums
+        denominator = n * xx - x * x
+        if n < MIN_OBSERVATIONS or denominator <= 1e-9:
+            return DEFAULT_PAYLOAD_LATENCY, DEFAULT_INVOCATION_OVERHEAD
+
+        latency = (n * xy - x * y) / denominator
+        overhead = (y - latency * x) / n
+        # a noisy fit must not turn the optimum upside down
+        return max(latency, 1e-3), max(overhead, 1e-3)
+
+    def parallelism(self, payloads, ceiling=None):
+        """
+        Number of splitQuery invocations minimising T(P), the closed form
+        P = sqrt(latency * N / overhead). It is kept below the concurrency
+        ceiling, otherwise splitQuery invocations would take the concurrency
+        performQuery needs and the search would stall.
+        """
+        if ceiling is None:
+            ceiling = ENV_CONFIG.CONFIG_VARIANT_SEARCH_MAX_CONCURRENCY
+        latency, overhead = self.coefficients()
+        best = math.sqrt(latency * payloads / overhead)
+        return max(1, min(round(best), payloads, ceiling))
+
+    def chunk_size(self, payloads, ceiling=None):
+        return max(1, math.ceil(payloads / self.parallelism(payloads, ceiling)))
+
+
+cost_model = CostModel(ENV_ATHENA.ATHENA_METADATA_BUCKET)
@@ -1,76 +1,106 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from typing import Generator, List
 import os
 import json
 import math
-import gzip
-import base64
+import uuid
 
 import boto3
-import jsons
 
+from shared.apiutils.requests import Granularity
 from shared.utils import get_matching_chromosome
-from shared.payloads import PerformQueryResponse
-from shared.utils import LambdaClient
+from shared.payloads import PerformQueryResponse, decode_responses, encode_chunk
+from shared.utils import (
+    AsyncLambdaClient,
+    ENV_CONFIG,
+    compile_matcher,
+    lambda_limiter,
+    resolve_spilled,
+)
+from shared.utils.site_index import query_site_index, site_indexes
+from shared.dynamodb import cancel_query
+from .cost_model import cost_model
+from .split_planner import (
+    SPLIT_TARGET_BYTES,
+    bytes_per_base,
+    describe_plan,
+    load_indexes,
+    load_summaries,
+    outside_span,
+    plan_splits,
+)
 
 
 SPLIT_QUERY_LAMBDA = os.environ["SPLIT_QUERY_LAMBDA"]
-SPLIT_SIZE = 20000
-THREADS = 200
+# adjacent splits of a vcf without a readable index are read by a single
+# performQuery invocation while they span fewer bases than this
+BATCH_BASES = 100000
+# synchronous invocations accept up to 6 MB of payload
+MAX_CHUNK_BYTES = 5 * 1024 * 1024
+# site index lookups in parallel
+THREADS = 32
+# exact allele queries over more start positions are not checked against
+# the bloom filters
+BLOOM_MAX_POSITIONS = 1000
 
 
 s3 = boto3.client("s3")
-aws_lambda = LambdaClient()
+aws_lambda = AsyncLambdaClient()
+executor = ThreadPoolExecutor(THREADS)
 
 
-def fan_out(payload: List[dict]):
-    # stringified payload
-    payload_str = json.dumps(payload)
+def encode_chunks(chunks: List[List[dict]]):
+    """
+    Returns the chunks with their encoding, halving those too large for an
+    invocation, e.g. with long sample lists of many datasets
+    """
+    encoded = []
+    for chunk in chunks:
+        payload_str = encode_chunk(chunk)
+        if len(payload_str) > MAX_CHUNK_BYTES and len(chunk) > 1:
+            half = len(chunk) // 2
+            encoded += encode_chunks([chunk[:half], chunk[half:]])
+        else:
+            encoded.append((chunk, payload_str))
+    return encoded
 
-    # compress if larger than 100 kb
-    if len(payload_str) > 100 * 1024:
-        payload_str = json.dumps(
-            base64.b64encode(gzip.compress(payload_str.encode())).decode()
-        )
 
-    response = aws_lambda.invoke(
-        FunctionName=SPLIT_QUERY_LAMBDA,
-        InvocationType="RequestResponse",
-        Payload=payload_str,
-    )
+def parse_responses(response: bytes):
     parsed = None
     try:
-        parsed = json.loads(response["Payload"].read())
-        parsed = jsons.default_list_deserializer(parsed, List[PerformQueryResponse])
+        # large responses are returned as pointers to the metadata bucket
+        parsed = resolve_spilled(json.loads(response))
+        parsed = list(decode_responses(parsed))
     except Exception as e:
         print(parsed, e)
         raise e
     return parsed
 
 
-def f_cost(N, P):
-    return 0.05 * N / P + 0.05 * P
-
-
-def df_cost(N, P):
-    return -0.05 * N / (P**2) + 0.05
-
+def batch_splits(splits):
+    """
+    Groups adjacent splits while their combined expected work is small, by
+    estimated compressed bytes when the index was read, otherwise by bases
+    """
+    if all(split.estimated_bytes is not None for split in splits):
+        budget = SPLIT_TARGET_BYTES
+        expected_work = lambda split: split.estimated_bytes
+    else:
+        budget = BATCH_BASES
+        expected_work = lambda split: split.end - split.start + 1
+    batches = []
+    batch_work = 0
 
-# adding scipy will be a huge overhead on lambda layers
-# this finds P such that cost is nil
-# compared to newton method, this seems a faster alternative
-def best_parallelism(N):
-    chosen = 1
-    best_cost = float("inf")
-    # This range must be smaller than total available concurrency
-    # otherwise the pipeline will hang without enough lambdas to continue
-    # TODO make 800 an env variable
-    for P in range(1, 800):
-        if (cost := f_cost(N, P)) < best_cost:
-            best_cost = cost
-            chosen = P
+    for split in splits:
+        work = expected_work(split)
+        if batches and batch_work + work <= budget:
+            batches[-1].append(split)
+            batch_work += work
+        else:
+            batches.append([split])
+            batch_work = work
 
-    return chosen
+    return batches
 
 
 def perform_variant_search(
@@ -86,7 +116,7 @@ def perform_variant_search(
     variant_max_length=-1,
     requested_granularity="boolean",
     include_datasets="ALL",
-    query_id="TEST",
+    query_id=None,
     dataset_samples=[],
     include_samples=False,
 ) -> Generator[PerformQueryResponse, None, None]:
@@ -115,11 +145,80 @@ def perform_variant_search(
         print("Error occured ", e)
         return False, []
 
+    # keys the cancellation flag polled by splitQuery and performQuery
+    query_id = query_id or uuid.uuid4().hex
     start_min += 1
     start_max += 1
     end_min += 1
     end_max += 1
     payloads = []
+    site_lookups = []
+    # splits of each scanned vcf, logged once for the whole query
+    planned = []
+    # contig spans profiled at submission rule out vcfs without records in
+    # the queried positions
+    vcf_summaries = load_summaries(
+        [vcf for vcf, chrom in vcf_chromosomes.items() if chrom]
+    )
+    outside = outside_span(vcf_summaries, vcf_chromosomes, start_min, start_max)
+    print(f"VCF summaries ruled out {len(outside)} of {len(vcf_summaries)} VCFs")
+    for vcf in outside:
+        vcf_chromosomes[vcf] = None
+    # a single allele over a few positions can be ruled out by bloom filters
+    exact_allele = (
+        reference_bases not in (None, "N")
+        and alternate_bases not in (None, "N")
+        and start_max - start_min < BLOOM_MAX_POSITIONS
+    )
+    counts_only = requested_granularity in (Granularity.BOOLEAN, Granularity.COUNT)
+    if ENV_CONFIG.CONFIG_VARIANT_SEARCH_SITE_INDEX and (exact_allele or counts_only):
+        site_manifests = site_indexes.load(
+            [vcf for vcf, chrom in vcf_chromosomes.items() if chrom]
+        )
+    else:
+        site_manifests = {}
+
+    if exact_allele and site_manifests:
+        may_contain = executor.map(
+            lambda vcf: site_indexes.may_contain(
+                vcf,
+                site_manifests[vcf],
+                vcf_chromosomes[vcf],
+                range(start_min, start_max + 1),
+                reference_bases,
+                alternate_bases,
+            ),
+            list(site_manifests),
+        )
+        pruned = [
+            vcf for vcf, found in zip(list(site_manifests), may_contain) if not found
+        ]
+        print(f"Bloom filters ruled out {len(pruned)} of {len(site_manifests)} VCFs")
+        # datasets left without a vcf send no payloads at all
+        for vcf in pruned:
+            vcf_chromosomes[vcf] = None
+
+    # existence and counts over all samples of a vcf are read from its site
+    # index when it has AC and AN, record and sample level queries scan the vcf
+    site_manifests = {
+        vcf: manifest
+        for vcf, manifest in site_manifests.items()
+        if counts_only and manifest["counts"] and vcf_chromosomes[vcf]
+    }
+    # splits are sized from the summary of a vcf, its index is only fetched
+    # for vcfs without a usable summary
+    densities = {
+        vcf: bytes_per_base(vcf_summaries.get(vcf), chrom)
+        for vcf, chrom in vcf_chromosomes.items()
+        if chrom
+    }
+    indexes = load_indexes(
+        [
+            vcf
+            for vcf, density in densities.items()
+            if density is None and vcf not in site_manifests
+        ]
+    )
 
     # parallelism across datasets
     for n, dataset in enumerate(datasets):
@@ -129,12 +228,26 @@ def perform_variant_search(
             if vcf_chromosomes[vcf]
         }
 
-        split_start = start_min
+        for vcf_location, chrom in vcf_locations.items():
+            if vcf_location in site_manifests and not (
+                dataset_samples and dataset_samples[n]
+            ):
+                site_lookups.append((dataset.id, vcf_location, chrom))
+                continue
+            density = densities[vcf_location]
+            if density is None and vcf_location not in indexes:
+                indexes.update(load_indexes([vcf_location]))
+            # regions of roughly equal compressed bytes
+            splits = plan_splits(
+                indexes.get(vcf_location),
+                chrom,
+                start_min,
+                start_max,
+                bytes_per_base=density,
+            )
+            planned.append(splits)
 
-        while split_start <= start_max:
-            # TODO improve SPLIT_SIZE - make dynamic
-            split_end = min(split_start + SPLIT_SIZE - 1, start_max)
-            for vcf_location, chrom in vcf_locations.items():
+            for batch in batch_splits(splits):
                 payload = {
                     "query_id": query_id,
                     "dataset_id": dataset.id,
@@ -148,30 +261,96 @@ def perform_variant_search(
                     "variant_max_length": variant_max_length,
                     "include_details": include_datasets in ("HIT", "ALL"),
                     "include_samples": include_samples,
-                    "region": f"{chrom}:{split_start}-{split_end}",
+                    "regions": [f"{chrom}:{split.start}-{split.end}" for split in batch],
                     "variant_type": variant_type,
                     "requested_granularity": requested_granularity,
+                    # see shared.payloads.compact_responses
+                    "response_encoding": "columnar",
                 }
                 payloads.append(payload)
-            # next split
-            split_start += SPLIT_SIZE
+
+    print(
+        describe_plan(len(planned), [split for splits in planned for split in splits])
+    )
+
+    if site_lookups:
+        print(f"Reading {len(site_lookups)} VCFs from their site index")
+        match = compile_matcher(
+            alternate_bases or "N",
+            variant_type,
+            variant_min_length,
+            variant_max_length if variant_max_length >= 0 else float("inf"),
+        )
+        # the response of a single region over the queried positions, the
+        # split payloads of a scan stop early per region, so counts of
+        # boolean queries or queries without details may differ from a scan,
+        # their existence does not
+        results = executor.map(
+            lambda lookup: query_site_index(
+                lookup[1],
+                site_manifests[lookup[1]],
+                lookup[2],
+                start_min,
+                start_max,
+                reference_bases or "N",
+                match,
+                boolean=requested_granularity == Granularity.BOOLEAN,
+                include_details=include_datasets in ("HIT", "ALL"),
+            ),
+            site_lookups,
+        )
+        for (dataset_id, _, _), (exists, call_count, all_alleles_count, variants) in zip(
+            site_lookups, results
+        ):
+            yield PerformQueryResponse(
+                dataset_id=dataset_id,
+                exists=exists,
+                all_alleles_count=all_alleles_count,
+                variants=variants,
+                call_count=call_count,
+                sample_names=[],
+            )
+    if not payloads:
+        return
 
     print("Start: event publishing")
-    # TODO further split by sample counts to avoid payload overflow
-    chunk_size = best_parallelism(len(payloads))
+    cost_model.refresh()
+    latency, overhead = cost_model.coefficients()
+    print(f"COST MODEL - PAYLOAD LATENCY - {latency:.4f}s OVERHEAD - {overhead:.4f}s")
+    chunk_size = cost_model.chunk_size(len(payloads))
     print(
         f"PAYLOADS - {len(payloads)} CHUNK SIZE - {chunk_size} NO CHUNKS - {math.ceil(len(payloads)/chunk_size)}"
     )
-    executor = ThreadPoolExecutor(THREADS)
-    futures = [
-        executor.submit(fan_out, payloads[itr : itr + chunk_size])
-        for itr in range(0, len(payloads), chunk_size)
-    ]
+    encoded_chunks = encode_chunks(
+        [payloads[itr : itr + chunk_size] for itr in range(0, len(payloads), chunk_size)]
+    )
+    chunks = [chunk for chunk, _ in encoded_chunks]
+    # every chunk is in flight at once, the cost model keeps their number
+    # below CONFIG_VARIANT_SEARCH_MAX_CONCURRENCY
+    responses = aws_lambda.stream(
+        SPLIT_QUERY_LAMBDA,
+        [payload_str for _, payload_str in encoded_chunks],
+        concurrency=ENV_CONFIG.CONFIG_VARIANT_SEARCH_MAX_CONCURRENCY,
+    )
+    remaining = len(chunks)
 
-    for future in as_completed(futures):
-        yield from future.result()
+    try:
+        for n, response, seconds in responses:
+            remaining -= 1
+            # calibrates the fan out of later searches
+            cost_model.observe(len(chunks[n]), seconds)
+            yield from parse_responses(response)
+    finally:
+        responses.close()
+        lambda_limiter.log_metrics()
+        # the caller stopped early, e.g. once a boolean answer is known
+        if remaining:
+            print(f"Cancelling query {query_id}")
+            try:
+                cancel_query(query_id)
+            except Exception as e:
+                print("Unable to cancel query\n", e)
 
-    # No need to executor.shutdown() the executor at this point, it'd be an unwatned code line
     print("End: retrieved results")
 
 
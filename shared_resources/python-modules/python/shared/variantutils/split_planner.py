@@ -0,0 +1,267 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import math
+import time
+
+import boto3
+import botocore
+from pynamodb.exceptions import PynamoDBException
+
+from shared.dynamodb import SummaryStatus, VcfSummary
+from shared.utils import ENV_CONFIG, parse_s3_url
+from shared.utils.tabix_index import TabixIndex
+from shared.utils.vcf_text import INDEX_SUFFIXES
+
+
+# used when neither the summary nor the index of a vcf can be read
+SPLIT_SIZE = 20000
+# compressed bytes of vcf read by a single performQuery invocation
+SPLIT_TARGET_BYTES = ENV_CONFIG.CONFIG_VARIANT_SEARCH_SPLIT_BYTES
+# a stale index only affects the plan, never the results of a query
+INDEX_CACHE_SECONDS = 15 * 60
+# indexes are only fetched for vcfs without a summary
+INDEX_CACHE_ENTRIES = 64
+# summaries are small, enough for every vcf of the largest datasets
+SUMMARY_CACHE_ENTRIES = 16384
+THREADS = 32
+
+
+s3 = boto3.client("s3")
+# vcf location -> (expiry, TabixIndex or None)
+indexes = OrderedDict()
+# vcf location -> (expiry, VcfSummary or None)
+summaries = OrderedDict()
+
+Split = namedtuple("Split", ["start", "end", "estimated_bytes"])
+
+
+def fetch_index(vcf_location):
+    bucket, key = parse_s3_url(vcf_location)
+    if bucket is None:
+        return None
+
+    for suffix in INDEX_SUFFIXES:
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key + suffix)
+        except botocore.exceptions.ClientError:
+            continue
+        try:
+            return TabixIndex.parse(response["Body"].read())
+        except Exception as e:
+            print(f"Unable to parse index of {vcf_location}\n", e)
+            return None
+
+    print(f"No readable index found for {vcf_location}")
+    return None
+
+
+def get_index(vcf_location):
+    """Parsed index of vcf_location, None if it is unavailable"""
+    now = time.time()
+    if (entry := indexes.get(vcf_location)) is not None and entry[0] > now:
+        indexes.move_to_end(vcf_location)
+        return entry[1]
+
+    index = fetch_index(vcf_location)
+    indexes[vcf_location] = (now + INDEX_CACHE_SECONDS, index)
+    indexes.move_to_end(vcf_location)
+    while len(indexes) > INDEX_CACHE_ENTRIES:
+        indexes.popitem(last=False)
+    return index
+
+
+def load_indexes(vcf_locations):
+    """Fetches the indexes of several vcfs in parallel"""
+    with ThreadPoolExecutor(THREADS) as executor:
+        return dict(zip(vcf_locations, executor.map(get_index, vcf_locations)))
+
+
+def load_summaries(vcf_locations):
+    """
+    VcfSummary of each vcf, None for those never summarised, still pending
+    or that failed to be. Summaries are cached like the indexes, a stale one
+    only matters once checked against the ETag of its vcf.
+    """
+    now = time.time()
+    loaded = dict()
+    missing = []
+    for vcf_location in vcf_locations:
+        if (entry := summaries.get(vcf_location)) is not None and entry[0] > now:
+            summaries.move_to_end(vcf_location)
+            loaded[vcf_location] = entry[1]
+        else:
+            missing.append(vcf_location)
+    if not missing:
+        return loaded
+
+    try:
+        found = {
+            summary.vcfLocation: summary for summary in VcfSummary.batch_get(missing)
+        }
+    except PynamoDBException as e:
+        print("Unable to read vcf summaries\n", e)
+        return {**loaded, **{vcf_location: None for vcf_location in missing}}
+
+    unusable = [
+        vcf_location
+        for vcf_location, summary in found.items()
+        if summary.status in (SummaryStatus.PENDING, SummaryStatus.FAILED)
+    ]
+    if unusable:
+        print(f"Unable to use pending or failed summaries of {len(unusable)} vcfs")
+    for vcf_location in unusable:
+        del found[vcf_location]
+    for vcf_location in missing:
+        loaded[vcf_location] = found.get(vcf_location)
+        summaries[vcf_location] = (now + INDEX_CACHE_SECONDS, loaded[vcf_location])
+        summaries.move_to_end(vcf_location)
+    while len(summaries) > SUMMARY_CACHE_ENTRIES:
+        summaries.popitem(last=False)
+    return loaded
+
+
+def get_etag(vcf_location):
+    bucket, key = parse_s3_url(vcf_location)
+    try:
+        return s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+    except botocore.exceptions.ClientError as error:
+        print(f"Unable to read ETag of {vcf_location}\n", error)
+        return None
+
+
+def outside_span(vcf_summaries, vcf_chromosomes, start, end):
+    """
+    Vcfs without records starting within [start, end] of their chromosome,
+    by their summaries. Only summaries of the current version of a vcf are
+    trusted, their ETags are checked in parallel. Summaries read from the
+    index only bound the records, never excluding a vcf with records in
+    range.
+    """
+    candidates = [
+        vcf_location
+        for vcf_location, summary in vcf_summaries.items()
+        if summary is not None
+        and vcf_chromosomes[vcf_location]
+        and (
+            (contig := summary.contig(vcf_chromosomes[vcf_location])) is None
+            or contig.maxPosition < start
+            or contig.minPosition > end
+        )
+    ]
+    with ThreadPoolExecutor(THREADS) as executor:
+        etags = executor.map(get_etag, candidates)
+    return [
+        vcf_location
+        for vcf_location, etag in zip(candidates, etags)
+        if etag == vcf_summaries[vcf_location].etag
+    ]
+
+
+def bytes_per_base(summary, chromosome):
+    """Compressed bytes of vcf per base of chromosome, None if unknown"""
+    if summary is None or (contig := summary.contig(chromosome)) is None:
+        return None
+    # the index cannot resolve bytes within a single block
+    if contig.compressedBytes:
+        contig_bytes = contig.compressedBytes
+    elif contig.recordCount and summary.recordCount:
+        # records of the contig share the bytes of the vcf
+        contig_bytes = summary.vcfBytes * contig.recordCount / summary.recordCount
+    else:
+        return None
+    return contig_bytes / (contig.maxPosition - contig.minPosition + 1)
+
+
+def fixed_splits(start, end, bytes_per_base=None, target_bytes=SPLIT_TARGET_BYTES):
+    if bytes_per_base is None:
+        return [
+            Split(split_start, min(split_start + SPLIT_SIZE - 1, end), None)
+            for split_start in range(start, end + 1, SPLIT_SIZE)
+        ]
+    # the density of records in the summary of the vcf sizes the splits
+    split_size = max(1, int(target_bytes / bytes_per_base))
+    return [
+        Split(
+            split_start,
+            split_end := min(split_start + split_size - 1, end),
+            int((split_end - split_start + 1) * bytes_per_base),
+        )
+        for split_start in range(start, end + 1, split_size)
+    ]
+
+
+def plan_splits(
+    index,
+    chromosome,
+    start,
+    end,
+    target_bytes=SPLIT_TARGET_BYTES,
+    bytes_per_base=None,
+):
+    """
+    Splits the 1-based closed interval [start, end] into regions of roughly
+    target_bytes compressed bytes each, sized by bytes_per_base from the
+    summary of the vcf when known. Otherwise they are estimated from the
+    index and aligned to its windows (16 kbp for tabix), except when a
+    single window is larger than the target, in which case it is split
+    evenly by bases.
+    """
+    if start > end:
+        return []
+    if (
+        bytes_per_base is not None
+        or index is None
+        or chromosome not in index.contigs
+    ):
+        return fixed_splits(start, end, bytes_per_base, target_bytes)
+
+    window = 1 << index.min_shift
+    split_start = start
+    split_offset = index.compressed_offset(chromosome, start)
+    splits = []
+
+    # first base of the next window
+    boundary = (start - 1) // window * window + window + 1
+    while boundary <= end:
+        # offsets of a csi index are not strictly increasing
+        offset = max(index.compressed_offset(chromosome, boundary), split_offset)
+        if offset - split_offset >= target_bytes:
+            splits.append(Split(split_start, boundary - 1, offset - split_offset))
+            split_start, split_offset = boundary, offset
+        boundary += window
+    # the linear index cannot resolve bytes within a single window
+    splits.append(Split(split_start, end, chunk_bytes(index, chromosome, split_start, end)))
+
+    return [piece for split in splits for piece in subdivide(split, target_bytes)]
+
+
+def chunk_bytes(index, chromosome, start, end):
+    return sum(
+        (chunk_end >> 16) - (chunk_beg >> 16)
+        for chunk_beg, chunk_end in index.chunks(chromosome, start, end)
+    )
+
+
+def subdivide(split, target_bytes):
+    pieces = math.ceil(split.estimated_bytes / target_bytes)
+    bases = split.end - split.start + 1
+    if pieces <= 1 or bases < pieces:
+        return [split]
+
+    return [
+        Split(
+            split.start + n * bases // pieces,
+            split.start + (n + 1) * bases // pieces - 1,
+            split.estimated_bytes // pieces,
+        )
+        for n in range(pieces)
+    ]
+
+
+def describe_plan(vcf_count, splits):
+    """Single line summary of the splits planned for vcf_count vcfs"""
+    known = [split.estimated_bytes for split in splits if split.estimated_bytes is not None]
+    return (
+        f"PLAN - VCFS - {vcf_count} REGIONS - {len(splits)} "
+        f"ESTIMATED BYTES - {sum(known) if known else 'unknown'}"
+    )
@@ -227,6 +227,42 @@ variable "config-max-variant-search-base-range" {
   default     = 10000
 }
 
+variable "config-variant-search-split-bytes" {
+  type        = number
+  description = "Compressed VCF bytes read by a single variant search worker"
+  default     = 4194304
+}
+
+variable "config-variant-search-max-concurrency" {
+  type        = number
+  description = "Max concurrent splitQuery invocations of a variant search, must be below the account lambda concurrency"
+  default     = 800
+}
+
+variable "config-variant-search-hedge-percentile" {
+  type        = number
+  description = "Latency percentile of recent performQuery invocations after which a duplicate invocation is sent, 0 disables hedging"
+  default     = 95
+}
+
+variable "config-variant-search-fanout-width" {
+  type        = number
+  description = "Max performQuery payloads invoked by a single splitQuery, larger chunks are delegated to further splitQuery invocations"
+  default     = 200
+}
+
+variable "config-variant-search-site-index" {
+  type        = bool
+  description = "Summarise submitted VCFs into a site index answering boolean and count variant queries without scanning the VCFs, see docs/INGESTION-GUIDE.md"
+  default     = false
+}
+
+variable "config-variant-search-genotype-sidecar" {
+  type        = bool
+  description = "Also store the genotypes of summarised VCFs as 2 bit packed matrices, read instead of the VCFs by sample restricted and record level variant queries, needs config-variant-search-site-index"
+  default     = false
+}
+
 # OPENAI config
 variable "azure-openai-api-key" {
   type        = string